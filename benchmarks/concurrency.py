@@ -0,0 +1,66 @@
+"""Concurrency benchmark for the read endpoints.
+
+Fires batches of concurrent GET requests at a running API server and reports
+throughput and latency percentiles. Run it once against the server started from
+the old sync routes and once against the async routes to compare.
+
+    uvicorn cmms.api:app --workers 1
+    python benchmarks/concurrency.py --url http://127.0.0.1:8000 --plan-id 1
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import httpx
+
+
+def percentile(values: list, percent: float) -> float:
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))
+    return values[index]
+
+
+async def run_endpoint(client: httpx.AsyncClient, path: str, requests: int, concurrency: int) -> dict:
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch() -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.get(path)
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(fetch() for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "path": path,
+        "requests": requests,
+        "concurrency": concurrency,
+        "requests_per_second": requests / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+async def main(url: str, plan_id: int, requests: int, concurrency: int) -> None:
+    paths = ["/equipment/", f"/maintenance_plan/{plan_id}", "/maintenance_plan/"]
+    async with httpx.AsyncClient(base_url=url, timeout=None) as client:
+        for path in paths:
+            result = await run_endpoint(client, path, requests, concurrency)
+            print(
+                f"{result['path']:<30} {result['requests']} requests @ {result['concurrency']} concurrent: "
+                f"{result['requests_per_second']:.1f} req/s, p50 {result['p50_ms']:.1f} ms, p99 {result['p99_ms']:.1f} ms"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--plan-id", type=int, default=1)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args.url, args.plan_id, args.requests, args.concurrency))
@@ -0,0 +1,61 @@
+"""Cold import time benchmark.
+
+Runs an import statement in fresh interpreters and reports the median wall time,
+plus the slowest top level imports from python -X importtime.
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --statement "import cmms.models" --repeat 20
+
+The default statement builds the API app the way uvicorn does, so it measures worker cold start.
+
+Run it from the repository root, before and after a change, on the same machine.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+def import_once(statement: str) -> tuple[float, str]:
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", statement], capture_output=True, text=True, env=os.environ)
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise SystemExit(result.stderr)
+    return elapsed, result.stderr
+
+
+def slowest_imports(importtime_output: str, count: int) -> list[tuple[int, str]]:
+    """Returns the cumulative time in microseconds of the slowest top level packages imported."""
+    packages = {}
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        top_level = name.strip().split(".")[0]
+        packages[top_level] = max(packages.get(top_level, 0), int(cumulative.strip()))
+    return sorted(((microseconds, name) for name, microseconds in packages.items()), reverse=True)[:count]
+
+
+def main(statement: str, repeat: int, top: int) -> None:
+    timings = []
+    output = ""
+    for _ in range(repeat):
+        elapsed, output = import_once(statement)
+        timings.append(elapsed)
+
+    print(f"{statement}: median {statistics.median(timings) * 1000:.0f} ms, min {min(timings) * 1000:.0f} ms over {repeat} runs (includes interpreter start)")
+    print("Slowest imports of the last run:")
+    for microseconds, name in slowest_imports(output, top):
+        print(f"  {microseconds / 1000:8.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--statement", default="from cmms.api import app")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+    main(args.statement, args.repeat, args.top)
@@ -0,0 +1,84 @@
+"""Login storm benchmark.
+
+Measures the latency of an unrelated GET endpoint on its own, then again while a burst of
+concurrent logins runs, the way a shift change hits the API. With bcrypt on the event loop the
+probe requests wait for every hash, with bcrypt on the worker pool they should barely move.
+
+    uvicorn cmms.api:app --workers 1
+    python benchmarks/login_storm.py --url http://127.0.0.1:8000 --logins 200
+
+The user must exist, the default admin user is used unless --username and --password are given.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import httpx
+
+
+def percentile(values: list, percent: float) -> float:
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))
+    return values[index]
+
+
+async def probe(client: httpx.AsyncClient, path: str, stop: asyncio.Event, latencies: list, interval: float) -> None:
+    """Requests path one at a time until stop is set."""
+    while not stop.is_set():
+        start = time.perf_counter()
+        response = await client.get(path)
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(interval)
+
+
+async def login(client: httpx.AsyncClient, username: str, password: str, latencies: list) -> None:
+    start = time.perf_counter()
+    response = await client.post("/auth/token", data={"username": username, "password": password})
+    response.raise_for_status()
+    latencies.append(time.perf_counter() - start)
+
+
+def report(label: str, latencies: list) -> None:
+    print(f"{label:<28} {len(latencies):>5} requests, p50 {statistics.median(latencies) * 1000:7.1f} ms, p99 {percentile(latencies, 99) * 1000:7.1f} ms, max {max(latencies) * 1000:7.1f} ms")
+
+
+async def main(url: str, path: str, username: str, password: str, logins: int, baseline_seconds: float, interval: float) -> None:
+    limits = httpx.Limits(max_connections=logins + 10)
+    async with httpx.AsyncClient(base_url=url, timeout=None, limits=limits) as client:
+        await login(client, username, password, [])
+
+        baseline = []
+        stop = asyncio.Event()
+        task = asyncio.create_task(probe(client, path, stop, baseline, interval))
+        await asyncio.sleep(baseline_seconds)
+        stop.set()
+        await task
+
+        during = []
+        login_latencies = []
+        stop = asyncio.Event()
+        task = asyncio.create_task(probe(client, path, stop, during, interval))
+        start = time.perf_counter()
+        await asyncio.gather(*(login(client, username, password, login_latencies) for _ in range(logins)))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await task
+
+    report(f"GET {path} idle", baseline)
+    report(f"GET {path} during storm", during)
+    report(f"{logins} logins", login_latencies)
+    print(f"Storm took {elapsed:.2f} s, {logins / elapsed:.1f} logins/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--path", default="/equipment_type/", help="Unrelated endpoint probed during the storm.")
+    parser.add_argument("--username", default="admin")
+    parser.add_argument("--password", default="admin")
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--baseline-seconds", type=float, default=3.0)
+    parser.add_argument("--interval", type=float, default=0.01, help="Pause between probe requests in seconds.")
+    args = parser.parse_args()
+    asyncio.run(main(args.url, args.path, args.username, args.password, args.logins, args.baseline_seconds, args.interval))
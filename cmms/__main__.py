@@ -0,0 +1,128 @@
+"""Command line tools.
+
+    python -m cmms migrate          Applies pending schema migrations and loads the default data.
+    python -m cmms version          Prints the database and code schema versions.
+    python -m cmms export-blobs     Moves file and image content from the database to the blob store.
+    python -m cmms thumbnails       Builds the missing thumbnails of the stored images.
+    python -m cmms gc-attachments   Deletes the files and images nothing refers to anymore.
+"""
+import argparse
+import sys
+
+
+def migrate_command(args: argparse.Namespace) -> int:
+    from cmms.database import engine
+    from cmms.defaultdata import load_default_data
+    from cmms.migrations import migrate
+
+    version = migrate(engine)
+    if not args.skip_default_data:
+        load_default_data()
+    print(f"Database is at schema version {version}.")
+    return 0
+
+
+def version_command(args: argparse.Namespace) -> int:
+    from cmms.database import engine
+    from cmms.migrations import SCHEMA_VERSION, get_version
+
+    with engine.connect() as connection:
+        version = get_version(connection)
+    print(f"Database schema version {version}, code schema version {SCHEMA_VERSION}.")
+    return 0 if version == SCHEMA_VERSION else 1
+
+
+def export_blobs_command(args: argparse.Namespace) -> int:
+    from cmms.database import engine
+    from cmms.migrations import export_blobs
+
+    def progress(table: str, rows: int, size: int) -> None:
+        print(f"{table}: {rows} rows, {size / 1024 / 1024:.1f} MiB exported.")
+
+    exported = export_blobs(engine, args.batch_size, progress)
+    for table, (rows, size) in exported.items():
+        print(f"{table}: {rows} rows, {size} bytes moved to the blob store.")
+    return 0
+
+
+def thumbnails_command(args: argparse.Namespace) -> int:
+    from cmms import config, thumbnails
+    from cmms.database import engine
+
+    if args.workers:
+        config.THUMBNAIL_WORKERS = args.workers
+
+    def progress(result: thumbnails.BackfillResult) -> None:
+        print(f"{result.images} images, {result.failed} failed, {result.images_per_second:.1f} images/s, {result.read_megabytes_per_second:.1f} MiB/s read.")
+
+    try:
+        result = thumbnails.backfill(engine, args.batch_size, progress)
+    finally:
+        thumbnails.shutdown()
+    print(
+        f"Checked {result.images} images in {result.seconds:.1f} s ({result.images_per_second:.1f} images/s), "
+        f"wrote {result.written_bytes} bytes of thumbnails, {result.failed} could not be read as images."
+    )
+    return 0
+
+
+def gc_attachments_command(args: argparse.Namespace) -> int:
+    from datetime import timedelta
+    from cmms.attachmentgc import CollectResult, collect
+    from cmms.database import engine
+
+    def progress(result: CollectResult) -> None:
+        print(f"{result.table}: {result.rows} rows, {result.notes} notes, {result.blobs} blobs, {result.reclaimed_bytes / 1024 / 1024:.1f} MiB.")
+
+    results = collect(engine, timedelta(hours=args.grace_hours), args.batch_size, args.pause, args.max_rows, args.dry_run, progress, not args.skip_store)
+    verb = "Would reclaim" if args.dry_run else "Reclaimed"
+    for result in results:
+        print(
+            f"{result.table}: {verb} {result.reclaimed_bytes} bytes, {result.blob_bytes} in {result.blobs} blobs and "
+            f"{result.database_bytes} in the database, from {result.rows} unreferenced rows and {result.notes} of their notes, "
+            f"and {result.temp_bytes} in {result.temp_files} temporary files."
+        )
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m cmms", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    migrate_parser = commands.add_parser("migrate", help="Apply pending schema migrations.")
+    migrate_parser.add_argument("--skip-default-data", action="store_true", help="Do not check the default data after migrating.")
+    migrate_parser.set_defaults(func=migrate_command)
+
+    version_parser = commands.add_parser("version", help="Print the schema versions, exits with 1 when they differ.")
+    version_parser.set_defaults(func=version_command)
+
+    export_blobs_parser = commands.add_parser("export-blobs", help="Move file and image content from the database to the blob store.")
+    export_blobs_parser.add_argument("--batch-size", type=int, default=50, help="Rows read and committed at a time.")
+    export_blobs_parser.set_defaults(func=export_blobs_command)
+
+    thumbnails_parser = commands.add_parser("thumbnails", help="Build the missing thumbnails of the stored images.")
+    thumbnails_parser.add_argument("--batch-size", type=int, default=200, help="Images handed to the workers at a time.")
+    thumbnails_parser.add_argument("--workers", type=int, help="Worker processes, THUMBNAIL_WORKERS by default.")
+    thumbnails_parser.set_defaults(func=thumbnails_command)
+
+    gc_parser = commands.add_parser("gc-attachments", help="Delete the files and images nothing refers to anymore.")
+    gc_parser.add_argument("--grace-hours", type=float, default=24, help="Keep rows and blobs younger than this, they may not be attached yet.")
+    gc_parser.add_argument("--batch-size", type=int, default=500, help="Rows deleted per transaction.")
+    gc_parser.add_argument("--pause", type=float, default=0.2, help="Seconds to sleep between batches.")
+    gc_parser.add_argument("--max-rows", type=int, help="Stop after deleting about this many rows per table.")
+    gc_parser.add_argument("--skip-store", action="store_true", help="Do not go through the blob store for blobs no row has.")
+    gc_parser.add_argument("--dry-run", action="store_true", help="Only report what would be deleted.")
+    gc_parser.set_defaults(func=gc_attachments_command)
+
+    return parser
+
+
+def main(argv: list = None) -> int:
+    args = build_parser().parse_args(argv)
+    from cmms.configlogging import configure_logging
+    configure_logging()
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,45 +1,70 @@
+"""The FastAPI application.
+
+The app and its routers are built on first access of cmms.api.app (uvicorn cmms.api:app),
+so importing cmms.api.schemas or another submodule does not import every router.
+"""
 import logging
-from sqlalchemy import create_engine
-import cmms
-from cmms.config import DATABASE_URL_WITHOUT_SCHEMA, SCHEMA_CREATE_STATEMENT
-from cmms.database import engine
-from cmms import models
-from cmms.api.extensions import app
-from cmms.api.routes import auth, equipment, user, equipmenttype, equipmentfailure, causeofequipmentfailure, maintenanceplan, location
-from cmms.defaultdata import load_default_data
 
 logger = logging.getLogger("api")
 
 
-app.include_router(causeofequipmentfailure.router)
-app.include_router(equipment.router)
-app.include_router(equipmentfailure.router)
-app.include_router(equipmenttype.router)
-app.include_router(location.router)
-app.include_router(maintenanceplan.router)
-app.include_router(auth.router)
-app.include_router(user.router)
+def create_app():
+    from cmms import config
+    from cmms.configlogging import configure_logging
+    from cmms.database import engine, async_engine
+    from cmms.api.extensions import app
+    from cmms.api.routes import admin, attachment, auth, equipment, user, equipmenttype, equipmentfailure, causeofequipmentfailure, maintenanceplan, location
+    from cmms.defaultdata import load_default_data
+    from cmms.migrations import migrate, check_version
+    from cmms import passwords, thumbnails
+    from cmms.loginlog import login_log_writer
+
+    configure_logging()
+
+    app.include_router(admin.router)
+    app.include_router(attachment.router)
+    app.include_router(causeofequipmentfailure.router)
+    app.include_router(equipment.router)
+    app.include_router(equipmentfailure.router)
+    app.include_router(equipmenttype.router)
+    app.include_router(location.router)
+    app.include_router(maintenanceplan.router)
+    app.include_router(auth.router)
+    app.include_router(user.router)
+
+
+    @app.on_event("startup")
+    async def startup_event():
+        logger.info("=" * 100)
+        logger.info("[SYSTEM] Starting API server.")
 
+        if config.MIGRATE_ON_STARTUP:
+            migrate(engine)
+            load_default_data()
+        else:
+            check_version(engine)
+        login_log_writer.start()
 
-@app.on_event("startup")
-async def startup_event():
-    logger.info("=" * 100)
-    logger.info("[SYSTEM] Starting API server.")
 
-    temp_engine = create_engine(DATABASE_URL_WITHOUT_SCHEMA)
-    with temp_engine.begin() as session:
-        session.execute(SCHEMA_CREATE_STATEMENT)
+    @app.on_event("shutdown")
+    async def shutdown_event():
+        logger.info("[SYSTEM] API server shutting down.")
+        await login_log_writer.stop()
+        await async_engine.dispose()
+        passwords.shutdown()
+        thumbnails.shutdown()
 
-    logger.info("[SYSTEM] Creating database tables.")
-    models.DeclarativeBase.metadata.create_all(bind=engine)
-    load_default_data()
 
+    @app.get("/")
+    def root():
+        return {"message": "Hello World."}
 
-@app.on_event("shutdown")
-async def shutdown_event():
-    logger.info("[SYSTEM] API server shutting down.")
+    return app
 
 
-@app.get("/")
-def root():
-    return {"message": "Hello World."}
\ No newline at end of file
+def __getattr__(name: str):
+    if name == "app":
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
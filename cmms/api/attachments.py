@@ -0,0 +1,281 @@
+"""Streaming attachment uploads and downloads.
+
+Starlette's request.form() spools every file part to a temporary file before the route runs, and
+storing it in the blob store would read and write it a second time. read_upload parses the
+multipart body as it arrives instead and feeds the file part to a BlobWriter, which hashes it
+while writing it to the store's staging folder. A request holds at most UPLOAD_BUFFER_SIZE bytes
+of the file at a time, whatever its size.
+
+BlobResponse sends stored content with support for single byte ranges, so video players can seek
+and interrupted downloads of large manuals can resume with Range and If-Range. The blob's key,
+its SHA-256 or the variant key of a thumbnail, is its strong ETag. When the server offers the ASGI
+zero-copy send extension the file is handed to it, otherwise it is read and sent in chunks.
+ColumnResponse does the same for content that has not been exported from the database yet,
+reading it a slice at a time with SUBSTR.
+"""
+from __future__ import annotations
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Optional
+from urllib.parse import quote
+from fastapi import HTTPException, Request, status
+from starlette.concurrency import run_in_threadpool
+from starlette.types import Receive, Scope, Send
+from starlette.responses import Response
+from python_multipart.multipart import MultipartParser, parse_options_header
+from cmms import config
+from cmms.blobstore import CHUNK_SIZE, BlobStore, BlobTooLargeError
+
+
+# File bytes buffered before they are handed to the BlobWriter in a worker thread.
+UPLOAD_BUFFER_SIZE = CHUNK_SIZE
+
+# Largest accepted value of a plain form field, like the note.
+MAX_FIELD_BYTES = 64 * 1024
+
+# Bytes read and sent at a time when the server has no zero-copy send.
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+
+# Bytes of a database column read per query by ColumnResponse.
+COLUMN_CHUNK_SIZE = CHUNK_SIZE
+
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+@dataclass
+class Upload:
+    sha256: str = None
+    size: int = 0
+    filename: str = None
+    content_type: str = None
+    fields: dict = field(default_factory=dict)
+
+
+def bad_request(detail: str) -> HTTPException:
+    return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detail)
+
+
+class UploadParser:
+    """Callbacks of python-multipart's MultipartParser for a form with one file part."""
+
+    def __init__(self, file_field: str):
+        self.file_field = file_field
+        self.upload = Upload()
+        self.buffer = bytearray()
+        self.in_file = False
+        self.error = None # type: Optional[HTTPException]
+        self._header_name = b""
+        self._header_value = b""
+        self._headers = {}
+        self._field_name = None
+        self._field_value = bytearray()
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+        }
+
+    def on_part_begin(self) -> None:
+        self._headers = {}
+        self._field_name = None
+        self._field_value = bytearray()
+
+    def on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def on_header_end(self) -> None:
+        self._headers[self._header_name.lower()] = self._header_value
+        self._header_name = b""
+        self._header_value = b""
+
+    def on_headers_finished(self) -> None:
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        name = options.get(b"name", b"").decode("utf-8", "replace")
+        if b"filename" not in options:
+            self._field_name = name
+            return
+        if name != self.file_field or self.upload.filename is not None:
+            self.error = self.error or bad_request(f"Send one file, in the '{self.file_field}' field.")
+            return
+        self.in_file = True
+        self.upload.filename = os.path.basename(options[b"filename"].decode("utf-8", "replace"))
+        content_type = self._headers.get(b"content-type")
+        self.upload.content_type = content_type.decode("latin-1") if content_type else None
+
+    def on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self.in_file:
+            self.buffer += data[start:end]
+        elif self._field_name is not None:
+            self._field_value += data[start:end]
+            if len(self._field_value) > MAX_FIELD_BYTES:
+                self.error = self.error or bad_request(f"Form field '{self._field_name}' is larger than {MAX_FIELD_BYTES} bytes.")
+                self._field_name = None
+
+    def on_part_end(self) -> None:
+        if self.in_file:
+            self.in_file = False
+        elif self._field_name is not None:
+            self.upload.fields[self._field_name] = self._field_value.decode("utf-8", "replace")
+
+
+async def read_upload(request: Request, store: BlobStore, file_field: str = "file") -> Upload:
+    """Stores the file part of a multipart/form-data request while the body arrives.
+
+    Raises:
+        HTTPException: 400 for a body that is not a form with one file, 413 for a file larger
+            than ATTACHMENT_MAX_UPLOAD_BYTES.
+    """
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in options:
+        raise bad_request("Expected a multipart/form-data body.")
+
+    parser = UploadParser(file_field)
+    multipart = MultipartParser(options[b"boundary"], parser.callbacks())
+    writer = await run_in_threadpool(store.writer, config.ATTACHMENT_MAX_UPLOAD_BYTES)
+    try:
+        async for chunk in request.stream():
+            multipart.write(chunk)
+            if parser.error:
+                raise parser.error
+            if len(parser.buffer) >= UPLOAD_BUFFER_SIZE:
+                data, parser.buffer = bytes(parser.buffer), bytearray()
+                await run_in_threadpool(writer.write, data)
+        multipart.finalize()
+        if parser.upload.filename is None:
+            raise bad_request(f"Send one file, in the '{file_field}' field.")
+        await run_in_threadpool(writer.write, bytes(parser.buffer))
+        parser.upload.sha256, parser.upload.size = await run_in_threadpool(writer.commit)
+    except BlobTooLargeError:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=f"Files are limited to {config.ATTACHMENT_MAX_UPLOAD_BYTES} bytes.")
+    finally:
+        await run_in_threadpool(writer.abort)
+    return parser.upload
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[tuple[int, int]]:
+    """Returns the first and last byte of a single byte range, None to send the whole content.
+
+    Several ranges are answered with the whole content, which RFC 9110 allows.
+
+    Raises:
+        HTTPException: 416 when the range starts past the end.
+    """
+    match = RANGE_PATTERN.match(header.strip()) if header else None
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if first and last and int(last) < int(first):
+        return None
+    if first == "":
+        first, last = max(size - int(last), 0), size - 1
+    else:
+        first, last = int(first), min(int(last), size - 1) if last else size - 1
+    if first > last or first >= size:
+        raise HTTPException(status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE, headers={"Content-Range": f"bytes */{size}"})
+    return first, last
+
+
+def content_disposition(filename: str) -> str:
+    return f"attachment; filename*=utf-8''{quote(filename)}"
+
+
+class RangeResponse(Response):
+    """Sends content of a known size, or a single byte range of it, see the module docstring.
+
+    Subclasses send the body in send_body, from self.first for self.count bytes.
+    """
+
+    def __init__(self, request: Request, size: int, media_type: str, filename: str = None, etag: str = None, headers: dict = None):
+        self.byte_range = None
+        if_range = request.headers.get("if-range")
+        if if_range is None or (etag is not None and if_range.strip() == etag):
+            self.byte_range = parse_range(request.headers.get("range"), size)
+
+        first, last = self.byte_range or (0, size - 1)
+        super().__init__(status_code=status.HTTP_206_PARTIAL_CONTENT if self.byte_range else status.HTTP_200_OK, media_type=media_type, headers=headers)
+        self.headers["accept-ranges"] = "bytes"
+        if etag is not None:
+            self.headers["etag"] = etag
+        self.headers["content-length"] = str(last - first + 1)
+        if self.byte_range:
+            self.headers["content-range"] = f"bytes {first}-{last}/{size}"
+        if filename:
+            self.headers.setdefault("content-disposition", content_disposition(filename))
+        self.first = first
+        self.count = last - first + 1
+        self.send_header_only = request.method == "HEAD"
+
+    async def send_body(self, scope: Scope, send: Send) -> None:
+        raise NotImplementedError
+
+    async def send_chunks(self, send: Send, read: Callable[[int], Awaitable[bytes]], chunk_size: int) -> None:
+        """Sends self.count bytes, read chunk_size at a time. Content that ends early ends the body."""
+        remaining = self.count
+        while remaining:
+            chunk = await read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+        if remaining:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if self.send_header_only or self.count <= 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        await self.send_body(scope, send)
+
+
+class BlobResponse(RangeResponse):
+    """Sends a stored blob, or a byte range of it. The blob's key is its ETag."""
+
+    def __init__(self, request: Request, store: BlobStore, key: str, size: int, media_type: str, filename: str = None, headers: dict = None):
+        self.store = store
+        self.key = key
+        super().__init__(request, size, media_type, filename, f'"{key}"', headers)
+
+    async def send_body(self, scope: Scope, send: Send) -> None:
+        f = await run_in_threadpool(self.store.open, self.key)
+        try:
+            if "http.response.zerocopysend" in scope.get("extensions", {}):
+                await send({"type": "http.response.zerocopysend", "file": f.fileno(), "offset": self.first, "count": self.count, "more_body": False})
+                return
+            await run_in_threadpool(f.seek, self.first)
+            await self.send_chunks(send, lambda count: run_in_threadpool(f.read, count), DOWNLOAD_CHUNK_SIZE)
+        finally:
+            await run_in_threadpool(f.close)
+
+
+class ColumnResponse(RangeResponse):
+    """Sends content that is still in a database column, or a byte range of it, a COLUMN_CHUNK_SIZE
+    slice per query. read(offset, count) returns the slice, each query in its own short transaction,
+    so no connection is held while the client receives. There is no ETag, so If-Range always gets
+    the whole content.
+    """
+
+    def __init__(self, request: Request, read: Callable[[int, int], Awaitable[bytes]], size: int, media_type: str, filename: str = None, headers: dict = None):
+        self.read = read
+        super().__init__(request, size, media_type, filename, None, headers)
+
+    async def send_body(self, scope: Scope, send: Send) -> None:
+        offset = self.first
+
+        async def read(count: int) -> bytes:
+            nonlocal offset
+            chunk = await self.read(offset, count)
+            offset += len(chunk or b"")
+            return chunk
+
+        await self.send_chunks(send, read, COLUMN_CHUNK_SIZE)
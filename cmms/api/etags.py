@@ -0,0 +1,89 @@
+"""Weak ETags for the GET by id routes.
+
+The tag of a response is a hash of the values that change whenever the response would change:
+the object's id, date_modified and modified_by_user_id, plus the row count and newest
+date_modified of the children for tree responses, so adding, changing or removing a child
+changes the tag too. Routes compute the tag with one small aggregate query and answer a
+matching If-None-Match with 304 before loading the object:
+
+    not_modified = await etags.conditional(db, request, response, etags.audit_query(models.Equipment, id))
+    if not_modified:
+        return not_modified
+
+The query string is part of the tag, a response limited with ?fields= or ?expand= is a
+different representation of the same object.
+
+date_modified keeps microseconds, a DATETIME(6) on MySQL since schema version 6, so two writes
+in the same second give different tags. The tags are still weak, they are only as precise as
+the clocks of the processes writing date_modified, and writers that do not set it, like other
+programs writing the database directly, do not change them.
+
+Only the audit columns of the object and its children are part of a tag. Objects a response
+embeds through a foreign key, like created_by_user, modified_by_user or an activity's
+meter_unit, are not, so renaming a user or a meter unit does not change the tags of the objects
+that embed it.
+"""
+from __future__ import annotations
+import hashlib
+from typing import Optional
+from fastapi import Request, Response, status
+from sqlalchemy import select, true
+from sqlalchemy.sql import Select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+def make_etag(*parts) -> str:
+    digest = hashlib.blake2b("|".join(str(part) for part in parts).encode(), digest_size=12).hexdigest()
+    return f'W/"{digest}"'
+
+
+def matches(request: Request, etag: str) -> bool:
+    """Weak comparison of an If-None-Match header with a tag."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    opaque_tag = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque_tag for tag in header.split(","))
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+
+def audit_query(model, id: int) -> Select:
+    """The tag columns of one audited row."""
+    return select(model.id, model.date_modified, model.modified_by_user_id).where(model.id == id)
+
+
+def tree_query(model, id: int, children: Select) -> Select:
+    """The tag columns of one audited row and of its children.
+
+    children is a one row aggregate select, usually the count and newest date_modified of the children.
+    """
+    children = children.subquery()
+    return audit_query(model, id).add_columns(*children.c).join(children, true())
+
+
+async def query_etag(db: AsyncSession, query: Select, *variant) -> Optional[str]:
+    """Returns the tag of the query's first row and the variant parts, None when it returns no row."""
+    row = (await db.execute(query)).first()
+    if row is None:
+        return None
+    return make_etag(*row, *variant)
+
+
+async def conditional(db: AsyncSession, request: Request, response: Response, query: Select) -> Optional[Response]:
+    """Returns a 304 response when If-None-Match matches the tag of the query's first row.
+
+    Otherwise sets the ETag header on the route's response and returns None. Nothing is set when
+    the query returns no row, the route then answers 404 as usual.
+    """
+    etag = await query_etag(db, query, *sorted(request.query_params.multi_items()))
+    if etag is None:
+        return None
+    if matches(request, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
+    return None
@@ -0,0 +1,178 @@
+"""Sparse fieldsets for the read endpoints.
+
+?fields=id,name returns only the named fields of each object, id is always returned.
+?expand=created_by_user,activities.meter_unit names the relationships embedded in each object,
+dotted names reach into embedded objects and embed the objects on the way. Without ?expand every relationship is embedded, as
+before. A relationship is only embedded when ?fields, if given, names it too.
+
+Routes take the parameters like PageParams and pass them on to what they load and serialize:
+
+    @router.get("/", response_model=schemas.LocationListOut)
+    async def get_location(..., selection: FieldParams = Depends()):
+        query = select(models.Location).options(*load_options(models.Location, schemas.LocationOut, selection))
+
+Columns and relationships that were not asked for are not loaded from the database.
+"""
+from typing import Iterable, Optional, Tuple, Type
+from fastapi import HTTPException, Query, status
+from pydantic import BaseModel
+from sqlalchemy import inspect, select
+from sqlalchemy.orm import load_only, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.ext.asyncio import AsyncSession
+from cmms import models
+from cmms.api import schemas
+
+
+# The user relationships of AuditMixin.
+AUDIT_USERS = ("created_by_user", "modified_by_user")
+
+
+def parse_names(value: Optional[str]) -> Optional[set]:
+    if value is None:
+        return None
+    return {name.strip() for name in value.split(",") if name.strip()}
+
+
+def nested_schema(field) -> Optional[Type[BaseModel]]:
+    """Returns the schema of an embedded object or list field, None for plain values."""
+    if isinstance(field.type_, type) and issubclass(field.type_, BaseModel):
+        return field.type_
+    return None
+
+
+class FieldParams:
+    """Query parameters shared by the read endpoints, see the module docstring."""
+
+    def __init__(
+        self,
+        fields: Optional[str] = Query(None, description="Comma separated fields to return for each object, all when not given. 'id' is always returned."),
+        expand: Optional[str] = Query(None, description="Comma separated relationships to embed, like 'created_by_user' or 'activities.meter_unit'. All when not given, none when empty.")
+    ):
+        self.fields = parse_names(fields)
+        self.expand = parse_names(expand)
+
+    @classmethod
+    def every(cls) -> "FieldParams":
+        """The selection of a request without ?fields and ?expand."""
+        return cls(None, None)
+
+    def includes(self, name: str) -> bool:
+        return name == "id" or self.fields is None or name in self.fields
+
+    def expands(self, name: str) -> bool:
+        if self.fields is not None and name not in self.fields:
+            return False
+        return self.expand is None or any(path == name or path.startswith(name + ".") for path in self.expand)
+
+    def nested(self, name: str) -> "FieldParams":
+        """The selection for the objects embedded under name, they keep all their fields."""
+        selection = FieldParams.every()
+        if self.expand is not None:
+            prefix = name + "."
+            selection.expand = {path[len(prefix):] for path in self.expand if path.startswith(prefix)}
+        return selection
+
+    def check(self, schema: Type[BaseModel]) -> None:
+        """Raises 400 for names that are not fields or relationships of the schema."""
+        unknown = sorted(name for name in self.fields or () if name not in schema.__fields__)
+        for path in sorted(self.expand or ()):
+            current = schema
+            for name in path.split("."):
+                field = current.__fields__.get(name)
+                current = nested_schema(field) if field is not None else None
+                if current is None:
+                    unknown.append(path)
+                    break
+        if unknown:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unknown fields for {schema.__name__}: {', '.join(unknown)}.")
+
+
+def load_columns(model, schema: Type[BaseModel], selection: FieldParams) -> list:
+    """The columns of model to load for the selection, with the keys of the relationships it expands.
+
+    Raises 400 for a selection that does not fit the schema.
+    """
+    selection.check(schema)
+    mapper = inspect(model)
+    names = {"id"}
+    for name, field in schema.__fields__.items():
+        if name in mapper.relationships:
+            if selection.expands(name):
+                names.update(column.key for column in mapper.relationships[name].local_columns)
+        elif selection.includes(name):
+            names.add(name)
+    return [getattr(model, name) for name in mapper.column_attrs.keys() if name in names]
+
+
+def load_options(model, schema: Type[BaseModel], selection: FieldParams) -> list:
+    """Loader options for a select of model: only the selected columns, and one IN query per
+    expanded list relationship. Tree relationships (children of the same schema) are left to
+    the route's tree loader.
+    """
+    options = [load_only(*load_columns(model, schema, selection))]
+    mapper = inspect(model)
+    for name, field in schema.__fields__.items():
+        relationship = mapper.relationships.get(name)
+        if relationship is None or not relationship.uselist or nested_schema(field) is schema or not selection.expands(name):
+            continue
+        target = relationship.mapper.class_
+        nested = selection.nested(name)
+        loader = selectinload(getattr(model, name)).load_only(*load_columns(target, nested_schema(field), nested))
+        options.append(loader)
+    return options
+
+
+def dump(obj, schema: Type[BaseModel], selection: FieldParams) -> dict:
+    """Serializes an ORM object to plain data like schema would, limited to the selection.
+
+    Embedded lists of the same schema, the children of a tree, use the same selection.
+    Runs through run_sync when relationships may lazy load.
+    """
+    data = {}
+    for name, field in schema.__fields__.items():
+        nested = nested_schema(field)
+        if nested is None:
+            if selection.includes(name):
+                data[name] = getattr(obj, name)
+            continue
+        if not selection.expands(name):
+            continue
+        value = getattr(obj, name)
+        nested_selection = selection if nested is schema else selection.nested(name)
+        if value is None:
+            data[name] = None
+        elif isinstance(value, list):
+            data[name] = [dump(item, nested, nested_selection) for item in value]
+        else:
+            data[name] = dump(value, nested, nested_selection)
+    return data
+
+
+async def load_audit_users(db: AsyncSession, *groups: Tuple[Iterable, FieldParams]) -> None:
+    """Sets created_by_user and modified_by_user of audited objects from one IN query.
+
+    Every group is a list of objects and the selection they are dumped with, users a selection
+    does not expand are not loaded. Most rows were written by the same few users, so this is one
+    small query per response instead of a lazy load per distinct user, whatever the row count.
+    """
+    groups = [(list(items), [key for key in AUDIT_USERS if selection.expands(key)]) for items, selection in groups]
+    user_ids = {getattr(item, key + "_id") for items, keys in groups for item in items for key in keys}
+    user_ids.discard(None)
+    users = {}
+    if user_ids:
+        query = select(models.User).where(models.User.id.in_(user_ids)).options(load_only(*load_columns(models.User, schemas.UserOut, FieldParams.every())))
+        users = {user.id: user for user in (await db.execute(query)).scalars()}
+    for items, keys in groups:
+        for item in items:
+            for key in keys:
+                set_committed_value(item, key, users.get(getattr(item, key + "_id")))
+
+
+async def to_data(db: AsyncSession, schema: Type[BaseModel], obj, selection: FieldParams):
+    """dump inside the session's greenlet, like database.to_schema. The items of a page from paginate are dumped one by one."""
+    def run(_):
+        if isinstance(obj, dict):
+            return {**obj, "items": [dump(item, schema, selection) for item in obj["items"]]}
+        return dump(obj, schema, selection)
+    return await db.run_sync(run)
@@ -0,0 +1,70 @@
+import json
+import base64
+import binascii
+from typing import Optional
+from fastapi import HTTPException, Query, status
+from sqlalchemy.sql import Select
+from sqlalchemy.ext.asyncio import AsyncSession
+from cmms.config import DEFAULT_PAGE_LIMIT, MAX_PAGE_LIMIT
+
+
+def encode_cursor(last_id: int) -> str:
+    """Returns an opaque cursor pointing after the row with the given id."""
+    data = json.dumps({"id": last_id}).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    """Returns the id stored in a cursor made by encode_cursor."""
+    try:
+        padding = "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(cursor + padding))
+        return int(data["id"])
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid cursor: '{cursor}'.")
+
+
+class PageParams:
+    """Query parameters shared by every list endpoint."""
+
+    def __init__(
+        self,
+        limit: int = Query(DEFAULT_PAGE_LIMIT, ge=1, le=MAX_PAGE_LIMIT, description=f"Max number of items to return, up to {MAX_PAGE_LIMIT}."),
+        after: Optional[str] = Query(None, description="Cursor from 'next_cursor' of the previous page.")
+    ):
+        self.limit = limit
+        self.after = decode_cursor(after) if after else None
+
+
+def page_query(query: Select, model, page: PageParams) -> Select:
+    if page.after is not None:
+        query = query.filter(model.id > page.after)
+    return query.order_by(model.id).limit(page.limit + 1)
+
+
+def page_result(items: list, page: PageParams) -> dict:
+    next_cursor = None
+    if len(items) > page.limit:
+        items = items[:page.limit]
+        next_cursor = encode_cursor(items[-1].id)
+    return {"items": items, "next_cursor": next_cursor}
+
+
+async def paginate(db: AsyncSession, query: Select, model, page: PageParams) -> dict:
+    """Runs a select one page at a time, ordered by id.
+
+    The page starts after the cursor id, so the database seeks straight to it on the
+    primary key instead of counting past an offset. One extra row is fetched to know
+    if there is a next page.
+
+    Returns:
+        dict: {"items": [...], "next_cursor": str or None}
+    """
+    items = (await db.execute(page_query(query, model, page))).scalars().all()
+    return page_result(items, page)
+
+
+async def paginate_rows(db: AsyncSession, query: Select, model, page: PageParams) -> dict:
+    """Like paginate for a select of columns, the items are rows. The select must include the id column."""
+    items = (await db.execute(page_query(query, model, page))).all()
+    return page_result(items, page)
@@ -0,0 +1,117 @@
+"""Column level reads for the flat read endpoints.
+
+Validating a list response through an orm_mode schema builds a pydantic model per row and per
+nested user, and lazy loads created_by_user and modified_by_user for every row that is not in
+the identity map yet. A Projection selects exactly the columns a schema shows instead, with the
+to-one relationships it nests (the audit users, the classifications) outer joined into the same
+statement. The rows become plain dicts that orjson encodes directly:
+
+    projection = Projection(schemas.EquipmentOut, models.Equipment, selection)
+
+    query = projection.select().filter(models.Equipment.serial_number.ilike("%" + serial_number + "%"))
+    return render(await projection.page(db, query, page))
+
+With a FieldParams selection only the requested columns are selected and only the expanded
+relationships are joined.
+
+The schemas stay the response_model of the routes, they document the responses and are still
+used by the write routes. Relationships the schema nests as lists are not supported, routes
+returning them keep the ORM path.
+"""
+from __future__ import annotations
+from typing import Optional
+from fastapi import Response
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel
+from sqlalchemy import inspect, select
+from sqlalchemy.orm import aliased
+from sqlalchemy.sql import Select
+from sqlalchemy.ext.asyncio import AsyncSession
+from cmms.api.pagination import PageParams, paginate_rows
+from cmms.api.fieldsets import FieldParams
+
+
+# Headers of the route's injected response that are not carried over to the rendered response.
+SKIPPED_HEADERS = ("content-length", "content-type")
+
+
+class Projection:
+    """The columns of an orm_mode schema, read with one select.
+
+    Scalar fields must be columns of the model, nested schema fields must be to-one relationships.
+    A nested object is None when its row is missing, which is told by its id column being NULL.
+    """
+
+    def __init__(self, schema: type[BaseModel], model, selection: FieldParams = None):
+        self.schema = schema
+        self.model = model
+        selection = selection or FieldParams.every()
+        selection.check(schema)
+        mapper = inspect(model)
+
+        self._columns = []
+        self._keys = []
+        for name, field in schema.__fields__.items():
+            if name in mapper.relationships:
+                continue
+            if name not in mapper.column_attrs:
+                raise ValueError(f"{schema.__name__}.{name} is not a column of {model.__name__}.")
+            if not selection.includes(name):
+                continue
+            self._columns.append(getattr(model, name).label(name))
+            self._keys.append(name)
+
+        self._joins = []
+        self._nested = [] # type: list[tuple[str, list[str], int, int]]
+        for name, field in schema.__fields__.items():
+            if name not in mapper.relationships or not selection.expands(name):
+                continue
+            relationship = mapper.relationships[name]
+            if relationship.uselist or not (isinstance(field.type_, type) and issubclass(field.type_, BaseModel)):
+                raise ValueError(f"{schema.__name__}.{name} is not a to-one relationship of {model.__name__}.")
+            target = aliased(relationship.mapper.class_)
+            keys = list(field.type_.__fields__)
+            if "id" not in keys:
+                raise ValueError(f"{field.type_.__name__} needs an id field to be nested in a Projection.")
+            start = len(self._columns)
+            self._columns.extend(getattr(target, key).label(f"{name}__{key}") for key in keys)
+            self._joins.append((target, getattr(model, name).of_type(target)))
+            self._nested.append((name, keys, start, start + keys.index("id")))
+
+    def select(self) -> Select:
+        """Returns the select of the projected columns, filter it like a select of the model."""
+        query = select(*self._columns).select_from(self.model)
+        for target, on in self._joins:
+            query = query.outerjoin(target, on)
+        return query
+
+    def dict(self, row) -> dict:
+        data = dict(zip(self._keys, row))
+        for name, keys, start, id_index in self._nested:
+            data[name] = dict(zip(keys, row[start:start + len(keys)])) if row[id_index] is not None else None
+        return data
+
+    async def one(self, db: AsyncSession, id: int) -> Optional[dict]:
+        """Returns the projected row with the given id, None when it does not exist."""
+        row = (await db.execute(self.select().where(self.model.id == id))).first()
+        return self.dict(row) if row is not None else None
+
+    async def page(self, db: AsyncSession, query: Select, page: PageParams) -> dict:
+        """Runs a select of this projection one page at a time, see paginate."""
+        page_data = await paginate_rows(db, query, self.model, page)
+        page_data["items"] = [self.dict(row) for row in page_data["items"]]
+        return page_data
+
+
+def render(content, response: Response = None) -> ORJSONResponse:
+    """Encodes plain data with orjson.
+
+    Headers the route set on its injected response, like the ETag, are carried over because
+    FastAPI does not merge them into a response the route returns itself.
+    """
+    rendered = ORJSONResponse(content)
+    if response is not None:
+        for name, value in response.headers.items():
+            if name not in SKIPPED_HEADERS:
+                rendered.headers[name] = value
+    return rendered
@@ -0,0 +1,166 @@
+"""In process cache of rendered JSON responses for the catalog list and tree endpoints.
+
+Entries are keyed by path and sorted query parameters and tagged with the models the response
+was built from. The create, update and delete routes of a model invalidate its tag after
+committing. Entries also expire after RESPONSE_CACHE_TTL_SECONDS, which bounds how long changes
+made outside the API (the desktop program writes to the database directly) go unseen.
+Routes by id are not cached, their ETag is computed from the database on every request and a
+cached body could be older than it, the ETag and 304 answers of etags cover them.
+The cache holds at most RESPONSE_CACHE_MAX_BYTES of response bodies, least recently used
+entries are evicted first.
+
+A miss records the generation of every tag, which invalidate bumps, on request.state. put skips
+storing a body when a tag it is built from was invalidated since, so a request that read the
+database before a write committed does not cache the old body.
+
+    cached = response_cache.get(request)
+    if cached:
+        return cached
+    ...
+    return response_cache.put(request, response, await to_schema(db, schemas.EquipmentTypeListOut, page_data), tags=("equipment_type", "equipment_failure"))
+"""
+from __future__ import annotations
+import time
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Iterable, Optional
+from urllib.parse import urlencode
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from cmms import config
+
+
+# Headers set by the route on its injected response that are cached with the body.
+KEPT_HEADERS = ("etag",)
+
+
+@dataclass
+class CacheEntry:
+    body: bytes
+    headers: dict
+    tags: frozenset
+    created: float = field(default_factory=time.monotonic)
+
+
+class RouteStatistics:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def hit_rate(self) -> float:
+        requests = self.hits + self.misses
+        return self.hits / requests if requests else 0.0
+
+
+class ResponseCache:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # type: OrderedDict[str, CacheEntry]
+        self.size_bytes = 0
+        # Bumped by invalidate per tag, and for every tag by invalidating everything.
+        self._generations = {} # type: dict[str, int]
+        self._generation = 0
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.routes = {} # type: dict[str, RouteStatistics]
+            self.evictions = 0
+            self.invalidations = 0
+            self.stale_puts = 0
+
+    @staticmethod
+    def key(request: Request) -> str:
+        return f"{request.url.path}?{urlencode(sorted(request.query_params.multi_items()))}"
+
+    def _statistics(self, request: Request) -> RouteStatistics:
+        route = request.scope.get("route")
+        name = getattr(route, "path", request.url.path)
+        return self.routes.setdefault(name, RouteStatistics())
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self.size_bytes -= len(entry.body)
+
+    def get(self, request: Request) -> Optional[Response]:
+        """Returns the cached response for the request, None on a miss."""
+        key = self.key(request)
+        with self._lock:
+            statistics = self._statistics(request)
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry.created > config.RESPONSE_CACHE_TTL_SECONDS:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                statistics.misses += 1
+                request.state.response_cache_generations = (self._generation, dict(self._generations))
+                return None
+            self._entries.move_to_end(key)
+            statistics.hits += 1
+
+        return Response(content=entry.body, media_type="application/json", headers=entry.headers)
+
+    def put(self, request: Request, response: Response, content, tags: Iterable[str]) -> Response:
+        """Caches the body of a response under the given tags and returns the response.
+
+        content is either a rendered response or data, which is rendered like FastAPI would.
+        """
+        rendered = content if isinstance(content, Response) else JSONResponse(content=jsonable_encoder(content))
+        headers = {name: response.headers[name] for name in KEPT_HEADERS if response is not None and name in response.headers}
+        rendered.headers.update(headers)
+
+        body = rendered.body
+        if len(body) <= config.RESPONSE_CACHE_MAX_BYTES:
+            key = self.key(request)
+            generations = getattr(request.state, "response_cache_generations", None)
+            with self._lock:
+                if generations is not None and not self._unchanged(generations, tags):
+                    self.stale_puts += 1
+                    return rendered
+                if key in self._entries:
+                    self._remove(key)
+                self._entries[key] = CacheEntry(body, headers, frozenset(tags))
+                self.size_bytes += len(body)
+                while self.size_bytes > config.RESPONSE_CACHE_MAX_BYTES:
+                    self._remove(next(iter(self._entries)))
+                    self.evictions += 1
+        return rendered
+
+    def _unchanged(self, generations: tuple[int, dict[str, int]], tags: Iterable[str]) -> bool:
+        generation, tag_generations = generations
+        return generation == self._generation and all(tag_generations.get(tag, 0) == self._generations.get(tag, 0) for tag in tags)
+
+    def invalidate(self, *tags: str) -> None:
+        """Drops the entries built from any of the given models, every entry when no tag is given."""
+        with self._lock:
+            if tags:
+                for tag in tags:
+                    self._generations[tag] = self._generations.get(tag, 0) + 1
+            else:
+                self._generation += 1
+            keys = [key for key, entry in self._entries.items() if not tags or entry.tags.intersection(tags)]
+            for key in keys:
+                self._remove(key)
+            self.invalidations += len(keys)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "size_bytes": self.size_bytes,
+                "max_bytes": config.RESPONSE_CACHE_MAX_BYTES,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "stale_puts": self.stale_puts,
+                "routes": [
+                    {"route": route, "hits": statistics.hits, "misses": statistics.misses, "hit_rate": statistics.hit_rate}
+                    for route, statistics in sorted(self.routes.items())
+                ],
+            }
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,73 @@
+from fastapi import status, HTTPException, Depends, APIRouter
+from cmms import models, catalogs
+from cmms.api import schemas
+from cmms.database import pool_statistics, async_pool_statistics
+from cmms.api.extensions import login_manager
+from cmms.api.responsecache import response_cache
+from cmms.usercache import user_cache
+from cmms.loginlog import login_log_writer
+
+
+router = APIRouter(
+    prefix="/admin",
+    tags=['Admin']
+)
+
+
+def require_superuser(current_user: models.User = Depends(login_manager)) -> models.User:
+    if not current_user.is_superuser:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only the admin user can access this resource.")
+    return current_user
+
+
+@router.get("/pool", response_model=schemas.PoolStatisticsListOut)
+async def get_pool_statistics(current_user: models.User = Depends(require_superuser)):
+    return {"items": [async_pool_statistics.snapshot(), pool_statistics.snapshot()]}
+
+
+@router.delete("/pool", status_code=status.HTTP_204_NO_CONTENT)
+async def reset_pool_statistics(current_user: models.User = Depends(require_superuser)):
+    async_pool_statistics.reset()
+    pool_statistics.reset()
+
+
+@router.get("/catalogs", response_model=schemas.CatalogStatisticsListOut)
+async def get_catalog_statistics(current_user: models.User = Depends(require_superuser)):
+    return {"items": [catalog.snapshot() for catalog in catalogs.CATALOGS]}
+
+
+@router.delete("/catalogs", status_code=status.HTTP_204_NO_CONTENT)
+async def reset_catalogs(current_user: models.User = Depends(require_superuser)):
+    """Drops every cached catalog and resets the counters."""
+    for catalog in catalogs.CATALOGS:
+        catalog.invalidate()
+        catalog.reset()
+
+
+@router.get("/user_cache", response_model=schemas.UserCacheStatisticsOut)
+async def get_user_cache_statistics(current_user: models.User = Depends(require_superuser)):
+    return user_cache.snapshot()
+
+
+@router.delete("/user_cache", status_code=status.HTTP_204_NO_CONTENT)
+async def reset_user_cache(current_user: models.User = Depends(require_superuser)):
+    """Drops every cached user and resets the counters."""
+    user_cache.invalidate()
+    user_cache.reset()
+
+
+@router.get("/response_cache", response_model=schemas.ResponseCacheStatisticsOut)
+async def get_response_cache_statistics(current_user: models.User = Depends(require_superuser)):
+    return response_cache.snapshot()
+
+
+@router.delete("/response_cache", status_code=status.HTTP_204_NO_CONTENT)
+async def reset_response_cache(current_user: models.User = Depends(require_superuser)):
+    """Drops every cached response and resets the counters."""
+    response_cache.invalidate()
+    response_cache.reset()
+
+
+@router.get("/login_log", response_model=schemas.LoginLogStatisticsOut)
+async def get_login_log_statistics(current_user: models.User = Depends(require_superuser)):
+    return login_log_writer.snapshot()
@@ -0,0 +1,214 @@
+import os
+from dataclasses import dataclass
+from functools import partial
+from datetime import datetime
+from uuid import uuid4
+from typing import Optional
+from fastapi import Request, Response, status, HTTPException, Depends, APIRouter, Query
+from sqlalchemy import select, insert, update, delete, func, inspect
+from sqlalchemy.schema import Table
+from sqlalchemy.ext.asyncio import AsyncSession
+from cmms import models, thumbnails
+from cmms.api import schemas
+from cmms.blobstore import get_blob_store
+from cmms.mixins import DEFAULT_MIME_TYPE, guess_mime_type
+from cmms.database import AsyncSessionLocal, get_async_session, to_schema
+from cmms.api.extensions import login_manager
+from cmms.api.attachments import read_upload, BlobResponse, ColumnResponse
+from cmms.api.responsecache import response_cache
+from cmms.api.pagination import PageParams
+from cmms.api.projections import Projection, render
+from cmms.api.fieldsets import FieldParams
+
+router = APIRouter(
+    prefix="/attachment",
+    tags=['Attachment']
+)
+
+
+# Models that have attachments, by the owner name used in the paths.
+OWNERS = {
+    "equipment": models.Equipment,
+    "location": models.Location,
+    "maintenance_plan": models.MaintenancePlan,
+    "maintenance_activity": models.MaintenanceActivity,
+    "non_routine_job": models.NonRoutineJob,
+}
+
+ATTACHMENT_MODELS = {
+    "file": models.FileData,
+    "image": models.ImageData,
+}
+
+# The request body of the upload route, which reads it itself.
+UPLOAD_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["file"],
+                    "properties": {
+                        "file": {"type": "string", "format": "binary"},
+                        "note": {"type": "string"},
+                    },
+                },
+            },
+        },
+    },
+}
+
+
+@dataclass
+class AttachmentRelationship:
+    """An attachment list of an owner, like Equipment.files, and its association table."""
+    owner: str
+    owner_model: type
+    model: type
+    table: Table
+    owner_column: str
+    attachment_column: str
+
+
+def get_relationship_or_404(owner: str, relationship: str) -> AttachmentRelationship:
+    owner_model = OWNERS.get(owner)
+    property = inspect(owner_model).relationships.get(relationship) if owner_model else None
+    if property is None or property.secondary is None or property.mapper.class_ not in ATTACHMENT_MODELS.values():
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"{owner} has no attachments named: {relationship}.")
+    return AttachmentRelationship(
+        owner=owner,
+        owner_model=owner_model,
+        model=property.mapper.class_,
+        table=property.secondary,
+        owner_column=property.synchronize_pairs[0][1].name,
+        attachment_column=property.secondary_synchronize_pairs[0][1].name,
+    )
+
+
+async def check_owner(db: AsyncSession, target: AttachmentRelationship, owner_id: int) -> None:
+    if (await db.execute(select(target.owner_model.id).where(target.owner_model.id == owner_id))).first() is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"{target.owner_model.__name__} with id: {owner_id} does not exist.")
+
+
+async def read_column(model, id: int, offset: int, count: int) -> bytes:
+    """Reads count bytes of the data column of an attachment from offset, in its own session."""
+    async with AsyncSessionLocal() as db:
+        return (await db.execute(select(func.substr(model.data, offset + 1, count)).where(model.id == id))).scalar()
+
+
+async def touch_owner(db: AsyncSession, target: AttachmentRelationship, owner_id: int, current_user: models.User) -> None:
+    """Marks the owner modified like add_file and remove_file do, which changes its ETag."""
+    await db.execute(update(target.owner_model).where(target.owner_model.id == owner_id).values(modified_by_user_id=current_user.id, date_modified=datetime.now()))
+
+
+@router.get("/{owner}/{owner_id}/{relationship}", response_model=schemas.AttachmentListOut)
+async def get_attachments(owner: str, owner_id: int, relationship: str, page: PageParams = Depends(), selection: FieldParams = Depends(), db: AsyncSession = Depends(get_async_session)):
+    """Lists the attachments of an owner, like /attachment/equipment/7/images. Only metadata is read, never the content."""
+    target = get_relationship_or_404(owner, relationship)
+    await check_owner(db, target, owner_id)
+    projection = Projection(schemas.AttachmentOut, target.model, selection)
+    query = (
+        projection.select()
+        .join(target.table, target.table.c[target.attachment_column] == target.model.id)
+        .where(target.table.c[target.owner_column] == owner_id)
+    )
+    return render(await projection.page(db, query, page))
+
+
+@router.post("/{owner}/{owner_id}/{relationship}", status_code=status.HTTP_201_CREATED, response_model=schemas.AttachmentOut, openapi_extra=UPLOAD_BODY)
+async def upload_attachment(owner: str, owner_id: int, relationship: str, request: Request, db: AsyncSession = Depends(get_async_session), current_user: models.User = Depends(login_manager)):
+    """Uploads a file in the 'file' field of a multipart form and attaches it, like /attachment/equipment/7/files.
+
+    The file is stored while it is received, content that is already stored is kept once.
+    """
+    target = get_relationship_or_404(owner, relationship)
+    await check_owner(db, target, owner_id)
+    # Ends the read transaction so the connection goes back to the pool while the body streams in.
+    await db.commit()
+    upload = await read_upload(request, get_blob_store())
+
+    mime_type = upload.content_type
+    if not mime_type or mime_type == DEFAULT_MIME_TYPE:
+        mime_type = guess_mime_type(upload.filename)
+    _, extension = upload.filename.rsplit(".", 1) if "." in upload.filename else (None, "")
+    attachment = target.model(
+        filename=f"{uuid4().hex}.{extension}" if extension else uuid4().hex,
+        original_filename=upload.filename,
+        sha256=upload.sha256,
+        size=upload.size,
+        mime_type=mime_type,
+    )
+    note = upload.fields.get("note")
+    if note:
+        attachment.note = note if target.model is models.FileData else models.Note(data=note)
+    attachment.created_by_user = current_user
+    attachment.modified_by_user = current_user
+    db.add(attachment)
+    await db.flush()
+
+    await db.execute(insert(target.table).values({target.owner_column: owner_id, target.attachment_column: attachment.id}))
+    await touch_owner(db, target, owner_id, current_user)
+    await db.commit()
+    response_cache.invalidate(owner)
+    if target.model is models.ImageData:
+        thumbnails.queue_thumbnails(upload.sha256)
+
+    return await to_schema(db, schemas.AttachmentOut, attachment)
+
+
+@router.delete("/{owner}/{owner_id}/{relationship}/{attachment_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def remove_attachment(owner: str, owner_id: int, relationship: str, attachment_id: int, db: AsyncSession = Depends(get_async_session), current_user: models.User = Depends(login_manager)):
+    """Detaches an attachment. The attachment itself is kept, other owners may use it."""
+    target = get_relationship_or_404(owner, relationship)
+    result = await db.execute(
+        delete(target.table)
+        .where(target.table.c[target.owner_column] == owner_id, target.table.c[target.attachment_column] == attachment_id)
+    )
+    if result.rowcount == 0:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"{target.owner_model.__name__} with id: {owner_id} has no {relationship} with id: {attachment_id}.")
+    await touch_owner(db, target, owner_id, current_user)
+    await db.commit()
+    response_cache.invalidate(owner)
+
+
+@router.get("/{kind}/{id}", response_class=Response, responses={206: {"description": "The requested byte range."}})
+@router.head("/{kind}/{id}", response_class=Response)
+async def download_attachment(
+    kind: str,
+    id: int,
+    request: Request,
+    pixels: Optional[int] = Query(None, ge=1, description="Images only, a thumbnail at least this many pixels on its longest side. The original when there is none."),
+    db: AsyncSession = Depends(get_async_session)
+):
+    """Downloads a file or image. Single byte ranges are supported with Range and If-Range.
+
+    Thumbnails are JPEGs and are named like the image with a .jpg extension.
+    """
+    model = ATTACHMENT_MODELS.get(kind)
+    if model is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Attachment kind: {kind} does not exist.")
+    query = select(model.sha256, model.size, model.mime_type, model.filename, model.original_filename).where(model.id == id)
+    row = (await db.execute(query)).first()
+    if row is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"{model.__name__} with id: {id} does not exist.")
+    filename = row.original_filename or row.filename
+    mime_type = row.mime_type or guess_mime_type(filename)
+
+    if row.sha256 is None:
+        # Not exported to the blob store yet, see 'python -m cmms export-blobs'.
+        size = (await db.execute(select(func.length(model.data)).where(model.id == id))).scalar() or 0
+        await db.commit()
+        return ColumnResponse(request, partial(read_column, model, id), size, mime_type, filename)
+    store = get_blob_store()
+    key = thumbnails.find_thumbnail(row.sha256, pixels) if pixels and model is models.ImageData else None
+    if key:
+        filename, mime_type = f"{os.path.splitext(filename)[0]}.jpg", thumbnails.THUMBNAIL_MEDIA_TYPE
+    else:
+        key = row.sha256
+    # Checked before the response starts, a blob missing from the store is a 404 and not a broken body.
+    try:
+        size = store.size(key)
+    except FileNotFoundError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"The content of {model.__name__} with id: {id} is missing from the blob store.")
+    return BlobResponse(request, store, key, size, mime_type, filename)
@@ -4,11 +4,15 @@ from fastapi import FastAPI, Response, status, HTTPException, Depends, APIRouter
 from fastapi.responses import RedirectResponse, HTMLResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi_login.exceptions import InvalidCredentialsException
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from cmms import models
-from cmms.database import DBContext
+from cmms.database import AsyncSessionLocal, get_async_session
 from cmms.api import schemas
 from cmms.api.extensions import login_manager
+from cmms.usercache import user_cache
+from cmms.loginlog import login_log_writer
+from cmms.passwords import hash_password_async, verify_password_async, needs_rehash
 from cmms.config import LOGIN_TOKEN_EXPIRE_MINUTES
 
 
@@ -18,24 +22,43 @@ router = APIRouter(
 )
 
 @login_manager.user_loader()
-async def load_user(username: str, db: Session = None) -> Optional[models.User]:
+async def load_user(username: str, db: AsyncSession = None) -> Optional[models.User]:
+    """Returns the user of a token.
+
+    Without a session this is the login manager resolving the current user of a request, which is
+    answered from the user cache when possible. The returned user is detached either way.
+    With a session the user is always read from the database and belongs to that session.
+    Deactivated users are returned as None, which the login manager answers with 401.
+    """
+    query = select(models.User).filter(models.User.username == username)
     if db is None:
-        with DBContext() as db:
-            user = db.query(models.User).filter(models.User.username == username).first() # type: models.User
+        user = user_cache.get(username)
+        if user is None:
+            generation = user_cache.generation
+            async with AsyncSessionLocal() as db:
+                user = (await db.execute(query)).scalars().first() # type: models.User
+            if user is not None:
+                user_cache.put(user, generation)
     else:
-        user = db.query(models.User).filter(models.User.username == username).first() # type: models.User
+        user = (await db.execute(query)).scalars().first() # type: models.User
+    if user is not None and not user.active:
+        return None
     return user
 
 
 @router.post("/token", response_model=schemas.Token)
-def login(data: OAuth2PasswordRequestForm = Depends()):
-    if not load_user(data):
+async def login(data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_session)):
+    user = await load_user(data.username, db)
+    # Ends the read transaction so the connection goes back to the pool while bcrypt runs.
+    await db.commit()
+    if not user or not await verify_password_async(user.password_hash, data.password):
         raise InvalidCredentialsException  # you can also use your own HTTPException
-    
-    with DBContext() as db:
-        user = db.query(models.User).filter(models.User.username == data.username).first() # type: models.User
-        db.add(user.on_login())
-        db.commit()
+
+    if needs_rehash(user.password_hash):
+        user.password_hash = await hash_password_async(data.password)
+        await db.commit()
+
+    await login_log_writer.record(user.id, models.LoginEventType.Login)
 
     expires = datetime.now() + timedelta(minutes=LOGIN_TOKEN_EXPIRE_MINUTES)
     access_token = login_manager.create_access_token(data=dict(sub=data.username), expires=timedelta(minutes=LOGIN_TOKEN_EXPIRE_MINUTES))
@@ -1,10 +1,16 @@
 from datetime import datetime
 from typing import List
-from fastapi import FastAPI, Response, status, HTTPException, Depends, APIRouter, Path
-from sqlalchemy.orm import Session
-from .. import models, schemas
-from cmms.database import get_session
+from fastapi import FastAPI, Request, Response, status, HTTPException, Depends, APIRouter, Path
+from sqlalchemy import select, update, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from cmms import models, catalogs
+from cmms.api import schemas, etags
+from cmms.database import get_async_session, to_schema
 from cmms.api.extensions import login_manager
+from cmms.api.pagination import PageParams, paginate
+from cmms.api.responsecache import response_cache
+from cmms.api.projections import Projection, render
+from cmms.api.fieldsets import FieldParams
 
 
 router = APIRouter(
@@ -14,68 +20,93 @@ router = APIRouter(
 
 
 @router.post("/create", response_model=schemas.CauseOfEquipmentFailureOut)
-async def create_cause_of_failure(cause_of_failure: schemas.CauseOfEquipmentFailureIn, db: Session = Depends(get_session), current_user: models.User = Depends(login_manager)):
+async def create_cause_of_failure(cause_of_failure: schemas.CauseOfEquipmentFailureIn, db: AsyncSession = Depends(get_async_session), current_user: models.User = Depends(login_manager)):
     dict_ = cause_of_failure.dict()
-    
+
     new_cause_of_failure = models.CauseOfEquipmentFailure(**dict_)
     new_cause_of_failure.created_by_user = current_user
     new_cause_of_failure.modified_by_user = current_user
     db.add(new_cause_of_failure)
-    db.commit()
-    db.refresh(new_cause_of_failure)
-    return new_cause_of_failure
+    await db.commit()
+    catalogs.cause_of_equipment_failure.invalidate()
+    response_cache.invalidate("cause_of_equipment_failure")
+    await db.refresh(new_cause_of_failure)
+    return await to_schema(db, schemas.CauseOfEquipmentFailureOut, new_cause_of_failure)
 
 
 @router.put("/{id}", response_model=schemas.CauseOfEquipmentFailureOut)
-async def update_cause_of_failure(id: int, cause_of_failure: schemas.CauseOfEquipmentFailureIn, db: Session = Depends(get_session), current_user: models.User = Depends(login_manager)):
-    query = db.query(models.CauseOfEquipmentFailure).filter(models.CauseOfEquipmentFailure.id == id)
+async def update_cause_of_failure(id: int, cause_of_failure: schemas.CauseOfEquipmentFailureIn, db: AsyncSession = Depends(get_async_session), current_user: models.User = Depends(login_manager)):
+    query = select(models.CauseOfEquipmentFailure).filter(models.CauseOfEquipmentFailure.id == id)
 
-    updated_cause_of_failure = query.first() # type: models.CauseOfEquipmentFailure
+    updated_cause_of_failure = (await db.execute(query)).scalars().first() # type: models.CauseOfEquipmentFailure
 
     if not updated_cause_of_failure:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Cause Of Equipment Failure with id: {id} does not exist.")
-    
+
     if updated_cause_of_failure.read_only:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=f"Cause Of Equipment Failure has been set to read only, can not update.")
 
-    query.update(cause_of_failure.dict(), synchronize_session=False)
+    await db.execute(
+        update(models.CauseOfEquipmentFailure)
+        .where(models.CauseOfEquipmentFailure.id == id)
+        .values(**cause_of_failure.dict())
+        .execution_options(synchronize_session=False)
+    )
     updated_cause_of_failure.modified_by_user = current_user
     updated_cause_of_failure.date_modified = datetime.now()
 
-    db.commit()
-    db.refresh(updated_cause_of_failure)
+    await db.commit()
+    catalogs.cause_of_equipment_failure.invalidate()
+    response_cache.invalidate("cause_of_equipment_failure")
+    await db.refresh(updated_cause_of_failure)
 
-    return updated_cause_of_failure
+    return await to_schema(db, schemas.CauseOfEquipmentFailureOut, updated_cause_of_failure)
 
 
 @router.delete("/{id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_cause_of_failure(id: int, db: Session = Depends(get_session), current_user: models.User = Depends(login_manager)):
-    query = db.query(models.CauseOfEquipmentFailure).filter(models.CauseOfEquipmentFailure.id == id)
+async def delete_cause_of_failure(id: int, db: AsyncSession = Depends(get_async_session), current_user: models.User = Depends(login_manager)):
+    query = select(models.CauseOfEquipmentFailure).filter(models.CauseOfEquipmentFailure.id == id)
 
-    cause_of_failure = query.first() # type: models.CauseOfEquipmentFailure
+    cause_of_failure = (await db.execute(query)).scalars().first() # type: models.CauseOfEquipmentFailure
 
     if cause_of_failure == None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Cause Of Equipment Failure with id: {id} does not exist.")
-    
+
     if cause_of_failure.read_only:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Cause Of Equipment Failure with id: {id} is set to read only and can not be deleted.")
 
-    query.delete(synchronize_session=False)
-    db.commit()
+    await db.execute(
+        delete(models.CauseOfEquipmentFailure)
+        .where(models.CauseOfEquipmentFailure.id == id)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    catalogs.cause_of_equipment_failure.invalidate()
+    response_cache.invalidate("cause_of_equipment_failure")
 
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
 @router.get("/{id}", response_model=schemas.CauseOfEquipmentFailureOut)
-async def get_cause_of_failure_by_id(id: int, db: Session = Depends(get_session)):
-    cause_of_failure = db.query(models.CauseOfEquipmentFailure).filter(models.CauseOfEquipmentFailure.id == id).first() # type: models.CauseOfEquipmentFailure
+async def get_cause_of_failure_by_id(id: int, request: Request, response: Response, selection: FieldParams = Depends(), db: AsyncSession = Depends(get_async_session)):
+    not_modified = await etags.conditional(db, request, response, etags.audit_query(models.CauseOfEquipmentFailure, id))
+    if not_modified:
+        return not_modified
+
+    cause_of_failure = await Projection(schemas.CauseOfEquipmentFailureOut, models.CauseOfEquipmentFailure, selection).one(db, id)
     if not cause_of_failure:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Cause Of Equipment Failure with id: {id} does not exist.")
 
-    return cause_of_failure
+    return render(cause_of_failure, response)
 
 
 @router.get("/", response_model=schemas.CauseOfEquipmentFailureListOut)
-async def get_cause_of_failure(name: str = "", db: Session = Depends(get_session)):
-    cause_of_failures = db.query(models.CauseOfEquipmentFailure).filter(models.CauseOfEquipmentFailure.name.ilike("%" + name + "%")).all() # type: List[models.CauseOfEquipmentFailure]
-    return {"items": cause_of_failures}
\ No newline at end of file
+async def get_cause_of_failure(request: Request, response: Response, name: str = "", page: PageParams = Depends(), selection: FieldParams = Depends(), db: AsyncSession = Depends(get_async_session)):
+    cached = response_cache.get(request)
+    if cached:
+        return cached
+
+    projection = Projection(schemas.CauseOfEquipmentFailureOut, models.CauseOfEquipmentFailure, selection)
+    query = projection.select().filter(models.CauseOfEquipmentFailure.name.ilike("%" + name + "%"))
+    page_data = await projection.page(db, query, page)
+    return response_cache.put(request, response, render(page_data), tags=("cause_of_equipment_failure",))
@@ -1,10 +1,19 @@
+import csv
 from datetime import datetime
-from typing import List
-from fastapi import FastAPI, Response, status, HTTPException, Depends, APIRouter, Path
-from sqlalchemy.orm import Session
-from .. import models, schemas
-from cmms.database import get_session
+from typing import List, Optional
+from fastapi import FastAPI, Request, Response, status, HTTPException, Depends, APIRouter, Path, Query, UploadFile, File
+from sqlalchemy import select, update, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from cmms import models, catalogs
+from cmms.api import schemas, etags
+from cmms.database import get_async_session, to_schema
 from cmms.api.extensions import login_manager
+from cmms.api.pagination import PageParams, paginate
+from cmms.api.projections import Projection, render
+from cmms.api.fieldsets import FieldParams, load_audit_users
+from cmms.config import MAX_PAGE_LIMIT
+from cmms.search import search_equipment
+from cmms.equipmentimport import parse_equipment_file, import_equipment
 
 
 router = APIRouter(
@@ -13,79 +22,144 @@ router = APIRouter(
 )
 
 
+async def set_classifications(db: AsyncSession, equipment: models.Equipment, classification1_name: Optional[str], classification2_name: Optional[str], current_user: models.User) -> bool:
+    """Sets the classifications of equipment by name, creating the ones that do not exist yet.
+
+    Returns:
+        bool: True if a classification was created.
+    """
+    created_classification = False
+    if classification1_name:
+        classification1_id = await db.run_sync(catalogs.equipment_classification1.id_of, classification1_name)
+        if classification1_id:
+            equipment.classification1_id = classification1_id
+        else:
+            equipment.set_classification1(models.EquipmentClassification1(name=classification1_name), current_user)
+            created_classification = True
+
+    if classification2_name:
+        classification2_id = await db.run_sync(catalogs.equipment_classification2.id_of, classification2_name)
+        if classification2_id:
+            equipment.classification2_id = classification2_id
+        else:
+            equipment.set_classification2(models.EquipmentClassification2(name=classification2_name), current_user)
+            created_classification = True
+    return created_classification
+
+
 @router.post("/create", response_model=schemas.EquipmentOut)
-async def create_equipment(equipment: schemas.EquipmentIn, db: Session = Depends(get_session), current_user: models.User = Depends(login_manager)):
+async def create_equipment(equipment: schemas.EquipmentIn, db: AsyncSession = Depends(get_async_session), current_user: models.User = Depends(login_manager)):
     dict_ = equipment.dict()
     classification1_name = dict_.pop("classification1_name", None)
     classification2_name = dict_.pop("classification2_name", None)
 
-    if classification1_name:
-        classification1 = db.query(models.EquipmentClassification1.name == classification1_name).first()
-        if not classification1:
-            classification1 = models.EquipmentClassification1(name=classification1_name)
-            db.add(classification1)
-    
-    if classification2_name:
-        classification2 = db.query(models.EquipmentClassification2.name == classification2_name).first()
-        if not classification2:
-            classification2 = models.EquipmentClassification2(name=classification2_name)
-            db.add(classification2)
-    
     new_equipment = models.Equipment(**dict_)
     new_equipment.created_by_user = current_user
-    new_equipment.set_classification1(classification1, current_user)
-    new_equipment.set_classification2(classification2, current_user)
+    new_equipment.modified_by_user = current_user
+
+    created_classification = await set_classifications(db, new_equipment, classification1_name, classification2_name, current_user)
+
     db.add(new_equipment)
-    db.commit()
-    db.refresh(new_equipment)
+    await db.commit()
+    if created_classification:
+        catalogs.equipment_classification1.invalidate()
+        catalogs.equipment_classification2.invalidate()
+    await db.refresh(new_equipment)
+
+    return await to_schema(db, schemas.EquipmentOut, new_equipment)
+
+
+@router.post("/import", response_model=schemas.EquipmentImportOut)
+async def import_equipment_file(file: UploadFile = File(..., description="CSV or JSON file with rows in the test_data.json 'Equipment' shape."), db: AsyncSession = Depends(get_async_session), current_user: models.User = Depends(login_manager)):
+    try:
+        rows = parse_equipment_file(file.filename or "", await file.read())
+    except (ValueError, csv.Error) as error:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"Could not read {file.filename}: {error}")
+
+    result = await import_equipment(db, rows, current_user)
+    await db.commit()
+    catalogs.equipment_classification1.invalidate()
+    catalogs.equipment_classification2.invalidate()
 
-    return new_equipment
+    return result
 
 
 @router.put("/{id}", response_model=schemas.EquipmentOut)
-async def update_equipment(id: int, equipment: schemas.EquipmentIn, db: Session = Depends(get_session), current_user: models.User = Depends(login_manager)):
-    query = db.query(models.Equipment).filter(models.Equipment.id == id)
+async def update_equipment(id: int, equipment: schemas.EquipmentIn, db: AsyncSession = Depends(get_async_session), current_user: models.User = Depends(login_manager)):
+    query = select(models.Equipment).filter(models.Equipment.id == id)
 
-    updated_equipment = query.first() # type: models.Equipment
+    updated_equipment = (await db.execute(query)).scalars().first() # type: models.Equipment
 
     if not updated_equipment:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Equipment with id: {id} does not exist.")
 
-    query.update(equipment.dict(), synchronize_session=False)
+    await db.execute(
+        update(models.Equipment)
+        .where(models.Equipment.id == id)
+        .values(**equipment.dict(exclude={"classification1_name", "classification2_name"}))
+        .execution_options(synchronize_session=False)
+    )
     updated_equipment.modified_by_user = current_user
     updated_equipment.date_modified = datetime.now()
 
-    db.commit()
-    db.refresh(updated_equipment)
+    # Classifications are set by name like on create. A name left out keeps the classification, null removes it.
+    created_classification = await set_classifications(db, updated_equipment, equipment.classification1_name, equipment.classification2_name, current_user)
+    if "classification1_name" in equipment.__fields_set__ and equipment.classification1_name is None:
+        updated_equipment.remove_classification1(current_user)
+    if "classification2_name" in equipment.__fields_set__ and equipment.classification2_name is None:
+        updated_equipment.remove_classification2(current_user)
 
-    return updated_equipment
+    await db.commit()
+    if created_classification:
+        catalogs.equipment_classification1.invalidate()
+        catalogs.equipment_classification2.invalidate()
+    await db.refresh(updated_equipment)
+
+    return await to_schema(db, schemas.EquipmentOut, updated_equipment)
 
 
 @router.delete("/{id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_equipment(id: int, db: Session = Depends(get_session), current_user: models.User = Depends(login_manager)):
-    query = db.query(models.Equipment).filter(models.Equipment.id == id)
+async def delete_equipment(id: int, db: AsyncSession = Depends(get_async_session), current_user: models.User = Depends(login_manager)):
+    query = select(models.Equipment).filter(models.Equipment.id == id)
 
-    equipment = query.first() # type: models.Equipment
+    equipment = (await db.execute(query)).scalars().first() # type: models.Equipment
 
     if equipment == None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Equipment with id: {id} does not exist.")
 
-    query.delete(synchronize_session=False)
-    db.commit()
+    await db.execute(
+        delete(models.Equipment)
+        .where(models.Equipment.id == id)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
 
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
+@router.get("/search", response_model=schemas.EquipmentSearchOut)
+async def search(q: str = Query(..., min_length=1, description="Words to find in the name, brand, model, serial number or code."), limit: int = Query(25, ge=1, le=MAX_PAGE_LIMIT), db: AsyncSession = Depends(get_async_session)):
+    results = await search_equipment(db, q, limit)
+    await load_audit_users(db, ([equipment for equipment, _ in results], FieldParams.every()))
+    items = [{"score": score, "equipment": equipment} for equipment, score in results]
+    return await to_schema(db, schemas.EquipmentSearchOut, {"items": items})
+
+
 @router.get("/{id}", response_model=schemas.EquipmentOut)
-async def get_equipment(id: int, db: Session = Depends(get_session)):
-    equipment = db.query(models.Equipment).filter(models.Equipment.id == id).first() # type: models.Equipment
+async def get_equipment(id: int, request: Request, response: Response, selection: FieldParams = Depends(), db: AsyncSession = Depends(get_async_session)):
+    not_modified = await etags.conditional(db, request, response, etags.audit_query(models.Equipment, id))
+    if not_modified:
+        return not_modified
+
+    equipment = await Projection(schemas.EquipmentOut, models.Equipment, selection).one(db, id)
     if not equipment:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Equipment with id: {id} does not exist.")
 
-    return equipment
+    return render(equipment, response)
 
 
 @router.get("/", response_model=schemas.EquipmentListOut)
-async def get_equipment(serial_number: str = "", db: Session = Depends(get_session)):
-    equipment = db.query(models.Equipment).filter(models.Equipment.serial_number.ilike("%" + serial_number + "%")).all() # type: List[models.Equipment]
-    return {"items": equipment}
\ No newline at end of file
+async def get_equipment(serial_number: str = "", page: PageParams = Depends(), selection: FieldParams = Depends(), db: AsyncSession = Depends(get_async_session)):
+    projection = Projection(schemas.EquipmentOut, models.Equipment, selection)
+    query = projection.select().filter(models.Equipment.serial_number.ilike("%" + serial_number + "%"))
+    return render(await projection.page(db, query, page))
@@ -1,10 +1,16 @@
 from datetime import datetime
 from typing import List
-from fastapi import FastAPI, Response, status, HTTPException, Depends, APIRouter
-from sqlalchemy.orm import Session
-from .. import models, schemas
-from cmms.database import get_session
+from fastapi import FastAPI, Request, Response, status, HTTPException, Depends, APIRouter
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from cmms import models, catalogs
+from cmms.api import schemas, etags
+from cmms.database import get_async_session, to_schema
 from cmms.api.extensions import login_manager
+from cmms.api.pagination import PageParams, paginate
+from cmms.api.responsecache import response_cache
+from cmms.api.projections import Projection, render
+from cmms.api.fieldsets import FieldParams
 
 
 router = APIRouter(
@@ -14,8 +20,9 @@ router = APIRouter(
 
 
 @router.post("/create", response_model=schemas.EquipmentFailureOut)
-async def create_equipment_failure(equipment_failure: schemas.EquipmentFailureIn, db: Session = Depends(get_session), current_user: models.User = Depends(login_manager)):
-    equipment_failure_obj = db.query(models.EquipmentFailure).filter(models.EquipmentFailure.name == equipment_failure.name).first() # type: models.EquipmentFailure
+async def create_equipment_failure(equipment_failure: schemas.EquipmentFailureIn, db: AsyncSession = Depends(get_async_session), current_user: models.User = Depends(login_manager)):
+    query = select(models.EquipmentFailure).filter(models.EquipmentFailure.name == equipment_failure.name)
+    equipment_failure_obj = (await db.execute(query)).scalars().first() # type: models.EquipmentFailure
 
     if equipment_failure_obj != None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Equipment Failure with name: '{equipment_failure.name}' already exist.")
@@ -24,52 +31,73 @@ async def create_equipment_failure(equipment_failure: schemas.EquipmentFailureIn
     new_equipment_failure.created_by_user = current_user
     new_equipment_failure.modified_by_user = current_user
     db.add(new_equipment_failure)
-    db.commit()
-    db.refresh(new_equipment_failure)
-    return new_equipment_failure
+    await db.commit()
+    catalogs.equipment_failure.invalidate()
+    response_cache.invalidate("equipment_failure")
+    await db.refresh(new_equipment_failure)
+    return await to_schema(db, schemas.EquipmentFailureOut, new_equipment_failure)
 
 
 @router.put("/{id}", response_model=schemas.EquipmentFailureOut)
-async def update_equipment_failure(id: int, equipment_failure: schemas.EquipmentFailureIn, db: Session = Depends(get_session), current_user: models.User = Depends(login_manager)):
-    query = db.query(models.EquipmentFailure).filter(models.EquipmentFailure.id == id)
+async def update_equipment_failure(id: int, equipment_failure: schemas.EquipmentFailureIn, db: AsyncSession = Depends(get_async_session), current_user: models.User = Depends(login_manager)):
+    query = select(models.EquipmentFailure).filter(models.EquipmentFailure.id == id)
 
-    updated_equipment_failure = query.first() # type: models.EquipmentFailure
+    updated_equipment_failure = (await db.execute(query)).scalars().first() # type: models.EquipmentFailure
 
     if not updated_equipment_failure:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Equipment Failure with id: {id} does not exist.")
 
-    query.update(equipment_failure.dict(), synchronize_session=False)
+    await db.execute(
+        update(models.EquipmentFailure)
+        .where(models.EquipmentFailure.id == id)
+        .values(**equipment_failure.dict())
+        .execution_options(synchronize_session=False)
+    )
     updated_equipment_failure.modified_by_user = current_user
     updated_equipment_failure.date_modified = datetime.now()
-    updated_equipment_failure.remove_all_failures()
-    db.commit()
-    db.refresh(updated_equipment_failure)
-    return updated_equipment_failure
+    await db.commit()
+    catalogs.equipment_failure.invalidate()
+    response_cache.invalidate("equipment_failure")
+    await db.refresh(updated_equipment_failure)
+    return await to_schema(db, schemas.EquipmentFailureOut, updated_equipment_failure)
 
 
 @router.delete("/{id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_equipment_failure(id: int, db: Session = Depends(get_session), current_user: models.User = Depends(login_manager)):
-    equipment_failure = db.query(models.EquipmentFailure).filter(models.EquipmentFailure.id == id).first() # type: models.EquipmentFailure
+async def delete_equipment_failure(id: int, db: AsyncSession = Depends(get_async_session), current_user: models.User = Depends(login_manager)):
+    query = select(models.EquipmentFailure).filter(models.EquipmentFailure.id == id)
+    equipment_failure = (await db.execute(query)).scalars().first() # type: models.EquipmentFailure
 
     if equipment_failure == None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Equipment Failure with id: {id} does not exist.")
 
-    db.delete(equipment_failure)
-    db.commit()
+    await db.delete(equipment_failure)
+    await db.commit()
+    catalogs.equipment_failure.invalidate()
+    response_cache.invalidate("equipment_failure")
 
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
 @router.get("/{id}", response_model=schemas.EquipmentFailureOut)
-async def get_equipment_failure_by_id(id: int, db: Session = Depends(get_session)):
-    equipment_failure = db.query(models.EquipmentFailure).filter(models.EquipmentFailure.id == id).first() # type: models.EquipmentFailure
+async def get_equipment_failure_by_id(id: int, request: Request, response: Response, selection: FieldParams = Depends(), db: AsyncSession = Depends(get_async_session)):
+    not_modified = await etags.conditional(db, request, response, etags.audit_query(models.EquipmentFailure, id))
+    if not_modified:
+        return not_modified
+
+    equipment_failure = await Projection(schemas.EquipmentFailureOut, models.EquipmentFailure, selection).one(db, id)
     if not equipment_failure:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Equipment Failure with id: {id} does not exist.")
 
-    return equipment_failure
+    return render(equipment_failure, response)
 
 
 @router.get("/", response_model=schemas.EquipmentFailureListOut)
-async def get_cause_of_failure(name: str = "", db: Session = Depends(get_session)):
-    cause_of_failures = db.query(models.EquipmentFailure).filter(models.EquipmentFailure.name.ilike("%" + name + "%")).all() # type: List[models.EquipmentFailure]
-    return {"items": cause_of_failures}
\ No newline at end of file
+async def get_cause_of_failure(request: Request, response: Response, name: str = "", page: PageParams = Depends(), selection: FieldParams = Depends(), db: AsyncSession = Depends(get_async_session)):
+    cached = response_cache.get(request)
+    if cached:
+        return cached
+
+    projection = Projection(schemas.EquipmentFailureOut, models.EquipmentFailure, selection)
+    query = projection.select().filter(models.EquipmentFailure.name.ilike("%" + name + "%"))
+    page_data = await projection.page(db, query, page)
+    return response_cache.put(request, response, render(page_data), tags=("equipment_failure",))
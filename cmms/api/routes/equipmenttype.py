@@ -1,10 +1,17 @@
 from datetime import datetime
 from typing import List
-from fastapi import FastAPI, Response, status, HTTPException, Depends, APIRouter
+from fastapi import FastAPI, Request, Response, status, HTTPException, Depends, APIRouter
+from sqlalchemy import select, update, delete, insert, func
 from sqlalchemy.orm import Session
-from .. import models, schemas
-from cmms.database import get_session
+from sqlalchemy.ext.asyncio import AsyncSession
+from cmms import models, catalogs
+from cmms.api import schemas, etags
+from cmms.database import get_async_session, to_schema
 from cmms.api.extensions import login_manager
+from cmms.api.pagination import PageParams, paginate
+from cmms.api.responsecache import response_cache
+from cmms.api.projections import render
+from cmms.api.fieldsets import FieldParams, load_options, load_audit_users, to_data
 
 
 router = APIRouter(
@@ -13,9 +20,67 @@ router = APIRouter(
 )
 
 
+def set_failures(db: Session, equipment_type: models.EquipmentType, failure_names: List[str], current_user: models.User) -> None:
+    """Replaces the failures of an equipment type. Runs on the sync session through run_sync.
+
+    Failure names are resolved through the failure catalog, missing failures are created and the
+    links are rewritten with one delete and one executemany insert.
+    """
+    failure_names = list(dict.fromkeys(failure_names))
+    failure_ids = catalogs.equipment_failure.ids(db, failure_names)
+
+    new_names = [name for name in failure_names if name not in failure_ids]
+    if new_names:
+        now = datetime.now()
+        audit = {"created_by_user_id": current_user.id, "modified_by_user_id": current_user.id, "date_created": now, "date_modified": now}
+        db.execute(insert(models.EquipmentFailure.__table__), [{"name": name, **audit} for name in new_names])
+        query = select(models.EquipmentFailure.id, models.EquipmentFailure.name).where(models.EquipmentFailure.name.in_(new_names))
+        failure_ids.update({name: id for id, name in db.execute(query)})
+        catalogs.equipment_failure.invalidate()
+
+    table = models.equipmenttypetofalure_table
+    db.execute(delete(table).where(table.c.equipment_type_id == equipment_type.id))
+    if failure_names:
+        db.execute(insert(table), [{"equipment_type_id": equipment_type.id, "equipment_failure_id": failure_ids[name]} for name in failure_names])
+    db.expire(equipment_type, ["failures"])
+    equipment_type.modified_by_user = current_user
+
+
+def equipment_type_etag_query(id: int):
+    """Tag columns of an equipment type and the failures it lists."""
+    links = models.equipmenttypetofalure_table
+    failures = (
+        select(func.count(models.EquipmentFailure.id), func.max(models.EquipmentFailure.date_modified))
+        .join(links, links.c.equipment_failure_id == models.EquipmentFailure.id)
+        .where(links.c.equipment_type_id == id)
+    )
+    return etags.tree_query(models.EquipmentType, id, failures)
+
+
+async def load_audit_users_of_types(db: AsyncSession, equipment_types: List[models.EquipmentType], selection: FieldParams = None) -> None:
+    """Loads the audit users of the equipment types and of the failures they list with one query."""
+    selection = selection or FieldParams.every()
+    failures = [failure for equipment_type in equipment_types for failure in equipment_type.failures] if selection.expands("failures") else []
+    await load_audit_users(db, (equipment_types, selection), (failures, selection.nested("failures")))
+
+
+async def reload_equipment_type(db: AsyncSession, id: int) -> models.EquipmentType:
+    """Reads a written equipment type again with its failures and audit users for the response."""
+    query = (
+        select(models.EquipmentType)
+        .where(models.EquipmentType.id == id)
+        .options(*load_options(models.EquipmentType, schemas.EquipmentTypeOut, FieldParams.every()))
+        .execution_options(populate_existing=True)
+    )
+    equipment_type = (await db.execute(query)).scalars().one() # type: models.EquipmentType
+    await load_audit_users_of_types(db, [equipment_type])
+    return equipment_type
+
+
 @router.post("/create", response_model=schemas.EquipmentTypeOut)
-async def create_equipment_type(equipment_type: schemas.EquipmentTypeIn, db: Session = Depends(get_session), current_user: models.User = Depends(login_manager)):
-    equipment_type_obj = db.query(models.EquipmentType).filter(models.EquipmentType.name == equipment_type.name).first() # type: models.EquipmentType
+async def create_equipment_type(equipment_type: schemas.EquipmentTypeIn, db: AsyncSession = Depends(get_async_session), current_user: models.User = Depends(login_manager)):
+    query = select(models.EquipmentType).filter(models.EquipmentType.name == equipment_type.name)
+    equipment_type_obj = (await db.execute(query)).scalars().first() # type: models.EquipmentType
 
     if equipment_type_obj != None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Equipment Type with name: '{equipment_type.name}' already exist.")
@@ -24,74 +89,84 @@ async def create_equipment_type(equipment_type: schemas.EquipmentTypeIn, db: Ses
     new_equipment_type.created_by_user = current_user
     new_equipment_type.modified_by_user = current_user
     db.add(new_equipment_type)
-    db.commit()
+    await db.commit()
 
-    for failure_name in equipment_type.failures:
-        failure = db.query(models.EquipmentFailure).filter(models.EquipmentFailure.name == failure_name).first() # type: models.EquipmentFailure
-        if not failure:
-            failure = models.EquipmentFailure(name=failure_name)
-            failure.created_by_user = current_user
-            failure.modified_by_user = current_user
-        new_equipment_type.add_failure(failure)
-    db.commit()
-    
-    db.refresh(new_equipment_type)
+    await db.run_sync(set_failures, new_equipment_type, equipment_type.failures, current_user)
+    await db.commit()
+    catalogs.equipment_type.invalidate()
+    response_cache.invalidate("equipment_type", "equipment_failure")
 
-    return new_equipment_type
+    new_equipment_type = await reload_equipment_type(db, new_equipment_type.id)
+
+    return await to_schema(db, schemas.EquipmentTypeOut, new_equipment_type)
 
 
 @router.put("/{id}", response_model=schemas.EquipmentTypeOut)
-async def update_equipment_type(id: int, equipment_type: schemas.EquipmentTypeIn, db: Session = Depends(get_session), current_user: models.User = Depends(login_manager)):
-    query = db.query(models.EquipmentType).filter(models.EquipmentType.id == id)
+async def update_equipment_type(id: int, equipment_type: schemas.EquipmentTypeIn, db: AsyncSession = Depends(get_async_session), current_user: models.User = Depends(login_manager)):
+    query = select(models.EquipmentType).filter(models.EquipmentType.id == id)
 
-    updated_equipment_type = query.first() # type: models.EquipmentType
+    updated_equipment_type = (await db.execute(query)).scalars().first() # type: models.EquipmentType
 
     if not updated_equipment_type:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Equipment Type with id: {id} does not exist.")
 
-    query.update(equipment_type.dict(), synchronize_session=False)
+    await db.execute(
+        update(models.EquipmentType)
+        .where(models.EquipmentType.id == id)
+        .values(**equipment_type.dict(exclude={"failures"}))
+        .execution_options(synchronize_session=False)
+    )
     updated_equipment_type.modified_by_user = current_user
     updated_equipment_type.date_modified = datetime.now()
-    updated_equipment_type.remove_all_failures()
-    db.commit()
 
-    for failure_name in equipment_type.failures:
-        failure = db.query(models.EquipmentFailure).filter(models.EquipmentFailure.name == failure_name).first() # type: models.EquipmentFailure
-        if not failure:
-            failure = models.EquipmentFailure(name=failure_name)
-            failure.created_by_user = current_user
-            failure.modified_by_user = current_user
-        updated_equipment_type.add_failure(failure)
-    db.commit()
+    await db.run_sync(set_failures, updated_equipment_type, equipment_type.failures, current_user)
+    await db.commit()
+    catalogs.equipment_type.invalidate()
+    response_cache.invalidate("equipment_type", "equipment_failure")
 
-    db.refresh(updated_equipment_type)
+    updated_equipment_type = await reload_equipment_type(db, id)
 
-    return updated_equipment_type
+    return await to_schema(db, schemas.EquipmentTypeOut, updated_equipment_type)
 
 
 @router.delete("/{id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_equipment_type(id: int, db: Session = Depends(get_session), current_user: models.User = Depends(login_manager)):
-    equipment_type = db.query(models.EquipmentType).filter(models.EquipmentType.id == id).first() # type: models.EquipmentType
+async def delete_equipment_type(id: int, db: AsyncSession = Depends(get_async_session), current_user: models.User = Depends(login_manager)):
+    query = select(models.EquipmentType).filter(models.EquipmentType.id == id)
+    equipment_type = (await db.execute(query)).scalars().first() # type: models.EquipmentType
 
     if equipment_type == None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Equipment Type with id: {id} does not exist.")
 
-    db.delete(equipment_type)
-    db.commit()
+    await db.delete(equipment_type)
+    await db.commit()
+    catalogs.equipment_type.invalidate()
+    response_cache.invalidate("equipment_type", "equipment_failure")
 
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
 @router.get("/{id}", response_model=schemas.EquipmentTypeOut)
-async def get_equipment_type_by_id(id: int, db: Session = Depends(get_session)):
-    equipment_type = db.query(models.EquipmentType).filter(models.EquipmentType.id == id).first() # type: models.EquipmentType
+async def get_equipment_type_by_id(id: int, request: Request, response: Response, selection: FieldParams = Depends(), db: AsyncSession = Depends(get_async_session)):
+    not_modified = await etags.conditional(db, request, response, equipment_type_etag_query(id))
+    if not_modified:
+        return not_modified
+
+    query = select(models.EquipmentType).filter(models.EquipmentType.id == id).options(*load_options(models.EquipmentType, schemas.EquipmentTypeOut, selection))
+    equipment_type = (await db.execute(query)).scalars().first() # type: models.EquipmentType
     if not equipment_type:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Equipment Type with id: {id} does not exist.")
 
-    return equipment_type
+    await load_audit_users_of_types(db, [equipment_type], selection)
+    return render(await to_data(db, schemas.EquipmentTypeOut, equipment_type, selection), response)
 
 
 @router.get("/", response_model=schemas.EquipmentTypeListOut)
-async def get_equipment_type(serial_number: str = "", db: Session = Depends(get_session)):
-    equipment_types = db.query(models.EquipmentType).filter(models.EquipmentType.serial_number.ilike("%" + serial_number + "%")).all() # type: List[models.EquipmentType]
-    return {"items": equipment_types}
\ No newline at end of file
+async def get_equipment_type(request: Request, response: Response, name: str = "", page: PageParams = Depends(), selection: FieldParams = Depends(), db: AsyncSession = Depends(get_async_session)):
+    cached = response_cache.get(request)
+    if cached:
+        return cached
+
+    query = select(models.EquipmentType).filter(models.EquipmentType.name.ilike("%" + name + "%")).options(*load_options(models.EquipmentType, schemas.EquipmentTypeOut, selection))
+    page_data = await paginate(db, query, models.EquipmentType, page)
+    await load_audit_users_of_types(db, page_data["items"], selection)
+    return response_cache.put(request, response, render(await to_data(db, schemas.EquipmentTypeOut, page_data, selection)), tags=("equipment_type", "equipment_failure"))
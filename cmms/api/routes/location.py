@@ -1,9 +1,18 @@
-from fastapi import FastAPI, Response, status, HTTPException, Depends, APIRouter
-from sqlalchemy.orm import Session
+from datetime import datetime
+from typing import List
+from fastapi import FastAPI, Request, Response, status, HTTPException, Depends, APIRouter
+from sqlalchemy import select, func
+from sqlalchemy.orm import aliased, load_only
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.ext.asyncio import AsyncSession
 from cmms import models
-from cmms.api import schemas
-from cmms.database import get_session
+from cmms.api import schemas, etags
+from cmms.database import get_async_session, to_schema
 from cmms.api.extensions import login_manager
+from cmms.api.pagination import PageParams, paginate
+from cmms.api.responsecache import response_cache
+from cmms.api.projections import Projection, render
+from cmms.api.fieldsets import FieldParams, load_columns, load_audit_users, to_data
 
 router = APIRouter(
     prefix="/location",
@@ -11,41 +20,161 @@ router = APIRouter(
 )
 
 
+def build_location(location: schemas.LocationIn, current_user: models.User) -> models.Location:
+    """Builds a location with its nested children. The closure rows are added by the model on flush."""
+    new_location = models.Location(name=location.name, parent_location_id=location.parent_location_id)
+    new_location.created_by_user = current_user
+    new_location.modified_by_user = current_user
+    new_location.children = [build_location(child, current_user) for child in location.children or []]
+    return new_location
+
+
+async def load_trees(db: AsyncSession, locations: List[models.Location], selection: FieldParams = None) -> None:
+    """Loads the children of every location below the given ones with one closure query, and the
+    audit users of the whole trees with one more.
+
+    The children are set as committed values, so serializing LocationOut does not lazy load per node.
+    The children are not loaded when the selection does not expand them, otherwise only its columns.
+    """
+    selection = selection or FieldParams.every()
+    if not locations:
+        return
+    if not selection.expands("children"):
+        await load_audit_users(db, (locations, selection))
+        return
+    closure = models.locationclosure_table
+    descendant_ids = select(closure.c.descendant_id).where(closure.c.ancestor_id.in_([location.id for location in locations]), closure.c.depth > 0)
+    columns = load_columns(models.Location, schemas.LocationOut, selection) + [models.Location.parent_location_id]
+    query = select(models.Location).where(models.Location.id.in_(descendant_ids)).order_by(models.Location.id).options(load_only(*columns))
+    descendants = (await db.execute(query)).scalars().all()
+
+    children = {}
+    for location in descendants:
+        children.setdefault(location.parent_location_id, []).append(location)
+    for location in list(locations) + list(descendants):
+        set_committed_value(location, "children", children.get(location.id, []))
+    await load_audit_users(db, (list(locations) + list(descendants), selection))
+
+
+def location_etag_query(id: int):
+    """Tag columns of a location and every location below it."""
+    closure = models.locationclosure_table
+    descendant = aliased(models.Location)
+    descendants = (
+        select(func.count(descendant.id), func.max(descendant.date_modified))
+        .join(closure, closure.c.descendant_id == descendant.id)
+        .where(closure.c.ancestor_id == id, closure.c.depth > 0)
+    )
+    return etags.tree_query(models.Location, id, descendants)
+
+
+async def get_location_or_404(db: AsyncSession, id: int, *options) -> models.Location:
+    query = select(models.Location).filter(models.Location.id == id).options(*options)
+    location = (await db.execute(query)).scalars().first() # type: models.Location
+    if not location:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Location with id: {id} does not exist.")
+    return location
+
+
 @router.post("/create", status_code=status.HTTP_201_CREATED, response_model=schemas.LocationOut)
-async def create_location(location: schemas.LocationIn, db: Session = Depends(get_session)):
-    location_obj = db.query(models.Location).filter(models.Location.name == location.name).first()
+async def create_location(location: schemas.LocationIn, db: AsyncSession = Depends(get_async_session), current_user: models.User = Depends(login_manager)):
+    query = select(models.Location).filter(models.Location.name == location.name)
+    location_obj = (await db.execute(query)).scalars().first()
     if location_obj:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"A location with name: {location.name} already exists.")
-    new_location = models.Location(**location.dict())
+    if location.parent_location_id is not None:
+        await get_location_or_404(db, location.parent_location_id)
+
+    new_location = build_location(location, current_user)
     db.add(new_location)
-    db.commit()
-    db.refresh(new_location)
+    await db.commit()
+    response_cache.invalidate("location")
 
-    return new_location
+    await load_trees(db, [new_location])
+    return await to_schema(db, schemas.LocationOut, new_location)
+
+
+@router.put("/{id}", response_model=schemas.LocationOut)
+async def update_location(id: int, location: schemas.LocationUpdate, db: AsyncSession = Depends(get_async_session), current_user: models.User = Depends(login_manager)):
+    updated_location = await get_location_or_404(db, id)
+
+    if location.parent_location_id is not None:
+        await get_location_or_404(db, location.parent_location_id)
+        closure = models.locationclosure_table
+        query = select(closure.c.depth).where(closure.c.ancestor_id == id, closure.c.descendant_id == location.parent_location_id)
+        if (await db.execute(query)).first():
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Location with id: {id} can not be moved below itself.")
+
+    updated_location.name = location.name
+    updated_location.parent_location_id = location.parent_location_id
+    updated_location.modified_by_user = current_user
+    updated_location.date_modified = datetime.now()
+    await db.commit()
+    response_cache.invalidate("location")
+
+    await load_trees(db, [updated_location])
+    return await to_schema(db, schemas.LocationOut, updated_location)
 
 
 @router.delete("/{id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_location(id: int, db: Session = Depends(get_session), current_user: models.User = Depends(login_manager)):    
-    location = db.query(models.Location).filter(models.Location.id == id).first() # type: models.Location
+async def delete_location(id: int, db: AsyncSession = Depends(get_async_session), current_user: models.User = Depends(login_manager)):
+    query = select(models.Location).filter(models.Location.id == id)
+    location = (await db.execute(query)).scalars().first() # type: models.Location
 
     if location == None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Location with id: {id} does not exist.")
 
-    location.delete(session=db)
+    await db.run_sync(location.delete, current_user)
+    response_cache.invalidate("location")
 
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
-@router.get('/{id}', response_model=schemas.LocationOut)
-async def get_location_by_id(id: int, db: Session = Depends(get_session)):
-    location = db.query(models.Location).filter(models.Location.id == id).first()
-    if not location:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Location with id: {id} does not exist")
+@router.get('/{id}/descendants', response_model=schemas.LocationNodeListOut)
+async def get_location_descendants(id: int, db: AsyncSession = Depends(get_async_session)):
+    await get_location_or_404(db, id)
+    query = models.Location.descendants_query(id).add_columns(models.locationclosure_table.c.depth)
+    return {"items": [
+        {"id": location.id, "name": location.name, "parent_location_id": location.parent_location_id, "depth": depth}
+        for location, depth in await db.execute(query)
+    ]}
 
-    return location
+
+@router.get('/{id}/ancestors', response_model=schemas.LocationNodeListOut)
+async def get_location_ancestors(id: int, db: AsyncSession = Depends(get_async_session)):
+    await get_location_or_404(db, id)
+    query = models.Location.ancestors_query(id).add_columns(models.locationclosure_table.c.depth)
+    return {"items": [
+        {"id": location.id, "name": location.name, "parent_location_id": location.parent_location_id, "depth": depth}
+        for location, depth in await db.execute(query)
+    ]}
+
+
+@router.get('/{id}/equipment', response_model=schemas.EquipmentListOut)
+async def get_location_equipment(id: int, page: PageParams = Depends(), selection: FieldParams = Depends(), db: AsyncSession = Depends(get_async_session)):
+    projection = Projection(schemas.EquipmentOut, models.Equipment, selection)
+    await get_location_or_404(db, id, load_only(models.Location.id))
+    query = models.Location.equipment_query(id, projection.select())
+    return render(await projection.page(db, query, page))
+
+
+@router.get('/{id}', response_model=schemas.LocationOut)
+async def get_location_by_id(id: int, request: Request, response: Response, selection: FieldParams = Depends(), db: AsyncSession = Depends(get_async_session)):
+    not_modified = await etags.conditional(db, request, response, location_etag_query(id))
+    if not_modified:
+        return not_modified
+    location = await get_location_or_404(db, id, load_only(*load_columns(models.Location, schemas.LocationOut, selection)))
+    await load_trees(db, [location], selection)
+    return render(await to_data(db, schemas.LocationOut, location, selection), response)
 
 
 @router.get('/', response_model=schemas.LocationListOut)
-async def get_location(name: str="", db: Session = Depends(get_session)):
-    locations = db.query(models.Location).filter(models.Location.name.ilike("%" + name + "%")).all()
-    return {"items": locations}
\ No newline at end of file
+async def get_location(request: Request, response: Response, name: str="", page: PageParams = Depends(), selection: FieldParams = Depends(), db: AsyncSession = Depends(get_async_session)):
+    cached = response_cache.get(request)
+    if cached:
+        return cached
+
+    query = select(models.Location).filter(models.Location.name.ilike("%" + name + "%")).options(load_only(*load_columns(models.Location, schemas.LocationOut, selection)))
+    page_data = await paginate(db, query, models.Location, page)
+    await load_trees(db, page_data["items"], selection)
+    return response_cache.put(request, response, render(await to_data(db, schemas.LocationOut, page_data, selection)), tags=("location",))
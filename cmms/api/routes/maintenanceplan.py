@@ -1,12 +1,20 @@
 from datetime import datetime
 from typing import List
-from fastapi import FastAPI, Response, status, HTTPException, Depends, APIRouter, Path
-from sqlalchemy.orm import Session
-
-from ...enums import WorkType
-from .. import models, schemas
-from cmms.database import get_session
+from fastapi import FastAPI, Request, Response, status, HTTPException, Depends, APIRouter, Path
+from sqlalchemy import select, update, delete, func
+from sqlalchemy.orm import Session, aliased, load_only
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from cmms.enums import WorkType
+from cmms import models, catalogs
+from cmms.api import schemas, etags
+from cmms.database import get_async_session, to_schema
 from cmms.api.extensions import login_manager
+from cmms.api.pagination import PageParams, paginate
+from cmms.api.responsecache import response_cache
+from cmms.api.projections import render
+from cmms.api.fieldsets import FieldParams, load_columns, load_audit_users, to_data
 
 
 router = APIRouter(
@@ -15,9 +23,97 @@ router = APIRouter(
 )
 
 
+# Keeps IN lists well below the bind parameter limits of MySQL and SQLite.
+DELETE_CHUNK_SIZE = 500
+
+
+def chunked(ids: List[int], size: int = None):
+    size = size or DELETE_CHUNK_SIZE
+    for index in range(0, len(ids), size):
+        yield ids[index:index + size]
+
+
+def get_meter_unit_id(db: Session, name: str) -> int:
+    """Returns the id of a meter unit from the catalog, creating the unit if it does not exist."""
+    meter_unit_id = catalogs.meter_unit.id_of(db, name)
+    if meter_unit_id is None:
+        meter_unit = models.MeterUnit(name=name)
+        db.add(meter_unit)
+        db.flush()
+        meter_unit_id = meter_unit.id
+        catalogs.meter_unit.invalidate()
+    return meter_unit_id
+
+
+def plan_etag_query(id: int):
+    """Tag columns of a plan, the plans below it and all their activities."""
+    plan = aliased(models.MaintenancePlan)
+    activity = models.MaintenanceActivity
+    children = (
+        select(func.count(plan.id.distinct()), func.max(plan.date_modified), func.count(activity.id), func.max(activity.date_modified))
+        .select_from(plan)
+        .outerjoin(activity, activity.plan_id == plan.id)
+        .where(plan.id.in_(models.MaintenancePlan.subtree_ids([id])))
+    )
+    return etags.tree_query(models.MaintenancePlan, id, children)
+
+
+async def load_plan_trees(db: AsyncSession, plans: List[models.MaintenancePlan], selection: FieldParams = None) -> None:
+    """Loads everything MaintenancePlanOut serializes for the given plans in a fixed number of queries.
+
+    One recursive CTE selects the plan subtrees, then activities, meter units and audit users
+    are loaded with one IN query each. The relationships are set as committed values, so
+    serializing the trees does not lazy load, however deep or wide they are.
+    With a selection only its columns are loaded and relationships it does not expand are skipped.
+    """
+    if not plans:
+        return
+    selection = selection or FieldParams.every()
+    activity_selection = selection.nested("activities")
+    load_activities = selection.expands("activities")
+
+    tree_plans = list(plans)
+    tree_ids = [plan.id for plan in plans]
+    if selection.expands("children"):
+        tree_ids = models.MaintenancePlan.subtree_ids(tree_ids)
+        columns = load_columns(models.MaintenancePlan, schemas.MaintenancePlanOut, selection) + [models.MaintenancePlan.parent_plan_id]
+        query = select(models.MaintenancePlan).where(models.MaintenancePlan.id.in_(tree_ids)).order_by(models.MaintenancePlan.id).options(load_only(*columns))
+        tree_plans = (await db.execute(query)).scalars().all() # type: list[models.MaintenancePlan]
+
+    activities = [] # type: list[models.MaintenanceActivity]
+    if load_activities:
+        columns = load_columns(models.MaintenanceActivity, schemas.MaintenanceActivityOut, activity_selection) + [models.MaintenanceActivity.plan_id]
+        query = select(models.MaintenanceActivity).where(models.MaintenanceActivity.plan_id.in_(tree_ids)).order_by(models.MaintenanceActivity.id).options(load_only(*columns))
+        activities = (await db.execute(query)).scalars().all()
+
+    meter_unit_ids = {activity.meter_unit_id for activity in activities if activity.meter_unit_id is not None} if activity_selection.expands("meter_unit") else set()
+    meter_units = {}
+    if meter_unit_ids:
+        query = select(models.MeterUnit).where(models.MeterUnit.id.in_(meter_unit_ids))
+        meter_units = {meter_unit.id: meter_unit for meter_unit in (await db.execute(query)).scalars()}
+
+    plans_by_id = {plan.id: plan for plan in tree_plans}
+    children = {}
+    activities_by_plan = {}
+    if selection.expands("children"):
+        for plan in tree_plans:
+            children.setdefault(plan.parent_plan_id, []).append(plan)
+    for activity in activities:
+        activities_by_plan.setdefault(activity.plan_id, []).append(activity)
+        set_committed_value(activity, "plan", plans_by_id.get(activity.plan_id))
+        if activity_selection.expands("meter_unit"):
+            set_committed_value(activity, "meter_unit", meter_units.get(activity.meter_unit_id))
+    for plan in tree_plans:
+        if selection.expands("children"):
+            set_committed_value(plan, "children", children.get(plan.id, []))
+        if load_activities:
+            set_committed_value(plan, "activities", activities_by_plan.get(plan.id, []))
+    await load_audit_users(db, (tree_plans, selection), (activities, activity_selection))
+
+
 @router.post("/create", response_model=schemas.MaintenancePlanOut)
-async def create_maintenance_plan(maintenance_plan: schemas.MaintenancePlanIn, db: Session = Depends(get_session), current_user: models.User = Depends(login_manager)):
-    def create_plan(plan: dict) -> models.MaintenancePlan:
+async def create_maintenance_plan(maintenance_plan: schemas.MaintenancePlanIn, db: AsyncSession = Depends(get_async_session), current_user: models.User = Depends(login_manager)):
+    def create_plan(db: Session, plan: dict) -> models.MaintenancePlan:
         plan_obj = db.query(models.MaintenancePlan).filter(models.MaintenancePlan.name == plan["name"]).first() # type: models.MaintenancePlan
         if plan_obj:
             raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Maintenance Plan '{plan['name']}' already exists.")
@@ -34,14 +130,7 @@ async def create_maintenance_plan(maintenance_plan: schemas.MaintenancePlanIn, d
             for activity_dict in activities:
                 meter_unit_name = activity_dict.pop("meter_unit_name", None) # type: str
 
-                if meter_unit_name:
-                    meter_unit = db.query(models.MeterUnit).filter(models.MeterUnit.name == meter_unit_name).first()
-                    if not meter_unit:
-                        meter_unit = models.MeterUnit(name=meter_unit_name)
-                        db.add(meter_unit)
-                else:
-                    meter_unit = None
-                activity_dict["meter_unit"] = meter_unit
+                activity_dict["meter_unit_id"] = get_meter_unit_id(db, meter_unit_name) if meter_unit_name else None
                 
                 if activity_dict["shutdown_duration_days"] and activity_dict["shutdown_duration_days"] > 0:
                     activity_dict["requires_shutdown"] = True
@@ -50,8 +139,8 @@ async def create_maintenance_plan(maintenance_plan: schemas.MaintenancePlanIn, d
                     activity_dict["requires_shutdown"] = False
                 
                 if not ((activity_dict["date_regimen"] and activity_dict["date_frequency"]) \
-                    or (activity_dict["meter_unit"] and activity_dict["meter_frequency"]) \
-                    or (activity_dict["date_regimen"] and activity_dict["date_frequency"] and  activity_dict["meter_unit"] and activity_dict["meter_frequency"])):
+                    or (activity_dict["meter_unit_id"] and activity_dict["meter_frequency"]) \
+                    or (activity_dict["date_regimen"] and activity_dict["date_frequency"] and  activity_dict["meter_unit_id"] and activity_dict["meter_frequency"])):
                     raise HTTPException(
                         status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
                         detail=f"Maintenance Plan activity '{plan['name']}'-'{activity_dict['name']}' must a frequency type. Eather date_frequency and/or meter_frequency."
@@ -100,7 +189,7 @@ async def create_maintenance_plan(maintenance_plan: schemas.MaintenancePlanIn, d
         if children and len(children) > 0:
             db.commit()
             for child_plan in children:
-                child_plan_obj = create_plan(plan=child_plan)
+                child_plan_obj = create_plan(db, plan=child_plan)
                 child_plan_obj.parent_plan_id = maintenance_plan.id
                 db.commit()
         else:
@@ -108,15 +197,22 @@ async def create_maintenance_plan(maintenance_plan: schemas.MaintenancePlanIn, d
             db.refresh(maintenance_plan)
         
         return maintenance_plan
-                    
-    return create_plan(plan=maintenance_plan.dict())
+
+    try:
+        new_maintenance_plan = await db.run_sync(create_plan, maintenance_plan.dict())
+    finally:
+        # create_plan commits plan by plan, a failure half way still changed the tree.
+        response_cache.invalidate("maintenance_plan")
+    await load_plan_trees(db, [new_maintenance_plan])
+    return await to_schema(db, schemas.MaintenancePlanOut, new_maintenance_plan)
 
 
 @router.put("/{id}", response_model=schemas.MaintenancePlanOut)
-async def update_maintenance_plan(id: int, maintenance_plan: schemas.UpdateMaintenancePlanIn, db: Session = Depends(get_session), current_user: models.User = Depends(login_manager)):
-    maintenance_plan_obj = db.query(models.MaintenancePlan).filter(models.MaintenancePlan.id == id).first() # type: models.MaintenancePlan
+async def update_maintenance_plan(id: int, maintenance_plan: schemas.UpdateMaintenancePlanIn, db: AsyncSession = Depends(get_async_session), current_user: models.User = Depends(login_manager)):
+    query = select(models.MaintenancePlan).filter(models.MaintenancePlan.id == id)
+    maintenance_plan_obj = (await db.execute(query)).scalars().first() # type: models.MaintenancePlan
 
-    def update_plan(plan: dict) -> models.MaintenancePlan:
+    def update_plan(db: Session, plan: dict) -> models.MaintenancePlan:
         plan_query = db.query(models.MaintenancePlan).filter(models.MaintenancePlan.id == plan["id"])
         plan_obj = plan_query.first() # type: models.MaintenancePlan
 
@@ -130,15 +226,7 @@ async def update_maintenance_plan(id: int, maintenance_plan: schemas.UpdateMaint
             for activity_dict in activities:
                 meter_unit_name = activity_dict.pop("meter_unit_name", None) # type: str
 
-                if meter_unit_name:
-                    meter_unit = db.query(models.MeterUnit).filter(models.MeterUnit.name == meter_unit_name).first()
-                    if not meter_unit:
-                        meter_unit = models.MeterUnit(name=meter_unit_name)
-                        db.add(meter_unit)
-                        db.commit()
-                    activity_dict["meter_unit_id"] = meter_unit.id
-                else:
-                    activity_dict["meter_unit_id"] = None
+                activity_dict["meter_unit_id"] = get_meter_unit_id(db, meter_unit_name) if meter_unit_name else None
                 
                 if activity_dict["shutdown_duration_days"] and activity_dict["shutdown_duration_days"] > 0:
                     activity_dict["requires_shutdown"] = True
@@ -214,7 +302,7 @@ async def update_maintenance_plan(id: int, maintenance_plan: schemas.UpdateMaint
 
         if children and len(children) > 0:
             for child_plan in children:
-                child_plan_obj = update_plan(plan=child_plan)
+                child_plan_obj = update_plan(db, plan=child_plan)
                 child_plan_obj.parent_plan_id = plan_obj.id
                 db.commit()
         
@@ -223,46 +311,72 @@ async def update_maintenance_plan(id: int, maintenance_plan: schemas.UpdateMaint
         maintenance_plan_obj.date_modified = datetime.now()
         db.commit()
         return maintenance_plan_obj
-                    
-    return update_plan(plan=maintenance_plan.dict())
 
+    try:
+        updated_maintenance_plan = await db.run_sync(update_plan, maintenance_plan.dict())
+    finally:
+        response_cache.invalidate("maintenance_plan")
+    await load_plan_trees(db, [updated_maintenance_plan])
+    return await to_schema(db, schemas.MaintenancePlanOut, updated_maintenance_plan)
 
-@router.delete("/{id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_maintenance_plan(id: int, db: Session = Depends(get_session), current_user: models.User = Depends(login_manager)):
-    maintenance_plan = db.query(models.MaintenancePlan).filter(models.MaintenancePlan.id == id).first() # type: models.MaintenancePlan
-
-    if maintenance_plan == None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Equipment with id: {id} does not exist.")
-
-    def delete_plan(plan: models.MaintenancePlan) -> None:
-        if len(plan.children) > 0:
-            for child in plan.children:
-                for activity in child.activities:
-                    db.delete(activity)
-                delete_plan(child)
-                db.delete(child)
-        else:
-            for activity in plan.activities:
-                db.delete(activity)
-        db.delete(plan)
-    
-    delete_plan(maintenance_plan)
 
-    db.commit()
+@router.delete("/{id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_maintenance_plan(id: int, db: AsyncSession = Depends(get_async_session), current_user: models.User = Depends(login_manager)):
+    query = select(models.MaintenancePlan.id).filter(models.MaintenancePlan.id == id)
+    if (await db.execute(query)).first() == None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Maintenance Plan with id: {id} does not exist.")
+
+    # The ids are materialized first because MySQL can not delete from a table the same statement selects from.
+    plan_ids = (await db.execute(models.MaintenancePlan.subtree_ids([id]))).scalars().all()
+    activity_ids = []
+    for chunk in chunked(plan_ids):
+        query = select(models.MaintenanceActivity.id).where(models.MaintenanceActivity.plan_id.in_(chunk))
+        activity_ids.extend((await db.execute(query)).scalars().all())
+
+    for chunk in chunked(activity_ids):
+        query = select(models.WorkOrderItem.id).where(models.WorkOrderItem.maintenance_activity_id.in_(chunk)).limit(1)
+        if (await db.execute(query)).first():
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Maintenance Plan with id: {id} has activities used by work orders.")
+
+    for chunk in chunked(activity_ids):
+        await db.execute(delete(models.maintenanceactivitytofile_table).where(models.maintenanceactivitytofile_table.c.maintenance_activity_to_file_id.in_(chunk)))
+        await db.execute(delete(models.maintenanceactivitytoimage_table).where(models.maintenanceactivitytoimage_table.c.maintenance_activity_to_image_id.in_(chunk)))
+        await db.execute(delete(models.MaintenanceActivity).where(models.MaintenanceActivity.id.in_(chunk)).execution_options(synchronize_session=False))
+
+    for chunk in chunked(plan_ids):
+        await db.execute(delete(models.maintenanceplantofile_table).where(models.maintenanceplantofile_table.c.maintenance_plan_id.in_(chunk)))
+        await db.execute(update(models.Equipment).where(models.Equipment.maintenance_plan_id.in_(chunk)).values(maintenance_plan_id=None).execution_options(synchronize_session=False))
+        await db.execute(update(models.MaintenancePlan).where(models.MaintenancePlan.id.in_(chunk)).values(parent_plan_id=None).execution_options(synchronize_session=False))
+    for chunk in chunked(plan_ids):
+        await db.execute(delete(models.MaintenancePlan).where(models.MaintenancePlan.id.in_(chunk)).execution_options(synchronize_session=False))
+
+    await db.commit()
+    response_cache.invalidate("maintenance_plan")
 
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
 @router.get("/{id}", response_model=schemas.MaintenancePlanOut)
-async def get_plan(id: int, db: Session = Depends(get_session)):
-    plan = db.query(models.MaintenancePlan).filter(models.MaintenancePlan.id == id).first() # type: models.MaintenancePlan
+async def get_plan(id: int, request: Request, response: Response, selection: FieldParams = Depends(), db: AsyncSession = Depends(get_async_session)):
+    not_modified = await etags.conditional(db, request, response, plan_etag_query(id))
+    if not_modified:
+        return not_modified
+    query = select(models.MaintenancePlan).filter(models.MaintenancePlan.id == id).options(load_only(*load_columns(models.MaintenancePlan, schemas.MaintenancePlanOut, selection)))
+    plan = (await db.execute(query)).scalars().first() # type: models.MaintenancePlan
     if not plan:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"MaintenancePlan with id: {id} does not exist.")
 
-    return plan
+    await load_plan_trees(db, [plan], selection)
+    return render(await to_data(db, schemas.MaintenancePlanOut, plan, selection), response)
 
 
 @router.get("/", response_model=schemas.MaintenancePlanListOut)
-async def get_plan(name: str = "", db: Session = Depends(get_session)):
-    plans = db.query(models.MaintenancePlan).filter(models.MaintenancePlan.name.ilike("%" + name + "%")).all() # type: list[models.MaintenancePlan]
-    return {"items": plans}
\ No newline at end of file
+async def get_plan(request: Request, response: Response, name: str = "", page: PageParams = Depends(), selection: FieldParams = Depends(), db: AsyncSession = Depends(get_async_session)):
+    cached = response_cache.get(request)
+    if cached:
+        return cached
+
+    query = select(models.MaintenancePlan).filter(models.MaintenancePlan.name.ilike("%" + name + "%")).options(load_only(*load_columns(models.MaintenancePlan, schemas.MaintenancePlanOut, selection)))
+    page_data = await paginate(db, query, models.MaintenancePlan, page)
+    await load_plan_trees(db, page_data["items"], selection)
+    return response_cache.put(request, response, render(await to_data(db, schemas.MaintenancePlanOut, page_data, selection)), tags=("maintenance_plan",))
\ No newline at end of file
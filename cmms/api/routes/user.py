@@ -1,8 +1,13 @@
-from fastapi import FastAPI, Response, status, HTTPException, Depends, APIRouter
-from sqlalchemy.orm import Session
+from fastapi import FastAPI, Request, Response, status, HTTPException, Depends, APIRouter
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from cmms import models
-from cmms.api import schemas
-from cmms.database import get_session
+from cmms.api import schemas, etags
+from cmms.database import get_async_session, to_schema
+from cmms.api.pagination import PageParams, paginate
+from cmms.api.projections import Projection, render
+from cmms.api.fieldsets import FieldParams
+from cmms.passwords import hash_password_async
 
 router = APIRouter(
     prefix="/users",
@@ -10,29 +15,40 @@ router = APIRouter(
 )
 
 
+def user_etag_query(id: int):
+    """Logins and the desktop program change users without touching date_modified, so the tag covers every column UserOut shows."""
+    return select(*[getattr(models.User, key) for key in schemas.UserOut.__fields__]).where(models.User.id == id)
+
+
 @router.post("/create", status_code=status.HTTP_201_CREATED, response_model=schemas.UserOut)
-async def create_user(user: schemas.UserCreate, db: Session = Depends(get_session)):
-    current_user = db.query(models.User).filter(models.User.username == user.username).first()
+async def create_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_async_session)):
+    query = select(models.User).filter(models.User.username == user.username)
+    current_user = (await db.execute(query)).scalars().first()
     if current_user:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"A user with username: {user.username} already exists.")
-    new_user = models.User(**user.dict())
+    new_user = models.User(**user.dict(exclude={"password"}), password_hash=await hash_password_async(user.password))
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
 
-    return new_user
+    return await to_schema(db, schemas.UserOut, new_user)
 
 
 @router.get('/{id}', response_model=schemas.UserOut)
-async def get_user_by_id(id: int, db: Session = Depends(get_session)):
-    user = db.query(models.User).filter(models.User.id == id).first()
+async def get_user_by_id(id: int, request: Request, response: Response, selection: FieldParams = Depends(), db: AsyncSession = Depends(get_async_session)):
+    not_modified = await etags.conditional(db, request, response, user_etag_query(id))
+    if not_modified:
+        return not_modified
+
+    user = await Projection(schemas.UserOut, models.User, selection).one(db, id)
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"User with id: {id} does not exist")
 
-    return user
+    return render(user, response)
 
 
 @router.get('/', response_model=schemas.UserListOut)
-async def get_user(username: str="", db: Session = Depends(get_session)):
-    users = db.query(models.User).filter(models.User.username.ilike("%" + username + "%")).all()
-    return {"items": users}
\ No newline at end of file
+async def get_user(username: str="", page: PageParams = Depends(), selection: FieldParams = Depends(), db: AsyncSession = Depends(get_async_session)):
+    projection = Projection(schemas.UserOut, models.User, selection)
+    query = projection.select().filter(models.User.username.ilike("%" + username + "%"))
+    return render(await projection.page(db, query, page))
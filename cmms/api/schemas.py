@@ -2,7 +2,7 @@ from __future__ import annotations
 from dataclasses import Field
 from pydantic import BaseModel, Field
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional, List, Dict
 from cmms import enums
 
 
@@ -27,6 +27,7 @@ class UserOut(BaseModel):
 
 class UserListOut(BaseModel):
     items: List[UserOut]
+    next_cursor: Optional[str] = Field(None, description="Pass as 'after' to get the next page. None on the last page.")
 
     class Config:
         orm_mode = True
@@ -140,6 +141,34 @@ class EquipmentOut(AuditOut):
 
 class EquipmentListOut(BaseModel):
     items: List[EquipmentOut]
+    next_cursor: Optional[str] = Field(None, description="Pass as 'after' to get the next page. None on the last page.")
+
+    class Config:
+        orm_mode = True
+
+
+class EquipmentImportErrorOut(BaseModel):
+    row: int = Field(description="Zero based index of the row in the uploaded file.")
+    name: Optional[str] = None
+    error: str
+
+
+class EquipmentImportOut(BaseModel):
+    inserted: int
+    failed: int
+    errors: List[EquipmentImportErrorOut]
+
+
+class EquipmentSearchResultOut(BaseModel):
+    score: float = Field(description="Relevance of the match, higher is better.")
+    equipment: EquipmentOut
+
+    class Config:
+        orm_mode = True
+
+
+class EquipmentSearchOut(BaseModel):
+    items: List[EquipmentSearchResultOut]
 
     class Config:
         orm_mode = True
@@ -147,6 +176,7 @@ class EquipmentListOut(BaseModel):
 
 class EquipmentTypeListOut(BaseModel):
     items: List[EquipmentTypeOut]
+    next_cursor: Optional[str] = Field(None, description="Pass as 'after' to get the next page. None on the last page.")
 
     class Config:
         orm_mode = True
@@ -154,6 +184,7 @@ class EquipmentTypeListOut(BaseModel):
 
 class EquipmentFailureListOut(BaseModel):
     items: List[EquipmentFailureOut]
+    next_cursor: Optional[str] = Field(None, description="Pass as 'after' to get the next page. None on the last page.")
 
     class Config:
         orm_mode = True
@@ -175,6 +206,7 @@ class CauseOfEquipmentFailureOut(AuditOut):
 
 class CauseOfEquipmentFailureListOut(BaseModel):
     items: List[CauseOfEquipmentFailureOut]
+    next_cursor: Optional[str] = Field(None, description="Pass as 'after' to get the next page. None on the last page.")
 
     class Config:
         orm_mode = True
@@ -294,6 +326,7 @@ class MaintenancePlanOut(AuditOut):
 
 class MaintenancePlanListOut(BaseModel):
     items: List[MaintenancePlanOut]
+    next_cursor: Optional[str] = Field(None, description="Pass as 'after' to get the next page. None on the last page.")
 
     class Config:
         orm_mode = True
@@ -301,9 +334,15 @@ class MaintenancePlanListOut(BaseModel):
 
 class LocationIn(BaseModel):
     name: str
+    parent_location_id: Optional[int] = Field(default=None, description="Location to create the new location under.")
     children: List[LocationIn] = None
 
 
+class LocationUpdate(BaseModel):
+    name: str
+    parent_location_id: Optional[int] = Field(default=None, description="Moves the location and everything below it. None makes it a top level location.")
+
+
 class LocationOut(AuditOut):
     id: int
     name: str
@@ -315,6 +354,110 @@ class LocationOut(AuditOut):
 
 class LocationListOut(BaseModel):
     items: List[LocationOut]
+    next_cursor: Optional[str] = Field(None, description="Pass as 'after' to get the next page. None on the last page.")
+
+    class Config:
+        orm_mode = True
+
+
+class LocationNodeOut(BaseModel):
+    id: int
+    name: str
+    parent_location_id: Optional[int]
+    depth: int = Field(description="Number of levels between this location and the one that was asked for.")
+
+
+class LocationNodeListOut(BaseModel):
+    items: List[LocationNodeOut]
+
+class AttachmentOut(AuditOut):
+    id: int
+    filename: str
+    original_filename: Optional[str] = None
+    mime_type: Optional[str] = None
+    size: Optional[int] = Field(None, description="Bytes.")
+    sha256: Optional[str] = Field(None, description="SHA-256 of the content, also the ETag of its download.")
 
     class Config:
-        orm_mode = True
\ No newline at end of file
+        orm_mode = True
+
+
+class AttachmentListOut(BaseModel):
+    items: List[AttachmentOut]
+    next_cursor: Optional[str] = Field(None, description="Pass as 'after' to get the next page. None on the last page.")
+
+    class Config:
+        orm_mode = True
+
+
+class PoolStatisticsOut(BaseModel):
+    name: str
+    size: int
+    checked_in: int
+    checked_out: int
+    overflow: int
+    checkouts: int
+    connects: int
+    wait_timeouts: int
+    pre_pings: int
+    pre_ping_failures: int
+    total_wait_seconds: float
+    max_wait_seconds: float
+    wait_histogram_ms: Dict[str, int] = Field(description="Number of checkouts per wait time bucket in milliseconds.")
+
+
+class PoolStatisticsListOut(BaseModel):
+    items: List[PoolStatisticsOut]
+
+
+class CatalogStatisticsOut(BaseModel):
+    name: str
+    size: int
+    loaded: bool
+    age_seconds: float
+    hits: int
+    misses: int
+    loads: int
+    invalidations: int
+
+
+class CatalogStatisticsListOut(BaseModel):
+    items: List[CatalogStatisticsOut]
+
+
+class UserCacheStatisticsOut(BaseModel):
+    size: int
+    max_size: int
+    ttl_seconds: int
+    hits: int
+    misses: int
+    expirations: int
+    evictions: int
+    invalidations: int
+    stale_puts: int
+
+
+class RouteCacheStatisticsOut(BaseModel):
+    route: str
+    hits: int
+    misses: int
+    hit_rate: float
+
+
+class ResponseCacheStatisticsOut(BaseModel):
+    entries: int
+    size_bytes: int
+    max_bytes: int
+    evictions: int
+    invalidations: int
+    stale_puts: int
+    routes: List[RouteCacheStatisticsOut]
+
+
+class LoginLogStatisticsOut(BaseModel):
+    running: bool
+    pending: int
+    max_pending: int
+    written: int
+    batches: int
+    failed: int
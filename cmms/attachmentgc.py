@@ -0,0 +1,222 @@
+"""Garbage collection of attachments nothing refers to anymore.
+
+remove_file, remove_image and the attachment DELETE route only delete the association row, and
+deleting a maintenance plan leaves its files, so file_data and image_data rows and their blobs
+stay behind. collect finds the rows no association table refers to and deletes them a batch at
+a time, each batch in its own short transaction, pausing between batches so the job can run
+next to normal traffic:
+
+    python -m cmms gc-attachments --grace-hours 24 --batch-size 500 --pause 0.2 --max-rows 10000
+
+Rows created in the last grace period are kept, an upload may not be attached yet. The note
+rows of the deleted rows are deleted with them. A blob is deleted, with its thumbnails, once no
+file_data or image_data row has its hash and it was not stored again in the grace period either,
+so an upload of the same content racing the collector keeps it. Both are checked again for each
+blob right before it is deleted, an upload stores its blob before inserting its row.
+
+Blobs can also be left without any row, when an upload was stored but inserting its row failed.
+After the tables, collect_store goes through the keys of the blob store and deletes the blobs
+older than the grace period no row has, and the temporary files of writes older than the grace
+period, which killed uploads leave in the staging folder and next to the blobs. Runs can be
+stopped at any time and the next one continues with what is left.
+"""
+from __future__ import annotations
+import logging
+import time
+from itertools import islice
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable
+from sqlalchemy import Table, and_, delete, exists, func, not_, select, union
+from sqlalchemy.engine import Connection, Engine
+from cmms import models
+from cmms.blobstore import BlobStore, get_blob_store
+
+
+logger = logging.getLogger("backend")
+
+
+GC_BATCH_SIZE = 500
+GC_GRACE_PERIOD = timedelta(hours=24)
+# Seconds to sleep after each batch.
+GC_PAUSE_SECONDS = 0.2
+
+
+@dataclass
+class CollectResult:
+    table: str
+    rows: int = 0
+    notes: int = 0
+    blobs: int = 0
+    blob_bytes: int = 0
+    database_bytes: int = 0
+    temp_files: int = 0
+    temp_bytes: int = 0
+
+    @property
+    def reclaimed_bytes(self) -> int:
+        return self.blob_bytes + self.database_bytes + self.temp_bytes
+
+
+def referencing_tables(model) -> list[Table]:
+    """The tables with a foreign key to the model's id, the association tables of the attachments."""
+    table = model.__table__
+    return [
+        other for other in models.DeclarativeBase.metadata.tables.values()
+        if any(foreign_key.column is table.c.id for foreign_key in other.foreign_keys)
+    ]
+
+
+def unreferenced(model):
+    """Where clause of the rows of model no association table refers to."""
+    table = model.__table__
+    clauses = []
+    for other in referencing_tables(model):
+        column = next(foreign_key.parent for foreign_key in other.foreign_keys if foreign_key.column is table.c.id)
+        clauses.append(not_(exists().where(column == table.c.id)))
+    return and_(*clauses)
+
+
+def shared_hashes(connection: Connection, hashes: set[str]) -> set[str]:
+    """The hashes some file_data or image_data row still has."""
+    query = union(*(
+        select(model.__table__.c.sha256).where(model.__table__.c.sha256.in_(hashes))
+        for model in (models.FileData, models.ImageData)
+    ))
+    return set(connection.execute(query).scalars())
+
+
+def delete_notes(connection: Connection, note_ids: set[int]) -> int:
+    """Deletes the notes of deleted attachments, unless something else still refers to them."""
+    if not note_ids:
+        return 0
+    table = models.Note.__table__
+    return connection.execute(delete(table).where(table.c.id.in_(note_ids), unreferenced(models.Note))).rowcount
+
+
+def delete_blobs(engine: Engine, store: BlobStore, hashes: set[str], cutoff: float, result: CollectResult) -> None:
+    """Deletes the blobs of hashes stored before cutoff, checking each for a row and its modified
+    time right before deleting it, so a blob an upload stored or attached since is kept."""
+    for sha256 in hashes:
+        # A connection per check, so it sees the rows committed since the last one.
+        with engine.connect() as connection:
+            if shared_hashes(connection, {sha256}):
+                continue
+        try:
+            if store.modified_time(sha256) > cutoff:
+                continue
+            size = store.size(sha256)
+        except FileNotFoundError:
+            continue
+        store.delete(sha256)
+        result.blobs += 1
+        result.blob_bytes += size
+
+
+def delete_temp_files(store: BlobStore, cutoff: float, dry_run: bool, result: CollectResult) -> None:
+    """Deletes the temporary files of writes older than cutoff, which no write is using anymore."""
+    for path, modified_time, size in store.temp_files():
+        if modified_time > cutoff:
+            continue
+        if not dry_run:
+            store.delete_temp_file(path)
+        result.temp_files += 1
+        result.temp_bytes += size
+
+
+def collect_model(engine: Engine, store: BlobStore, model, grace_period: timedelta, batch_size: int, pause: float, max_rows: int, dry_run: bool, progress: Callable[[CollectResult], None] = None) -> CollectResult:
+    table = model.__table__
+    result = CollectResult(table.name)
+    cutoff = datetime.now() - grace_period
+    orphaned = and_(unreferenced(model), table.c.date_created < cutoff)
+    last_id = 0
+    while True:
+        query = (
+            select(table.c.id, table.c.sha256, table.c.size, table.c.note_id, func.length(table.c.data))
+            .where(table.c.id > last_id, orphaned)
+            .order_by(table.c.id)
+            .limit(batch_size)
+        )
+        with engine.begin() as connection:
+            batch = connection.execute(query).all()
+            if not batch:
+                break
+            last_id = batch[-1].id
+            ids = [row.id for row in batch]
+            if dry_run:
+                deleted = batch
+            else:
+                # The orphan check is repeated, a row attached since the select is kept.
+                connection.execute(delete(table).where(table.c.id.in_(ids), unreferenced(model)))
+                kept = set(connection.execute(select(table.c.id).where(table.c.id.in_(ids))).scalars())
+                deleted = [row for row in batch if row.id not in kept]
+            note_ids = {row.note_id for row in deleted if row.note_id}
+            notes = len(note_ids) if dry_run else delete_notes(connection, note_ids)
+            sizes = {row.sha256: row.size or 0 for row in deleted if row.sha256}
+            hashes = set(sizes) if dry_run else set(sizes) - shared_hashes(connection, set(sizes))
+
+        result.rows += len(deleted)
+        result.notes += notes
+        result.database_bytes += sum(row[4] or 0 for row in deleted)
+        if dry_run:
+            result.blobs += len(hashes)
+            result.blob_bytes += sum(sizes.values())
+        else:
+            delete_blobs(engine, store, hashes, (datetime.now() - grace_period).timestamp(), result)
+        if progress:
+            progress(result)
+        if max_rows and result.rows >= max_rows:
+            break
+        if pause:
+            time.sleep(pause)
+    return result
+
+
+def collect_store(engine: Engine, store: BlobStore, grace_period: timedelta, batch_size: int, pause: float, dry_run: bool, progress: Callable[[CollectResult], None] = None) -> CollectResult:
+    """Deletes the blobs no file_data or image_data row has, checking batch_size keys per query,
+    and the old temporary files of writes."""
+    result = CollectResult("blob store")
+    cutoff = (datetime.now() - grace_period).timestamp()
+    keys = store.keys()
+    while True:
+        batch = set(islice(keys, batch_size))
+        if not batch:
+            break
+        with engine.connect() as connection:
+            hashes = batch - shared_hashes(connection, batch)
+        if dry_run:
+            for sha256 in hashes:
+                try:
+                    if store.modified_time(sha256) <= cutoff:
+                        result.blobs += 1
+                        result.blob_bytes += store.size(sha256)
+                except FileNotFoundError:
+                    pass
+        else:
+            delete_blobs(engine, store, hashes, cutoff, result)
+        if progress:
+            progress(result)
+        if pause and hashes:
+            time.sleep(pause)
+    delete_temp_files(store, cutoff, dry_run, result)
+    if progress:
+        progress(result)
+    return result
+
+
+def collect(engine: Engine, grace_period: timedelta = GC_GRACE_PERIOD, batch_size: int = GC_BATCH_SIZE, pause: float = GC_PAUSE_SECONDS, max_rows: int = None, dry_run: bool = False, progress: Callable[[CollectResult], None] = None, sweep_store: bool = True) -> list[CollectResult]:
+    """Deletes the file_data and image_data rows no association table refers to, with their
+    notes, and the blobs nothing has anymore, see the module docstring.
+
+    max_rows bounds the rows deleted per table in one run, the batch in progress is finished.
+    sweep_store=False skips going through the blob store for blobs without any row.
+    With dry_run nothing is deleted and the result tells what would be, counting every blob of
+    the orphaned rows, also those other rows share.
+    """
+    store = get_blob_store()
+    results = [collect_model(engine, store, model, grace_period, batch_size, pause, max_rows, dry_run, progress) for model in (models.FileData, models.ImageData)]
+    if sweep_store:
+        results.append(collect_store(engine, store, grace_period, batch_size, pause, dry_run, progress))
+    for result in results:
+        logger.info(f"[SYSTEM] Attachment GC {'(dry run) ' if dry_run else ''}{result.table}: {result.rows} rows, {result.notes} notes, {result.blobs} blobs, {result.reclaimed_bytes} bytes reclaimed.")
+    return results
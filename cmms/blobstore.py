@@ -0,0 +1,360 @@
+"""Content addressed storage for attachment data.
+
+Files and images are stored once per distinct content, named by the SHA-256 of their bytes.
+The file_data and image_data rows keep the hash, size and MIME type, so the same manual attached
+to ten pieces of equipment, a location and a non-routine job is one file in the store.
+
+    store = get_blob_store()
+    sha256, size = store.put_file(upload.file)
+    with store.open(sha256) as f:
+        ...
+
+The backend is chosen with BLOB_STORE_BACKEND:
+
+    filesystem  Files under BLOB_STORE_FOLDER, by default a "Blobs" folder next to the database
+                files, fanned out by the first two byte pairs of the hash: ab/cd/abcd....
+
+Content derived from a blob, like the thumbnails of an image, is stored next to it under a
+variant key, <sha256>.<variant>, and deleted with it.
+
+Blobs are never overwritten, a hash that is already stored is not written again. Writes go to a
+temporary file in the store that is renamed into place, so readers never see a partial blob.
+
+Content that arrives in pieces, like an upload, goes through a BlobWriter, which hashes each
+chunk as it writes it to the staging file and only holds the chunk it is given:
+
+    with store.writer(max_size=config.ATTACHMENT_MAX_UPLOAD_BYTES) as writer:
+        async for chunk in request.stream():
+            writer.write(chunk)
+        sha256, size = writer.commit()
+"""
+from __future__ import annotations
+import hashlib
+import glob
+import os
+import re
+import shutil
+import tempfile
+from typing import BinaryIO, Callable, Iterable, Iterator, Optional
+from cmms import config, errors
+
+
+# Bytes read and hashed at a time when storing a stream.
+CHUNK_SIZE = 1024 * 1024
+
+HASH_LENGTH = 64
+
+# Name prefix of the files of writes in progress, in the staging folder and next to the blobs.
+TEMP_FILE_PREFIX = ".upload-"
+
+VARIANT_PATTERN = re.compile(r"^[a-z0-9]+(\.[a-z0-9]+)*$")
+
+
+def is_sha256(value: str) -> bool:
+    return len(value) == HASH_LENGTH and all(character in "0123456789abcdef" for character in value)
+
+
+def is_key(value: str) -> bool:
+    """True for a SHA-256 or a variant key made by variant_key."""
+    sha256, _, variant = value.partition(".")
+    return is_sha256(sha256) and (not variant or VARIANT_PATTERN.match(variant) is not None)
+
+
+def variant_key(sha256: str, variant: str) -> str:
+    return f"{sha256}.{variant}"
+
+
+class BlobBackend:
+    """Where the blobs are kept. Blobs are keyed by their lower case hex SHA-256, or by a variant
+    key. Deleting a blob deletes its variants.
+    """
+    name = ""
+
+    def exists(self, sha256: str) -> bool:
+        raise NotImplementedError
+
+    def size(self, sha256: str) -> int:
+        raise NotImplementedError
+
+    def modified_time(self, sha256: str) -> float:
+        """When the blob was last stored, as a timestamp. Storing content that is already there
+        counts, so a blob that was just uploaded again is not collected as garbage."""
+        raise NotImplementedError
+
+    def touch(self, sha256: str) -> None:
+        """Marks a blob as just stored, see modified_time."""
+        raise NotImplementedError
+
+    def open(self, sha256: str) -> BinaryIO:
+        """Opens a blob for binary reading. Raises FileNotFoundError when it is not stored."""
+        raise NotImplementedError
+
+    def put(self, sha256: str, chunks: Iterable[bytes]) -> None:
+        """Stores the chunks under sha256, which the caller has already computed."""
+        raise NotImplementedError
+
+    def delete(self, sha256: str) -> None:
+        raise NotImplementedError
+
+    def keys(self) -> Iterator[str]:
+        """Iterates the SHA-256 of every stored blob, variants not included."""
+        raise NotImplementedError
+
+    def temp_files(self) -> Iterator[tuple[str, float, int]]:
+        """Iterates the path, modified time and size of the temporary files of writes, left behind
+        by writes that were killed. Files of writes in progress are included."""
+        return iter(())
+
+    def delete_temp_file(self, path: str) -> None:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    def local_path(self, sha256: str) -> Optional[str]:
+        """The path of a stored blob when it is a local file that can be sent as is, else None."""
+        return None
+
+    def staging_folder(self) -> str:
+        """Where BlobWriter keeps content until its hash is known."""
+        return tempfile.gettempdir()
+
+    def put_staged(self, sha256: str, temp_path: str) -> None:
+        """Stores a staged file under sha256 and removes the staged file."""
+        try:
+            if self.exists(sha256):
+                self.touch(sha256)
+            else:
+                with open(temp_path, "rb") as f:
+                    self.put(sha256, iter(lambda: f.read(CHUNK_SIZE), b""))
+        finally:
+            os.unlink(temp_path)
+
+
+class FileSystemBackend(BlobBackend):
+    name = "filesystem"
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def path(self, key: str) -> str:
+        if not is_key(key):
+            raise ValueError(f"Not a blob key: {key!r}.")
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def exists(self, sha256: str) -> bool:
+        return os.path.isfile(self.path(sha256))
+
+    def size(self, sha256: str) -> int:
+        return os.path.getsize(self.path(sha256))
+
+    def modified_time(self, sha256: str) -> float:
+        return os.path.getmtime(self.path(sha256))
+
+    def touch(self, sha256: str) -> None:
+        os.utime(self.path(sha256))
+
+    def open(self, sha256: str) -> BinaryIO:
+        return open(self.path(sha256), "rb")
+
+    def put(self, sha256: str, chunks: Iterable[bytes]) -> None:
+        path = self.path(sha256)
+        folder = config.ensure_folder(os.path.dirname(path))
+        descriptor, temp_path = tempfile.mkstemp(dir=folder, prefix=TEMP_FILE_PREFIX)
+        try:
+            with os.fdopen(descriptor, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def delete(self, sha256: str) -> None:
+        path = self.path(sha256)
+        paths = [path] + (glob.glob(glob.escape(path) + ".*") if is_sha256(sha256) else [])
+        for path in paths:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def keys(self) -> Iterator[str]:
+        for folder, folders, files in os.walk(self.root):
+            if folder == self.root and "staging" in folders:
+                folders.remove("staging")
+            yield from (name for name in files if is_sha256(name))
+
+    def temp_files(self) -> Iterator[tuple[str, float, int]]:
+        # The staging folder and the temporary files put writes next to their blob.
+        for folder, folders, files in os.walk(self.root):
+            for name in files:
+                if not name.startswith(TEMP_FILE_PREFIX):
+                    continue
+                path = os.path.join(folder, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_mtime, stat.st_size
+
+    def local_path(self, sha256: str) -> Optional[str]:
+        return self.path(sha256)
+
+    def staging_folder(self) -> str:
+        return config.ensure_folder(os.path.join(self.root, "staging"))
+
+    def put_staged(self, sha256: str, temp_path: str) -> None:
+        """Renames the staged file into place, the staging folder is on the same file system."""
+        if self.exists(sha256):
+            self.touch(sha256)
+            os.unlink(temp_path)
+            return
+        config.ensure_folder(os.path.dirname(self.path(sha256)))
+        os.replace(temp_path, self.path(sha256))
+
+
+class BlobTooLargeError(errors.CMMSError):
+    """Raised by BlobWriter when content grows past its max_size."""
+
+
+class BlobWriter:
+    """Hashes content and writes it to a staging file as it arrives, see the module docstring.
+
+    Used as a context manager, the staging file is removed when the block exits without commit.
+    """
+
+    def __init__(self, backend: BlobBackend, max_size: int = None):
+        self.backend = backend
+        self.max_size = max_size
+        self.size = 0
+        self._digest = hashlib.sha256()
+        descriptor, self._temp_path = tempfile.mkstemp(dir=backend.staging_folder(), prefix=TEMP_FILE_PREFIX)
+        self._file = os.fdopen(descriptor, "wb")
+
+    def write(self, chunk: bytes) -> None:
+        self.size += len(chunk)
+        if self.max_size is not None and self.size > self.max_size:
+            raise BlobTooLargeError(f"Content is larger than {self.max_size} bytes.")
+        self._digest.update(chunk)
+        self._file.write(chunk)
+
+    def commit(self) -> tuple[str, int]:
+        """Stores the content written so far.
+
+        Returns:
+            tuple[str, int]: The SHA-256 and size of the content.
+        """
+        self._file.close()
+        sha256 = self._digest.hexdigest()
+        self.backend.put_staged(sha256, self._temp_path)
+        self._temp_path = None
+        return sha256, self.size
+
+    def abort(self) -> None:
+        if self._temp_path is None:
+            return
+        self._file.close()
+        os.unlink(self._temp_path)
+        self._temp_path = None
+
+    def __enter__(self) -> BlobWriter:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.abort()
+
+
+class BlobStore:
+    """Hashes content while storing it and skips content that is already stored."""
+
+    def __init__(self, backend: BlobBackend):
+        self.backend = backend
+
+    def writer(self, max_size: int = None) -> BlobWriter:
+        return BlobWriter(self.backend, max_size)
+
+    def put_file(self, f: BinaryIO) -> tuple[str, int]:
+        """Stores the rest of a binary file object, read CHUNK_SIZE bytes at a time.
+
+        Returns:
+            tuple[str, int]: The SHA-256 and size of the content.
+        """
+        with self.writer() as writer:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                writer.write(chunk)
+            return writer.commit()
+
+    def put_bytes(self, data: bytes) -> tuple[str, int]:
+        """Stores content that is already in memory, see put_file."""
+        sha256 = hashlib.sha256(data).hexdigest()
+        if self.backend.exists(sha256):
+            self.backend.touch(sha256)
+        else:
+            self.backend.put(sha256, [data])
+        return sha256, len(data)
+
+    def put_variant(self, sha256: str, variant: str, data: bytes) -> str:
+        """Stores content derived from a blob next to it, replacing an older version.
+
+        Returns:
+            str: The variant key to open it with.
+        """
+        key = variant_key(sha256, variant)
+        self.backend.put(key, [data])
+        return key
+
+    def put_path(self, file_path: str) -> tuple[str, int]:
+        with open(file_path, "rb") as f:
+            return self.put_file(f)
+
+    def open(self, sha256: str) -> BinaryIO:
+        return self.backend.open(sha256)
+
+    def read(self, sha256: str) -> bytes:
+        with self.open(sha256) as f:
+            return f.read()
+
+    def copy_to(self, sha256: str, file_path: str) -> None:
+        with self.open(sha256) as source, open(file_path, "wb") as target:
+            shutil.copyfileobj(source, target, CHUNK_SIZE)
+
+    def exists(self, sha256: str) -> bool:
+        return self.backend.exists(sha256)
+
+    def local_path(self, sha256: str) -> Optional[str]:
+        return self.backend.local_path(sha256)
+
+    def size(self, sha256: str) -> int:
+        return self.backend.size(sha256)
+
+    def modified_time(self, sha256: str) -> float:
+        return self.backend.modified_time(sha256)
+
+    def delete(self, sha256: str) -> None:
+        self.backend.delete(sha256)
+
+    def keys(self) -> Iterator[str]:
+        return self.backend.keys()
+
+    def temp_files(self) -> Iterator[tuple[str, float, int]]:
+        return self.backend.temp_files()
+
+    def delete_temp_file(self, path: str) -> None:
+        self.backend.delete_temp_file(path)
+
+
+BACKEND_TYPES = {
+    "filesystem": lambda: FileSystemBackend(config.BLOB_STORE_FOLDER),
+} # type: dict[str, Callable[[], BlobBackend]]
+
+
+_blob_store = None # type: Optional[BlobStore]
+
+
+def get_blob_store() -> BlobStore:
+    """Returns the configured store, creating it on first use."""
+    global _blob_store
+    if _blob_store is None:
+        _blob_store = BlobStore(BACKEND_TYPES[config.BLOB_STORE_BACKEND]())
+    return _blob_store
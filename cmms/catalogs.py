@@ -0,0 +1,128 @@
+"""In process name to id caches for the small reference tables.
+
+Each catalog loads its whole table with one query and answers name lookups from memory until it
+is invalidated or its TTL runs out. Routes that write to a catalog table invalidate it after
+committing. Names that are not in a loaded map are looked up with one IN query per call before
+being reported missing, so a row added by another process is found before the TTL expires.
+
+The lookups take a sync Session, async routes call them through run_sync:
+
+    failure_ids = await db.run_sync(catalogs.equipment_failure.ids, names)
+"""
+from __future__ import annotations
+import time
+import threading
+from typing import Iterable
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from cmms import config, models
+
+
+class CatalogCache:
+    """Name to id map of one reference table."""
+
+    def __init__(self, name: str, model):
+        self.name = name
+        self.model = model
+        self._lock = threading.Lock()
+        self._ids_by_name = None # type: dict[str, int]
+        self._loaded_at = 0.0
+        # Bumped by invalidate, so a load that raced with a write does not store a stale map.
+        self._generation = 0
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.loads = 0
+            self.invalidations = 0
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._ids_by_name = None
+            self._generation += 1
+            self.invalidations += 1
+
+    def _current(self) -> dict[str, int]:
+        """Returns the loaded map, None when it was never loaded, invalidated or is older than the TTL."""
+        if self._ids_by_name is None or time.monotonic() - self._loaded_at > config.CATALOG_CACHE_TTL_SECONDS:
+            return None
+        return self._ids_by_name
+
+    def _load(self, session: Session) -> dict[str, int]:
+        generation = self._generation
+        ids_by_name = {name: id for id, name in session.execute(select(self.model.id, self.model.name))}
+        with self._lock:
+            if generation == self._generation:
+                self._ids_by_name = ids_by_name
+                self._loaded_at = time.monotonic()
+            self.loads += 1
+        return ids_by_name
+
+    def mapping(self, session: Session) -> dict[str, int]:
+        """Returns a copy of the full name to id map."""
+        ids_by_name = self._current()
+        if ids_by_name is None:
+            ids_by_name = self._load(session)
+        return dict(ids_by_name)
+
+    def ids(self, session: Session, names: Iterable[str]) -> dict[str, int]:
+        """Returns the ids of the names that exist, names that do not exist are left out."""
+        names = set(names)
+        if not names:
+            return {}
+
+        ids_by_name = self._current()
+        loaded = ids_by_name is None
+        if loaded:
+            ids_by_name = self._load(session)
+
+        found = {name: ids_by_name[name] for name in names if name in ids_by_name}
+        missing = names.difference(found)
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(missing)
+
+        if missing and not loaded:
+            rows = session.execute(select(self.model.id, self.model.name).where(self.model.name.in_(missing)))
+            added = {name: id for id, name in rows}
+            if added:
+                with self._lock:
+                    if self._ids_by_name is ids_by_name:
+                        self._ids_by_name = {**ids_by_name, **added}
+                found.update(added)
+        return found
+
+    def id_of(self, session: Session, name: str) -> int:
+        """Returns the id of one name, None if it does not exist."""
+        return self.ids(session, [name]).get(name)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            ids_by_name = self._ids_by_name
+            return {
+                "name": self.name,
+                "size": len(ids_by_name) if ids_by_name is not None else 0,
+                "loaded": ids_by_name is not None,
+                "age_seconds": time.monotonic() - self._loaded_at if ids_by_name is not None else 0.0,
+                "hits": self.hits,
+                "misses": self.misses,
+                "loads": self.loads,
+                "invalidations": self.invalidations,
+            }
+
+
+equipment_failure = CatalogCache("equipment_failure", models.EquipmentFailure)
+cause_of_equipment_failure = CatalogCache("cause_of_equipment_failure", models.CauseOfEquipmentFailure)
+meter_unit = CatalogCache("meter_unit", models.MeterUnit)
+equipment_classification1 = CatalogCache("equipment_classification1", models.EquipmentClassification1)
+equipment_classification2 = CatalogCache("equipment_classification2", models.EquipmentClassification2)
+equipment_type = CatalogCache("equipment_type", models.EquipmentType)
+
+CATALOGS = [equipment_failure, cause_of_equipment_failure, meter_unit, equipment_classification1, equipment_classification2, equipment_type]
+
+
+def invalidate_all() -> None:
+    for catalog in CATALOGS:
+        catalog.invalidate()
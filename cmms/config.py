@@ -1,54 +1,29 @@
+"""Program settings.
+
+Constants are plain module attributes. Settings that can be changed per install are declared in
+SETTINGS and resolved lazily, on first access of the module attribute, through the settings
+backends listed in CMMS_SETTINGS_BACKENDS (default "env,toml"):
+
+    env         Environment variables, the setting key prefixed with CMMS_, e.g. CMMS_DATABASE_HOST.
+    toml        A TOML file of setting keys, e.g. DATABASE_HOST = "db01". The path comes from
+                CMMS_CONFIG_FILE and defaults to cmms.toml in the program folder.
+    qsettings   The Qt settings registry used by the desktop program. Imports PyQt5 when used.
+
+The first backend that has a value wins, otherwise the setting's default is used.
+Importing this module does not touch the file system or import Qt.
+
+Installs configured through the desktop program before the env and toml backends existed keep
+their settings in the Qt registry only. When CMMS_SETTINGS_BACKENDS is not set, no CMMS_ setting
+is in the environment, there is no TOML file and PyQt5 is installed, "qsettings" is used after
+"env,toml", so those installs keep reading their settings without being reconfigured.
+"""
 from __future__ import annotations
 import os
 import logging
+import importlib.util
 import secrets
-from typing import Any
+from typing import Any, Callable, Optional
 from dataclasses import dataclass
-from PyQt5.QtCore import QSettings
-
-
-@dataclass
-class DefaultSetting:
-    """Default settings."""
-
-    settings: QSettings
-    name: str
-    value: str
-    group_name: str = None
-
-    @property
-    def hive_location(self) -> str:
-        """Return the hive location path for this setting."""
-        base = f"HKEY_CURRENT_USER\SOFTWARE\{COMPANY_NAME}\{PROGRAM_NAME}"
-        if self.group_name:
-            base += f"\{self.group_name}"
-        return f"{base}\{self.name}"
-
-    def initialize_setting(self) -> DefaultSetting:
-        """Initialize the default setting or pulls the current setting value."""
-        if self.group_name:
-            self.settings.beginGroup(self.group_name)
-
-        if not self.settings.contains(self.name):
-            self.settings.setValue(self.name, self.value)
-        else:
-            self.value = self.settings.value(self.name)
-
-        if self.group_name:
-            self.settings.endGroup()
-        return self
-
-    def save(self) -> DefaultSetting:
-        """Save the default setting."""
-        if self.group_name:
-            self.settings.beginGroup(self.group_name)
-
-        self.settings.setValue(self.name, self.value)
-
-        if self.group_name:
-            self.settings.endGroup()
-        return self
-
 
 
 COMPANY_NAME = "DF-Software"
@@ -60,40 +35,26 @@ PROGRAM_FOLDER = os.path.join(COMPANY_FOLDER, PROGRAM_NAME)
 LOG_FOLDER = os.path.join(PROGRAM_FOLDER, "Logs")
 DATABASE_FOLDER = os.path.join(PROGRAM_FOLDER, "Database")
 TEMP_DATA_FOLDER = os.path.join(PROGRAM_FOLDER, "Temp Data")
+SECRET_KEY_FILE = os.path.join(PROGRAM_FOLDER, "secret.key")
 ENCODING_STR = "utf-8"
 
+ENVIRONMENT_PREFIX = "CMMS_"
+DEFAULT_SETTINGS_BACKENDS = "env,toml"
+DEFAULT_CONFIG_FILE = os.path.join(PROGRAM_FOLDER, "cmms.toml")
 
-if not os.path.exists(COMPANY_FOLDER):
-    os.mkdir(COMPANY_FOLDER)
-
-if not os.path.exists(PROGRAM_FOLDER):
-    os.mkdir(PROGRAM_FOLDER)
-
-if not os.path.exists(LOG_FOLDER):
-    os.mkdir(LOG_FOLDER)
 
-if not os.path.exists(DATABASE_FOLDER):
-    os.mkdir(DATABASE_FOLDER)
+def ensure_folder(path: str) -> str:
+    """Creates a program folder the first time something is written to it."""
+    os.makedirs(path, exist_ok=True)
+    return path
 
-if not os.path.exists(TEMP_DATA_FOLDER):
-    os.mkdir(TEMP_DATA_FOLDER)
-
-
-settings = QSettings(COMPANY_NAME, PROGRAM_NAME)
 
 # Program settings
 DATETIME_FORMAT = "%m-%d-%Y %H:%M"
 DATE_FORMAT = "%m-%d-%Y"
 DEFAULT_DUE_DATE_PUSH_BACK_DAYS = 30
-SECRET_KEY = DefaultSetting(settings=settings, name="Secret Key", value=secrets.token_hex(32)).initialize_setting().value
-LOGIN_TOKEN_EXPIRE_MINUTES = DefaultSetting(settings=settings, name="Login Token Expire Minutes", value=60).initialize_setting().value
-
-DEBUG = DefaultSetting(settings=settings, name="debug", value=False).initialize_setting().value
-if DEBUG == "true":
-    DEBUG = True
-else:
-    DEBUG = False
-
+DEFAULT_PAGE_LIMIT = 100
+MAX_PAGE_LIMIT = 500
 
 # Logging settings
 LOG_FILE = "CMMS.log"
@@ -101,41 +62,256 @@ SQLALCHEMY_ENGINE_LOG_FILE = "SQLAlchemy Engine.log"
 SQLALCHEMY_POOL_LOG_FILE = "SQLAlchemy Pool.log"
 SQLALCHEMY_DIALECT_LOG_FILE = "SQLAlchemy Dialect.log"
 SQLALCHEMY_ORM_LOG_FILE = "SQLAlchemy ORM.log"
-
-MAX_LOG_SIZE_MB = DefaultSetting(settings=settings, group_name="Logging", name="max_log_size_mb", value=5).initialize_setting().value
-MAX_LOG_COUNT = DefaultSetting(settings=settings, group_name="Logging", name="max_log_count", value=3).initialize_setting().value
-LOG_LEVEL = logging.DEBUG # DefaultSetting(settings=settings, group_name="Logging", name="log_level", value=logging.INFO).initialize_setting().value
-if DEBUG:
-    LOG_LEVEL = logging.DEBUG
-
-
-# Database Settings
-SCHEMA_NAME = DefaultSetting(settings=settings, group_name="Database/MySQL", name="Schema Name", value=f"{PROGRAM_NAME.lower().replace(' ', '')}").initialize_setting().value
-DATABASE_USER = DefaultSetting(settings=settings, group_name="Database/MySQL", name="User", value="").initialize_setting().value
-DATABASE_PASSWORD = DefaultSetting(settings=settings, group_name="Database/MySQL", name="Password", value="").initialize_setting().value
-DATABASE_HOST = DefaultSetting(settings=settings, group_name="Database/MySQL", name="Host", value="localhost").initialize_setting().value
-DATABASE_PORT = DefaultSetting(settings=settings, group_name="Database/MySQL", name="Port", value="3306").initialize_setting().value
-DATABASE_DUMP_LOCATION = DefaultSetting(settings=settings, group_name="Database/MySQL", name="MySQLDump Location", value="").initialize_setting().value
-
-SCHEMA_CREATE_STATEMENT = f"CREATE SCHEMA IF NOT EXISTS {SCHEMA_NAME} DEFAULT CHARACTER SET utf8 COLLATE utf8_bin ;"
-DATABASE_URL_WITHOUT_SCHEMA = f"mysql+pymysql://{DATABASE_USER}:{DATABASE_PASSWORD}@{DATABASE_HOST}:{DATABASE_PORT}"
-DATABASE_URL_WITH_SCHEMA = f"{DATABASE_URL_WITHOUT_SCHEMA}/{SCHEMA_NAME}"
-FORCE_REBUILD_DATABASE = DefaultSetting(settings=settings, group_name="Database", name="force_rebuild_database", value=False,).initialize_setting().value
-if FORCE_REBUILD_DATABASE == "true":
-    FORCE_REBUILD_DATABASE = True
-else:
-    FORCE_REBUILD_DATABASE = False
-
-
-# Fishbowl settings
-FISHBOWL_SCHEMA_NAME = DefaultSetting(settings=settings, group_name="Database/Fishbowl", name="Schema Name", value="").initialize_setting().value
-FISHBOWL_DATABASE_USER = DefaultSetting(settings=settings, group_name="Database/Fishbowl", name="User", value="gone").initialize_setting().value
-FISHBOWL_DATABASE_PASSWORD = DefaultSetting(settings=settings, group_name="Database/Fishbowl", name="Password", value="fishing").initialize_setting().value
-FISHBOWL_DATABASE_HOST = DefaultSetting(settings=settings, group_name="Database/Fishbowl", name="Host", value="").initialize_setting().value
-FISHBOWL_DATABASE_PORT = DefaultSetting(settings=settings, group_name="Database/Fishbowl", name="Port", value="3305").initialize_setting().value
-FISHBOWL_DATABASE_URL = f"mysql+pymysql://{FISHBOWL_DATABASE_USER}:{FISHBOWL_DATABASE_PASSWORD}@{FISHBOWL_DATABASE_HOST}:{FISHBOWL_DATABASE_PORT}/{FISHBOWL_SCHEMA_NAME}"
+LOG_LEVEL = logging.DEBUG
 
 # Github settings
 GITHUB_USERNAME = "dominickfau"
 GITHUB_REPO_NAME = "CMMS"
-GITHUB_LATEST_RELEASE_ENDPOINT = f"https://api.github.com/repos/{GITHUB_USERNAME}/{GITHUB_REPO_NAME}/releases/latest"
\ No newline at end of file
+GITHUB_LATEST_RELEASE_ENDPOINT = f"https://api.github.com/repos/{GITHUB_USERNAME}/{GITHUB_REPO_NAME}/releases/latest"
+
+
+def to_bool(value: Any) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() in ("true", "1", "yes", "on")
+    return bool(value)
+
+
+def default_secret_key() -> str:
+    """Returns the install's secret key, creating it on first use.
+
+    The key is kept in a file so every API worker and restart signs tokens with the same key.
+    """
+    if os.path.exists(SECRET_KEY_FILE):
+        with open(SECRET_KEY_FILE, "r") as f:
+            return f.read().strip()
+    ensure_folder(PROGRAM_FOLDER)
+    secret_key = secrets.token_hex(32)
+    with open(os.open(SECRET_KEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), "w") as f:
+        f.write(secret_key)
+    return secret_key
+
+
+@dataclass
+class Setting:
+    """A setting that can be changed per install.
+
+    key is the module attribute and the name used by the env and toml backends.
+    group_name and name are where the qsettings backend keeps it, as before.
+    default may be a callable, called only when no backend has a value.
+    """
+    key: str
+    name: str
+    default: Any
+    group_name: str = None
+    type: Callable[[Any], Any] = str
+
+    def parse(self, value: Any) -> Any:
+        if self.type is bool:
+            return to_bool(value)
+        return self.type(value)
+
+    def default_value(self) -> Any:
+        return self.default() if callable(self.default) else self.default
+
+
+class SettingsBackend:
+    """Source of setting values."""
+    name = ""
+
+    def get(self, setting: Setting) -> Optional[Any]:
+        """Returns the raw value of a setting, None if this backend does not have one."""
+        raise NotImplementedError
+
+
+class EnvironmentBackend(SettingsBackend):
+    name = "env"
+
+    def __init__(self, prefix: str = ENVIRONMENT_PREFIX):
+        self.prefix = prefix
+
+    def get(self, setting: Setting) -> Optional[Any]:
+        return os.environ.get(self.prefix + setting.key)
+
+
+class TomlBackend(SettingsBackend):
+    """Reads a flat TOML file of setting keys. The file is optional and read once."""
+    name = "toml"
+
+    def __init__(self, path: str):
+        self.path = path
+        self.values = None # type: dict[str, Any]
+
+    def load(self) -> dict[str, Any]:
+        if self.values is not None:
+            return self.values
+        self.values = {}
+        if os.path.exists(self.path):
+            try:
+                import tomllib
+            except ModuleNotFoundError: # Python < 3.11
+                import tomli as tomllib
+            with open(self.path, "rb") as f:
+                self.values = tomllib.load(f)
+        return self.values
+
+    def get(self, setting: Setting) -> Optional[Any]:
+        return self.load().get(setting.key)
+
+
+class QSettingsBackend(SettingsBackend):
+    """Adapter for the Qt settings registry. Missing settings are written with their default,
+    so they show up for editing like they always have."""
+    name = "qsettings"
+
+    def __init__(self, company_name: str = COMPANY_NAME, program_name: str = PROGRAM_NAME):
+        from PyQt5.QtCore import QSettings
+        self.settings = QSettings(company_name, program_name)
+
+    def get(self, setting: Setting) -> Optional[Any]:
+        if setting.group_name:
+            self.settings.beginGroup(setting.group_name)
+        try:
+            if self.settings.contains(setting.name):
+                return self.settings.value(setting.name)
+            self.settings.setValue(setting.name, setting.default_value())
+            return None
+        finally:
+            if setting.group_name:
+                self.settings.endGroup()
+
+    def save(self, setting: Setting, value: Any) -> None:
+        if setting.group_name:
+            self.settings.beginGroup(setting.group_name)
+        self.settings.setValue(setting.name, value)
+        if setting.group_name:
+            self.settings.endGroup()
+
+
+BACKEND_TYPES = {
+    "env": EnvironmentBackend,
+    "toml": lambda: TomlBackend(os.environ.get(f"{ENVIRONMENT_PREFIX}CONFIG_FILE", DEFAULT_CONFIG_FILE)),
+    "qsettings": QSettingsBackend,
+} # type: dict[str, Callable[[], SettingsBackend]]
+
+
+SETTINGS = {setting.key: setting for setting in [
+    Setting("SECRET_KEY", "Secret Key", default_secret_key),
+    Setting("LOGIN_TOKEN_EXPIRE_MINUTES", "Login Token Expire Minutes", 60, type=int),
+    # bcrypt work factor for new hashes. Changing it rehashes each password on the user's next login.
+    Setting("BCRYPT_ROUNDS", "Bcrypt Rounds", 12, type=int),
+    Setting("PASSWORD_HASH_WORKERS", "Password Hash Workers", lambda: min(4, os.cpu_count() or 1), type=int),
+    Setting("DEBUG", "debug", False, type=bool),
+
+    Setting("MAX_LOG_SIZE_MB", "max_log_size_mb", 5, "Logging", int),
+    Setting("MAX_LOG_COUNT", "max_log_count", 3, "Logging", int),
+
+    # Database Settings
+    Setting("SCHEMA_NAME", "Schema Name", f"{PROGRAM_NAME.lower().replace(' ', '')}", "Database/MySQL"),
+    Setting("DATABASE_USER", "User", "", "Database/MySQL"),
+    Setting("DATABASE_PASSWORD", "Password", "", "Database/MySQL"),
+    Setting("DATABASE_HOST", "Host", "localhost", "Database/MySQL"),
+    Setting("DATABASE_PORT", "Port", "3306", "Database/MySQL"),
+    Setting("DATABASE_DUMP_LOCATION", "MySQLDump Location", "", "Database/MySQL"),
+    Setting("FORCE_REBUILD_DATABASE", "force_rebuild_database", False, "Database", bool),
+    # When false the API only checks the schema version on startup and 'python -m cmms migrate'
+    # has to be run after upgrading. Single worker installs may let the API migrate itself.
+    Setting("MIGRATE_ON_STARTUP", "migrate_on_startup", False, "Database", bool),
+
+    # Connection pool settings. Pre ping may be "always", "interval" (only connections idle
+    # longer than the interval are pinged) or "never". Size, overflow and timeout are those of
+    # the API's async engine, per worker process. The sync engine of the CLI, migrations and
+    # startup tasks keeps a fixed pool of DATABASE_SYNC_POOL_SIZE connections next to it.
+    Setting("DATABASE_POOL_SIZE", "Pool Size", 5, "Database/Pool", int),
+    Setting("DATABASE_POOL_MAX_OVERFLOW", "Max Overflow", 10, "Database/Pool", int),
+    Setting("DATABASE_POOL_TIMEOUT", "Timeout Seconds", 30, "Database/Pool", int),
+    Setting("DATABASE_SYNC_POOL_SIZE", "Sync Pool Size", 3, "Database/Pool", int),
+    Setting("DATABASE_POOL_RECYCLE", "Recycle Seconds", 3600, "Database/Pool", int),
+    Setting("DATABASE_POOL_PRE_PING", "Pre Ping", "interval", "Database/Pool"),
+    Setting("DATABASE_POOL_PRE_PING_INTERVAL", "Pre Ping Interval Seconds", 30, "Database/Pool", int),
+
+    # In process caches. Writes through the API invalidate them, the TTL bounds how long
+    # changes made by another process (the desktop client, another worker) go unseen.
+    Setting("CATALOG_CACHE_TTL_SECONDS", "Catalog TTL Seconds", 300, "Cache", int),
+    Setting("USER_CACHE_TTL_SECONDS", "User TTL Seconds", 60, "Cache", int),
+    Setting("USER_CACHE_SIZE", "User Cache Size", 1024, "Cache", int),
+    Setting("RESPONSE_CACHE_TTL_SECONDS", "Response TTL Seconds", 300, "Cache", int),
+    Setting("RESPONSE_CACHE_MAX_BYTES", "Response Cache Max Bytes", 32 * 1024 * 1024, "Cache", int),
+
+    # Attachment content, see cmms.blobstore.
+    Setting("BLOB_STORE_BACKEND", "Backend", "filesystem", "Blob Store"),
+    Setting("BLOB_STORE_FOLDER", "Folder", os.path.join(DATABASE_FOLDER, "Blobs"), "Blob Store"),
+    Setting("ATTACHMENT_MAX_UPLOAD_BYTES", "Max Upload Bytes", 2 * 1024 * 1024 * 1024, "Blob Store", int),
+
+    # Longest side in pixels of the thumbnails built for every image, comma separated.
+    Setting("THUMBNAIL_SIZES", "Sizes", "160,480,1280", "Thumbnails"),
+    Setting("THUMBNAIL_WORKERS", "Workers", lambda: min(2, os.cpu_count() or 1), "Thumbnails", int),
+
+    # Login events are queued and written in batches by the API.
+    Setting("LOGIN_LOG_BATCH_SIZE", "Batch Size", 200, "Login Log", int),
+    Setting("LOGIN_LOG_FLUSH_INTERVAL_SECONDS", "Flush Interval Seconds", 1.0, "Login Log", float),
+    Setting("LOGIN_LOG_MAX_PENDING", "Max Pending", 10000, "Login Log", int),
+
+    # Fishbowl settings
+    Setting("FISHBOWL_SCHEMA_NAME", "Schema Name", "", "Database/Fishbowl"),
+    Setting("FISHBOWL_DATABASE_USER", "User", "gone", "Database/Fishbowl"),
+    Setting("FISHBOWL_DATABASE_PASSWORD", "Password", "fishing", "Database/Fishbowl"),
+    Setting("FISHBOWL_DATABASE_HOST", "Host", "", "Database/Fishbowl"),
+    Setting("FISHBOWL_DATABASE_PORT", "Port", "3305", "Database/Fishbowl"),
+]} # type: dict[str, Setting]
+
+
+# Values built from other settings, resolved lazily like the settings themselves.
+DERIVED_SETTINGS = {
+    "SCHEMA_CREATE_STATEMENT": lambda: f"CREATE SCHEMA IF NOT EXISTS {value_of('SCHEMA_NAME')} DEFAULT CHARACTER SET utf8 COLLATE utf8_bin ;",
+    "DATABASE_URL_WITHOUT_SCHEMA": lambda: f"mysql+pymysql://{value_of('DATABASE_USER')}:{value_of('DATABASE_PASSWORD')}@{value_of('DATABASE_HOST')}:{value_of('DATABASE_PORT')}",
+    "DATABASE_URL_WITH_SCHEMA": lambda: f"{value_of('DATABASE_URL_WITHOUT_SCHEMA')}/{value_of('SCHEMA_NAME')}",
+    "ASYNC_DATABASE_URL_WITH_SCHEMA": lambda: f"mysql+aiomysql://{value_of('DATABASE_USER')}:{value_of('DATABASE_PASSWORD')}@{value_of('DATABASE_HOST')}:{value_of('DATABASE_PORT')}/{value_of('SCHEMA_NAME')}",
+    "FISHBOWL_DATABASE_URL": lambda: f"mysql+pymysql://{value_of('FISHBOWL_DATABASE_USER')}:{value_of('FISHBOWL_DATABASE_PASSWORD')}@{value_of('FISHBOWL_DATABASE_HOST')}:{value_of('FISHBOWL_DATABASE_PORT')}/{value_of('FISHBOWL_SCHEMA_NAME')}",
+} # type: dict[str, Callable[[], Any]]
+
+
+_backends = None # type: list[SettingsBackend]
+
+
+def default_backend_names() -> str:
+    """Returns DEFAULT_SETTINGS_BACKENDS, with qsettings added for installs that are only configured through Qt."""
+    config_file = os.environ.get(f"{ENVIRONMENT_PREFIX}CONFIG_FILE", DEFAULT_CONFIG_FILE)
+    configured = os.path.exists(config_file) or any(ENVIRONMENT_PREFIX + key in os.environ for key in SETTINGS)
+    if configured or importlib.util.find_spec("PyQt5") is None:
+        return DEFAULT_SETTINGS_BACKENDS
+    return f"{DEFAULT_SETTINGS_BACKENDS},qsettings"
+
+
+def settings_backends() -> list[SettingsBackend]:
+    """Returns the configured backends, creating them on first use."""
+    global _backends
+    if _backends is None:
+        names = os.environ.get(f"{ENVIRONMENT_PREFIX}SETTINGS_BACKENDS") or default_backend_names()
+        _backends = [BACKEND_TYPES[name.strip()]() for name in names.split(",") if name.strip()]
+    return _backends
+
+
+def get_setting(key: str) -> Any:
+    """Resolves a setting through the backends, falling back to its default."""
+    setting = SETTINGS[key]
+    for backend in settings_backends():
+        value = backend.get(setting)
+        if value is not None:
+            return setting.parse(value)
+    return setting.parse(setting.default_value())
+
+
+def value_of(name: str) -> Any:
+    """Module level access to a setting, plain global lookups inside this module skip __getattr__."""
+    return globals()[name] if name in globals() else __getattr__(name)
+
+
+def __getattr__(name: str) -> Any:
+    if name in SETTINGS:
+        value = get_setting(name)
+    elif name in DERIVED_SETTINGS:
+        value = DERIVED_SETTINGS[name]()
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value
+    return value
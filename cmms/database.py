@@ -2,8 +2,21 @@ from __future__ import annotations
 import logging
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
 from sqlalchemy.ext.declarative import declarative_base
-from cmms.config import DATABASE_URL_WITH_SCHEMA
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from cmms.config import (
+    DATABASE_URL_WITH_SCHEMA,
+    ASYNC_DATABASE_URL_WITH_SCHEMA,
+    DATABASE_POOL_SIZE,
+    DATABASE_POOL_MAX_OVERFLOW,
+    DATABASE_POOL_TIMEOUT,
+    DATABASE_POOL_RECYCLE,
+    DATABASE_SYNC_POOL_SIZE,
+    DATABASE_POOL_PRE_PING,
+    DATABASE_POOL_PRE_PING_INTERVAL
+)
+from cmms.pool import PoolStatistics, instrumented_pool_class, instrument_engine
 
 logger = logging.getLogger("backend")
 
@@ -17,10 +30,30 @@ if not log_started:
     log_started = True
 
 
-engine = create_engine(DATABASE_URL_WITH_SCHEMA, pool_pre_ping=True)
+pool_options = dict(
+    pool_size=DATABASE_POOL_SIZE,
+    max_overflow=DATABASE_POOL_MAX_OVERFLOW,
+    pool_timeout=DATABASE_POOL_TIMEOUT,
+    pool_recycle=DATABASE_POOL_RECYCLE
+)
+
+# The sync engine serves one command or startup task at a time, a small fixed pool keeps it from
+# adding DATABASE_POOL_SIZE + DATABASE_POOL_MAX_OVERFLOW connections per process to the async ones.
+sync_pool_options = dict(pool_options, pool_size=DATABASE_SYNC_POOL_SIZE, max_overflow=0)
+
+pool_statistics = PoolStatistics("sync")
+engine = create_engine(DATABASE_URL_WITH_SCHEMA, poolclass=instrumented_pool_class(QueuePool, pool_statistics), **sync_pool_options)
+instrument_engine(engine, pool_statistics, DATABASE_POOL_PRE_PING, DATABASE_POOL_PRE_PING_INTERVAL)
 SessionLocal = sessionmaker(bind=engine)
 DeclarativeBase = declarative_base(bind=engine)
 
+# Non-blocking engine used by the API routes. The sync engine above is kept for
+# scripts and startup tasks such as cmms.defaultdata.
+async_pool_statistics = PoolStatistics("async")
+async_engine = create_async_engine(ASYNC_DATABASE_URL_WITH_SCHEMA, poolclass=instrumented_pool_class(AsyncAdaptedQueuePool, async_pool_statistics), **pool_options)
+instrument_engine(async_engine.sync_engine, async_pool_statistics, DATABASE_POOL_PRE_PING, DATABASE_POOL_PRE_PING_INTERVAL)
+AsyncSessionLocal = sessionmaker(bind=async_engine, class_=AsyncSession, expire_on_commit=False)
+
 
 class DBContext:
     def __init__(self):
@@ -36,4 +69,19 @@ class DBContext:
 def get_session() -> Session:
     """ Returns the current db connection """
     with DBContext() as session:
-        yield session
\ No newline at end of file
+        yield session
+
+
+async def get_async_session() -> AsyncSession:
+    """ Returns a non-blocking db session for the API routes """
+    async with AsyncSessionLocal() as session:
+        yield session
+
+
+async def to_schema(db: AsyncSession, schema, obj):
+    """Builds a pydantic schema from ORM data inside the session's greenlet.
+
+    Lazy loaded relationships can not be loaded from plain async code, so the
+    schema is validated through run_sync where those loads stay non-blocking.
+    """
+    return await db.run_sync(lambda _: schema.validate(obj))
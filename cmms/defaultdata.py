@@ -1,200 +1,239 @@
+from __future__ import annotations
 import logging
 import json
+import time
+from contextlib import contextmanager
 from datetime import datetime
-from sqlalchemy.exc import IntegrityError
-from cmms.config import *
+from sqlalchemy import Column, Table, UniqueConstraint, insert, update, bindparam, select
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
 from cmms.database import DBContext
-from cmms import models
+from cmms import models, catalogs
+from cmms.equipmentimport import ImportRowError, equipment_values, unique_key, by_unique_key
 
 
 logger = logging.getLogger("backend")
 
 
+@contextmanager
+def stage(name: str):
+    """Logs how long a loading stage took."""
+    start = time.perf_counter()
+    yield
+    logger.info(f"[SYSTEM] {name} loaded in {(time.perf_counter() - start) * 1000:.1f} ms.")
+
+
+def unique_key_columns(table: Table, names) -> list[Column]:
+    """The columns of the first unique constraint, unique index or primary key of a table that
+    the rows have values for, like name for the catalogs or both ids for a link table."""
+    keys = [constraint.columns for constraint in table.constraints if isinstance(constraint, UniqueConstraint)]
+    keys += [index.columns for index in table.indexes if index.unique]
+    keys.append(table.primary_key.columns)
+    for columns in keys:
+        if all(column.name in names for column in columns):
+            return list(columns)
+    raise ValueError(f"The rows for {table.name} have no values for any of its unique keys.")
+
+
+def insert_ignore(session: Session, table: Table, rows: list[dict]) -> None:
+    """Inserts rows with one executemany, skipping rows that would violate a unique key.
+
+    MySQL uses a no-op ON DUPLICATE KEY UPDATE and SQLite ON CONFLICT DO NOTHING.
+    Other databases only get the rows whose unique key, see unique_key_columns, is not in the
+    table yet.
+    """
+    if not rows:
+        return
+    dialect = session.bind.dialect.name
+    if dialect == "mysql":
+        key = table.primary_key.columns.values()[0]
+        statement = mysql_insert(table).on_duplicate_key_update({key.name: key})
+    elif dialect == "sqlite":
+        statement = sqlite_insert(table).on_conflict_do_nothing()
+    else:
+        columns = unique_key_columns(table, rows[0].keys())
+        existing = {tuple(row) for row in session.execute(select(*columns))}
+        rows = [row for row in rows if tuple(row[column.name] for column in columns) not in existing]
+        if not rows:
+            return
+        statement = insert(table)
+    session.execute(statement, rows)
+
+
+def name_map(session: Session, model) -> dict[str, int]:
+    """Returns a name to id map of every row of a model."""
+    return {name: id for id, name in session.execute(select(model.id, model.name))}
+
+
+def audit_values(user_id: int, now: datetime) -> dict:
+    return {"created_by_user_id": user_id, "modified_by_user_id": user_id, "date_created": now, "date_modified": now}
+
+
+def load_equipment_types(session: Session, equipment_types: list[dict], user_id: int) -> None:
+    """Upserts equipment types and links them to their failures, creating missing failures."""
+    now = datetime.now()
+    failure_names = {failure for equipment_type in equipment_types for failure in equipment_type["failures"]}
+    insert_ignore(session, models.EquipmentFailure.__table__, [{"name": name, **audit_values(user_id, now)} for name in sorted(failure_names)])
+    insert_ignore(session, models.EquipmentType.__table__, [{"name": equipment_type["name"], **audit_values(user_id, now)} for equipment_type in equipment_types])
+
+    failures = name_map(session, models.EquipmentFailure)
+    types = name_map(session, models.EquipmentType)
+    links = [
+        {"equipment_type_id": types[equipment_type["name"]], "equipment_failure_id": failures[failure]}
+        for equipment_type in equipment_types
+        for failure in equipment_type["failures"]
+    ]
+    insert_ignore(session, models.equipmenttypetofalure_table, links)
+
+
 def load_default_data() -> None:
     logger.info("[SYSTEM] Checking default data.")
+    start = time.perf_counter()
 
     with DBContext() as session:
-        try:
-            user_obj = models.User(**default_user)
-            session.add(user_obj)
-            session.commit()
-        except IntegrityError:
-            session.rollback()
+        with stage("Default user"):
             user_obj = session.query(models.User).filter(models.User.username == default_user["username"]).first()
+            if not user_obj:
+                user_obj = models.User(**default_user)
+                session.add(user_obj)
+                session.commit()
 
-        try:
-            root_location = models.Location(name="Root")
-            root_location.created_by_user_id = user_obj.id
-            root_location.modified_by_user_id = user_obj.id
-            session.add(root_location)
-            session.commit()
-        except IntegrityError:
-            session.rollback()
+        with stage("Root location"):
+            if not session.query(models.Location.id).filter(models.Location.name == "Root").first():
+                root_location = models.Location(name="Root")
+                root_location.created_by_user_id = user_obj.id
+                root_location.modified_by_user_id = user_obj.id
+                session.add(root_location)
+                session.commit()
 
-        try:
-            for cause_of_failure in cause_of_failures:
-                item = models.CauseOfEquipmentFailure(name=cause_of_failure, read_only=True)
-                item.created_by_user_id = user_obj.id
-                item.modified_by_user_id = user_obj.id
-                session.add(item)
+        with stage("Causes of failure"):
+            now = datetime.now()
+            rows = [{"name": name, "read_only": True, **audit_values(user_obj.id, now)} for name in cause_of_failures]
+            insert_ignore(session, models.CauseOfEquipmentFailure.__table__, rows)
             session.commit()
-        except IntegrityError:
-            session.rollback()
 
-        try:
-            for equipment_failure in equipment_failures:
-                item = models.EquipmentFailure(name=equipment_failure)
-                item.created_by_user_id = user_obj.id
-                item.modified_by_user_id = user_obj.id
-                session.add(item)
+        with stage("Equipment failures"):
+            now = datetime.now()
+            insert_ignore(session, models.EquipmentFailure.__table__, [{"name": name, **audit_values(user_obj.id, now)} for name in equipment_failures])
             session.commit()
-        except IntegrityError:
-            session.rollback()
-        
-        try:
-            for equipment_type in equipment_types:
-                name = equipment_type["name"]
-                failures = equipment_type["failures"]
-
-                equipment_type_obj = models.EquipmentType(name=name)
-                for failure in failures:
-                    failure_obj = session.query(models.EquipmentFailure).filter(models.EquipmentFailure.name == failure).first() # type: models.EquipmentFailure
-                    equipment_type_obj.add_failure(failure_obj, user_obj)
-                    item.created_by_user_id = user_obj.id
-                session.add(equipment_type_obj)
+
+        with stage("Equipment types"):
+            load_equipment_types(session, equipment_types, user_obj.id)
             session.commit()
-        except IntegrityError:
-            session.rollback()
 
+    catalogs.invalidate_all()
+    logger.info(f"[SYSTEM] Default data checked in {(time.perf_counter() - start) * 1000:.1f} ms.")
 
-def load_test_data() -> None:
+
+def load_test_data(path: str = "test_data.json") -> None:
     logger.warning("[SYSTEM] Loading test data")
-    with open("test_data.json", "r") as f:
+    start = time.perf_counter()
+    with open(path, "r") as f:
         data = json.loads(f.read())
-    
-    locations = data.pop("Locations", None) # type: list[dict[str, str]]
-
-    if locations:
-        with DBContext() as session:
-            root_location = models.Location(
-                    name="Root"
-                )
 
-            session.add(root_location)
-            session.commit()
+    with DBContext() as session:
+        user_obj = session.query(models.User).filter(models.User.username == default_user["username"]).first() # type: models.User
 
-            location_objs = {} # type: dict[str, models.Location]
-
-            for location in locations:
-                name = location["Name"]
-                parent_location_name = location["Parent Location"]
-
-                if parent_location_name == "Root":
-                    location_obj = models.Location(
-                        name=name,
-                        parent_location_id=root_location.id
-                    )
-
-                else:
-                    location_obj = models.Location(
-                        name=name,
-                        parent_location_id=location_objs[parent_location_name].id
-                    )
-                
-                
-                session.add(location_obj)
+        users = data.pop("Users", None) # type: list[dict[str, str]]
+        if users:
+            with stage("Users"):
+                existing = {username for username, in session.execute(select(models.User.username))}
+                session.add_all([models.User(**user) for user in users if user["username"] not in existing])
                 session.commit()
-                location_objs[location_obj.name] = location_obj
 
-    equipment_classification1 = data.pop("Equipment Classifications 1", None) # type: list[str]
+        locations = data.pop("Locations", None) # type: list[dict[str, str]]
+        if locations:
+            with stage("Locations"):
+                load_locations(session, locations, user_obj.id)
+                session.commit()
 
-    if equipment_classification1:
-        with DBContext() as session:
-            for item in equipment_classification1:
-                classification1 = models.EquipmentClassification1(name=item)
-                session.add(classification1)
-            session.commit()
-        
-
-    equipment_types = data.pop("Equipment Types", None) # type: list[dict[str, str]]
-    
-    if equipment_types:
-        with DBContext() as session:
-            for item in equipment_types:
-                name = item["Name"]
-                failures = item["Failures"] # type: list[str]
-
-                equipment_type = models.EquipmentType(name=name)
-                for failure in failures:
-                    failure_obj = session.query(models.EquipmentFailure).filter(models.EquipmentFailure.name == failure).first()
-                    equipment_type.add_failure(failure_obj)
-                    session.add(equipment_type)
+        equipment_classification1 = data.pop("Equipment Classifications 1", None) # type: list[str]
+        if equipment_classification1:
+            with stage("Equipment classifications"):
+                insert_ignore(session, models.EquipmentClassification1.__table__, [{"name": name} for name in equipment_classification1])
+                session.commit()
 
-            session.commit()
+        test_equipment_types = data.pop("Equipment Types", None) # type: list[dict[str, str]]
+        if test_equipment_types:
+            with stage("Equipment types"):
+                load_equipment_types(session, [{"name": item["Name"], "failures": item["Failures"]} for item in test_equipment_types], user_obj.id)
+                session.commit()
 
+        equipment = data.pop("Equipment", None) # type: list[dict[str, str]]
+        if equipment:
+            with stage(f"{len(equipment)} equipment"):
+                load_equipment(session, equipment, user_obj.id)
+                session.commit()
 
-    equipment = data.pop("Equipment", None) # type: list[dict[str, str]]
-
-    if equipment:
-        with DBContext() as session:
-            for item in equipment:
-                name = item["Name"]
-                brand = item["Brand"]
-                model = item["Model"]
-                serial_number = item["Serial Number"]
-                priority_name = item["Priority"]
-                year = item["Year"]
-                location_name = item["Location"]
-
-                # Optional Items
-                capacity = item.pop("Capacity", "")
-                code = item.pop("Code", "")
-                notes = item.pop("Notes", "")
-                type_name = item.pop("Type", None)
-                parent_equipment_name = item.pop("Parent Equipment", None)
-                acquisition_date = item.pop("Acquisition Date", datetime.now())
-                classification1_name = item.pop("Classification 1", None)
-                classification2_name = item.pop("Classification 2", None)
-
-                location = session.query(models.Location).filter(models.Location.name == location_name).first()
-
-                if notes:
-                    note = models.Note(data=notes)
-                    session.add(note)
-
-                equipment_obj = models.Equipment(
-                    name=name,
-                    capacity=capacity,
-                    code=code,
-                    note=note if notes else None,
-                    brand=brand,
-                    model=model,
-                    serial_number=serial_number,
-                    priority=priority_name,
-                    acquisition_date=acquisition_date,
-                    location=location,
-                    year=year
-                )
-
-                if type_name:
-                    type_ = session.query(models.EquipmentType).filter(models.EquipmentType.name == type_name).first()
-                    equipment_obj.set_type(type_)
-                
-                if parent_equipment_name:
-                    parent_equipment = session.query(models.Equipment).filter(models.Equipment.name == parent_equipment_name).first()
-                    equipment_obj.set_parent(parent_equipment)
-                
-                if classification1_name:
-                    classification1 = session.query(models.EquipmentClassification1).filter(models.EquipmentClassification1.name == classification1_name).first()
-                    equipment_obj.classification1 = classification1
-
-                if classification2_name:
-                    classification2 = session.query(models.EquipmentClassification2).filter(models.EquipmentClassification2.name == classification2_name).first()
-                    equipment_obj.classification2 = classification2
-
-                session.add(equipment_obj)
-        
-            session.commit()
+    catalogs.invalidate_all()
+    logger.warning(f"[SYSTEM] Test data loaded in {(time.perf_counter() - start) * 1000:.1f} ms.")
+
+
+def load_locations(session: Session, locations: list[dict[str, str]], user_id: int) -> None:
+    """Inserts locations one tree level per statement, then rebuilds the closure table once.
+
+    Rows are inserted with Core, which skips the per row closure maintenance of the mapper events.
+    """
+    now = datetime.now()
+    location_ids = name_map(session, models.Location)
+    pending = [location for location in locations if location["Name"] not in location_ids]
+    while pending:
+        level = [location for location in pending if location["Parent Location"] in location_ids]
+        if not level:
+            raise ValueError(f"Parent location of {[location['Name'] for location in pending]} does not exist.")
+        rows = [{"name": location["Name"], "parent_location_id": location_ids[location["Parent Location"]], **audit_values(user_id, now)} for location in level]
+        session.execute(insert(models.Location.__table__), rows)
+        location_ids = name_map(session, models.Location)
+        pending = [location for location in pending if location["Name"] not in location_ids]
+
+    models.Location.rebuild_closure(session.connection())
+
+
+def load_equipment(session: Session, equipment: list[dict[str, str]], user_id: int) -> None:
+    """Inserts equipment with one executemany, resolving names through maps loaded once."""
+    now = datetime.now()
+    maps = {
+        "location": name_map(session, models.Location),
+        "type": name_map(session, models.EquipmentType),
+        "classification1": name_map(session, models.EquipmentClassification1),
+        "classification2": name_map(session, models.EquipmentClassification2),
+    }
+    existing = set(session.execute(select(models.Equipment.name, models.Equipment.brand, models.Equipment.model, models.Equipment.serial_number)))
+
+    rows = []
+    for item in equipment:
+        try:
+            values = equipment_values(item, maps, user_id, now)
+        except ImportRowError as error:
+            logger.warning(f"[SYSTEM] Skipping test equipment '{item.get('Name')}': {error}")
+            continue
+        key = (values["name"], values["brand"], values["model"], values["serial_number"])
+        if key in existing:
+            continue
+        existing.add(key)
+        rows.append((item, values))
+
+    if not rows:
+        return
+    session.execute(insert(models.Equipment.__table__), [values for _, values in rows])
+
+    query = select(models.Equipment.id, models.Equipment.name).order_by(models.Equipment.id.desc())
+    parents = {name: id for id, name in session.execute(query)} # Lowest id wins.
+    parent_updates = [
+        {"parent_equipment_id": parents[item["Parent Equipment"]], **unique_key(values)}
+        for item, values in rows if item.get("Parent Equipment") in parents
+    ]
+    if parent_updates:
+        session.execute(update(models.Equipment.__table__).where(by_unique_key()).values(parent_equipment_id=bindparam("parent_equipment_id")), parent_updates)
+
+    note_updates = []
+    for item, values in rows:
+        if item.get("Notes"):
+            result = session.execute(insert(models.Note.__table__).values(data=item["Notes"]))
+            note_updates.append({"note_id": result.inserted_primary_key[0], **unique_key(values)})
+    if note_updates:
+        session.execute(update(models.Equipment.__table__).where(by_unique_key()).values(note_id=bindparam("note_id")), note_updates)
 
 
 default_user = {
@@ -0,0 +1,258 @@
+from __future__ import annotations
+import csv
+import io
+import json
+import logging
+from datetime import datetime
+from sqlalchemy import select, insert, update, bindparam, and_
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
+from cmms import models, catalogs
+from cmms.enums import Priority
+
+
+logger = logging.getLogger("backend")
+
+
+# Rows per executemany. Each batch runs in its own savepoint.
+IMPORT_BATCH_SIZE = 1000
+
+REQUIRED_FIELDS = ("Name", "Brand", "Model", "Serial Number")
+
+
+class ImportRowError(Exception):
+    """Raised when a row can not be turned into equipment values."""
+
+
+def parse_equipment_file(filename: str, data: bytes) -> list[dict]:
+    """Parses an uploaded CSV or JSON file in the test_data.json "Equipment" shape.
+
+    JSON may be a list of rows or an object with an "Equipment" list. CSV uses the same keys as headers.
+
+    Returns:
+        list[dict]: The rows, in file order.
+    """
+    text = data.decode("utf-8-sig")
+    if filename.lower().endswith(".csv"):
+        return [{key: value for key, value in row.items() if value not in ("", None)} for row in csv.DictReader(io.StringIO(text))]
+
+    rows = json.loads(text)
+    if isinstance(rows, dict):
+        rows = rows.get("Equipment", [])
+    if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+        raise ValueError("Expected a list of equipment objects.")
+    return rows
+
+
+async def name_map(db: AsyncSession, model) -> dict[str, int]:
+    return {name: id for id, name in await db.execute(select(model.id, model.name))}
+
+
+async def ensure_names(db: AsyncSession, model, names: set[str], names_to_ids: dict[str, int]) -> None:
+    """Inserts the names missing from names_to_ids and adds their ids to it."""
+    missing = [name for name in names if name not in names_to_ids]
+    if not missing:
+        return
+    await db.execute(insert(model), [{"name": name} for name in missing])
+    names_to_ids.update({name: id for id, name in await db.execute(select(model.id, model.name).where(model.name.in_(missing)))})
+
+
+def equipment_values(row: dict, maps: dict[str, dict[str, int]], user_id: int, now: datetime, created: tuple[str, ...] = ()) -> dict:
+    """Turns one import row into equipment column values.
+
+    Names missing from the maps named in created are not errors, their ids are left None for the
+    caller to fill in once it has created them.
+
+    Raises:
+        ImportRowError: If a required value is missing or a referenced name does not exist.
+    """
+    missing = [field for field in REQUIRED_FIELDS if not row.get(field)]
+    if missing:
+        raise ImportRowError(f"Missing {', '.join(missing)}.")
+
+    priority = row.get("Priority") or Priority.NA.value
+    if priority not in Priority.__members__:
+        raise ImportRowError(f"Priority '{priority}' must be one of {list(Priority.__members__)}.")
+
+    year = row.get("Year")
+    try:
+        year = int(year) if year not in (None, "") else None
+    except (TypeError, ValueError):
+        raise ImportRowError(f"Year '{year}' is not a number.")
+
+    acquisition_date = row.get("Acquisition Date")
+    try:
+        acquisition_date = datetime.fromisoformat(acquisition_date) if acquisition_date else now
+    except (TypeError, ValueError):
+        raise ImportRowError(f"Acquisition Date '{acquisition_date}' is not an ISO date.")
+
+    def lookup(field: str, map_name: str) -> int:
+        name = row.get(field)
+        if not name:
+            return None
+        if name not in maps[map_name]:
+            if map_name in created:
+                return None
+            raise ImportRowError(f"{field} '{name}' does not exist.")
+        return maps[map_name][name]
+
+    return {
+        "name": str(row["Name"]),
+        "brand": str(row["Brand"]),
+        "model": str(row["Model"]),
+        "serial_number": str(row["Serial Number"]),
+        "capacity": str(row.get("Capacity") or ""),
+        "code": str(row.get("Code") or ""),
+        "priority": priority,
+        "year": year,
+        "acquisition_date": acquisition_date,
+        "location_id": lookup("Location", "location"),
+        "type_id": lookup("Type", "type"),
+        "classification1_id": lookup("Classification 1", "classification1"),
+        "classification2_id": lookup("Classification 2", "classification2"),
+        "created_by_user_id": user_id,
+        "modified_by_user_id": user_id,
+        "date_created": now,
+        "date_modified": now,
+    }
+
+
+async def insert_batch(db: AsyncSession, batch: list[tuple[int, dict]], errors: list[dict]) -> list[tuple[int, dict]]:
+    """Inserts a batch with one executemany. On a database error the batch is retried row by row,
+    so only the offending rows are reported.
+
+    Returns:
+        list[tuple[int, dict]]: The rows that were inserted.
+    """
+    try:
+        async with db.begin_nested():
+            await db.execute(insert(models.Equipment.__table__), [values for _, values in batch])
+        return batch
+    except DBAPIError:
+        pass
+
+    inserted = []
+    for index, values in batch:
+        try:
+            async with db.begin_nested():
+                await db.execute(insert(models.Equipment.__table__), [values])
+            inserted.append((index, values))
+        except DBAPIError as error:
+            errors.append({"row": index, "name": values["name"], "error": str(error.orig)})
+    return inserted
+
+
+async def import_equipment(db: AsyncSession, rows: list[dict], user: models.User) -> dict:
+    """Bulk inserts equipment rows in the test_data.json "Equipment" shape.
+
+    Locations, types, classifications and parent equipment are resolved through name to id maps
+    loaded once up front. Missing classifications of the valid rows are created, like
+    POST /equipment/create does.
+    Rows are inserted with executemany in batches of IMPORT_BATCH_SIZE, and parent equipment is set
+    in a second pass so a row may reference a parent that comes later in the file. Invalid rows are
+    reported and skipped, the rest of the file is still imported. The caller commits.
+
+    Returns:
+        dict: The number of inserted and failed rows and an error per failed row.
+    """
+    now = datetime.now()
+    errors = [] # type: list[dict]
+
+    maps = {
+        "location": await name_map(db, models.Location),
+        "type": await db.run_sync(catalogs.equipment_type.mapping),
+        "classification1": await db.run_sync(catalogs.equipment_classification1.mapping),
+        "classification2": await db.run_sync(catalogs.equipment_classification2.mapping),
+    }
+    classifications = (
+        ("classification1", "Classification 1", models.EquipmentClassification1),
+        ("classification2", "Classification 2", models.EquipmentClassification2),
+    )
+
+    valid = [] # type: list[tuple[int, dict]]
+    seen = set()
+    for index, row in enumerate(rows):
+        try:
+            values = equipment_values(row, maps, user.id, now, created=("classification1", "classification2"))
+        except ImportRowError as error:
+            errors.append({"row": index, "name": row.get("Name"), "error": str(error)})
+            continue
+        key = (values["name"], values["brand"], values["model"], values["serial_number"])
+        if key in seen:
+            errors.append({"row": index, "name": values["name"], "error": "Duplicate of an earlier row in the file."})
+            continue
+        seen.add(key)
+        valid.append((index, values))
+
+    for map_name, field, model in classifications:
+        names = {str(rows[index][field]) for index, _ in valid if rows[index].get(field)}
+        await ensure_names(db, model, names, maps[map_name])
+        for index, values in valid:
+            if rows[index].get(field):
+                values[f"{map_name}_id"] = maps[map_name][str(rows[index][field])]
+
+    inserted = []
+    for start in range(0, len(valid), IMPORT_BATCH_SIZE):
+        inserted.extend(await insert_batch(db, valid[start:start + IMPORT_BATCH_SIZE], errors))
+
+    await set_parents(db, rows, inserted, errors)
+    await add_notes(db, rows, inserted)
+
+    errors.sort(key=lambda error: error["row"])
+    logger.info(f"[SYSTEM] Imported {len(inserted)} equipment, {len(rows) - len(inserted)} rows failed.")
+    return {"inserted": len(inserted), "failed": len(rows) - len(inserted), "errors": errors}
+
+
+def unique_key(values: dict) -> dict:
+    return {"b_name": values["name"], "b_brand": values["brand"], "b_model": values["model"], "b_serial_number": values["serial_number"]}
+
+
+def by_unique_key():
+    table = models.Equipment.__table__
+    return and_(
+        table.c.name == bindparam("b_name"),
+        table.c.brand == bindparam("b_brand"),
+        table.c.model == bindparam("b_model"),
+        table.c.serial_number == bindparam("b_serial_number"),
+    )
+
+
+async def set_parents(db: AsyncSession, rows: list[dict], inserted: list[tuple[int, dict]], errors: list[dict]) -> None:
+    """Second pass, sets parent_equipment_id by parent name now that every row exists.
+
+    Rows whose parent can not be found stay imported without a parent and are reported.
+    """
+    parent_names = {str(rows[index]["Parent Equipment"]) for index, _ in inserted if rows[index].get("Parent Equipment")}
+    if not parent_names:
+        return
+
+    query = select(models.Equipment.id, models.Equipment.name).where(models.Equipment.name.in_(parent_names)).order_by(models.Equipment.id.desc())
+    parents = {name: id for id, name in await db.execute(query)} # Lowest id wins, like the first() lookup in defaultdata.
+
+    updates = []
+    for index, values in inserted:
+        parent_name = rows[index].get("Parent Equipment")
+        if not parent_name:
+            continue
+        if str(parent_name) not in parents:
+            errors.append({"row": index, "name": values["name"], "error": f"Parent Equipment '{parent_name}' does not exist, imported without a parent."})
+            continue
+        updates.append({"parent_equipment_id": parents[str(parent_name)], **unique_key(values)})
+
+    if updates:
+        statement = update(models.Equipment.__table__).where(by_unique_key()).values(parent_equipment_id=bindparam("parent_equipment_id"))
+        await db.execute(statement, updates)
+
+
+async def add_notes(db: AsyncSession, rows: list[dict], inserted: list[tuple[int, dict]]) -> None:
+    """Creates the notes of imported rows. Notes are rare, so each one is inserted on its own to get its id."""
+    updates = []
+    for index, values in inserted:
+        if not rows[index].get("Notes"):
+            continue
+        result = await db.execute(insert(models.Note.__table__).values(data=str(rows[index]["Notes"])))
+        updates.append({"note_id": result.inserted_primary_key[0], **unique_key(values)})
+
+    if updates:
+        statement = update(models.Equipment.__table__).where(by_unique_key()).values(note_id=bindparam("note_id"))
+        await db.execute(statement, updates)
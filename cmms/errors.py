@@ -1,2 +1,6 @@
 class CMMSError(Exception):
-    """Base exception for cmms."""
\ No newline at end of file
+    """Base exception for cmms."""
+
+
+class SchemaVersionError(CMMSError):
+    """Raised when the database schema version does not match the code."""
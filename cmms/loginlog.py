@@ -0,0 +1,105 @@
+"""Write-behind queue for user login events.
+
+Logins hand their UserLoginLog row to the writer and return without waiting for a commit.
+A background task inserts the queued rows with one multi-row insert per batch, once
+LOGIN_LOG_BATCH_SIZE rows are waiting or LOGIN_LOG_FLUSH_INTERVAL_SECONDS after the first
+row of a batch arrived. The queue holds at most LOGIN_LOG_MAX_PENDING rows, when it is full
+record waits for room, which slows logins down instead of growing memory without bound.
+stop writes everything still queued.
+"""
+from __future__ import annotations
+import asyncio
+import logging
+from datetime import datetime
+from sqlalchemy import insert
+from cmms import config, models
+from cmms.database import AsyncSessionLocal
+
+
+logger = logging.getLogger("backend")
+
+
+class LoginLogWriter:
+
+    def __init__(self):
+        self._queue = None # type: asyncio.Queue
+        self._task = None # type: asyncio.Task
+        self.reset()
+
+    def reset(self) -> None:
+        self.written = 0
+        self.batches = 0
+        self.failed = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def start(self) -> None:
+        """Starts the background task on the running event loop."""
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=config.LOGIN_LOG_MAX_PENDING)
+        self._task = asyncio.get_running_loop().create_task(self._run(), name="login log writer")
+
+    async def stop(self) -> None:
+        """Writes the queued rows and stops the background task."""
+        if not self.running:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+        self._queue = None
+
+    async def record(self, user_id: int, event_type: models.LoginEventType) -> None:
+        """Queues a login event. Written right away when the writer is not running, e.g. in scripts."""
+        row = {"user_id": user_id, "event_type": event_type, "event_date": datetime.now()}
+        if not self.running:
+            await self._write([row])
+            return
+        await self._queue.put(row)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            row = await self._queue.get()
+            if row is None:
+                break
+            batch = [row]
+            deadline = loop.time() + config.LOGIN_LOG_FLUSH_INTERVAL_SECONDS
+            while len(batch) < config.LOGIN_LOG_BATCH_SIZE:
+                try:
+                    row = await asyncio.wait_for(self._queue.get(), max(0, deadline - loop.time()))
+                except asyncio.TimeoutError:
+                    break
+                if row is None:
+                    stopping = True
+                    break
+                batch.append(row)
+            await self._write(batch)
+
+    async def _write(self, rows: list[dict]) -> None:
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(insert(models.UserLoginLog.__table__), rows)
+                await db.commit()
+        except Exception:
+            self.failed += len(rows)
+            logger.exception(f"[SYSTEM] Could not write {len(rows)} login log rows.")
+            return
+        self.written += len(rows)
+        self.batches += 1
+
+    def snapshot(self) -> dict:
+        return {
+            "running": self.running,
+            "pending": self._queue.qsize() if self._queue is not None else 0,
+            "max_pending": config.LOGIN_LOG_MAX_PENDING,
+            "written": self.written,
+            "batches": self.batches,
+            "failed": self.failed,
+        }
+
+
+login_log_writer = LoginLogWriter()
@@ -0,0 +1,223 @@
+from __future__ import annotations
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable
+from sqlalchemy import MetaData, Table, Column, Integer, String, DateTime, create_engine, inspect, select, func, text
+from sqlalchemy.engine import Connection, Engine
+from cmms import config, errors, models
+from cmms.search import ensure_equipment_search_index
+
+
+logger = logging.getLogger("backend")
+
+
+schema_version_metadata = MetaData()
+
+schema_version_table = Table(
+    "schema_version",
+    schema_version_metadata,
+    Column("version", Integer, primary_key=True, autoincrement=False),
+    Column("description", String(256), nullable=False),
+    Column("date_applied", DateTime, nullable=False, default=datetime.now),
+)
+
+# Held on MySQL while migrating, so two runners started at once do not apply the same step twice.
+MIGRATION_LOCK_NAME = "cmms_migrate"
+MIGRATION_LOCK_TIMEOUT_SECONDS = 300
+
+# Rows of file_data and image_data read per transaction by export_blobs.
+EXPORT_BLOBS_BATCH_SIZE = 50
+
+
+@dataclass
+class Migration:
+    """One schema step. upgrade runs inside the transaction that records the new version.
+
+    Steps must be safe to run against databases created by create_all before versioning
+    existed, so they check for what they add first.
+    """
+    version: int
+    description: str
+    upgrade: Callable[[Connection], None]
+
+
+def create_tables(connection: Connection) -> None:
+    models.DeclarativeBase.metadata.create_all(bind=connection)
+
+
+def create_equipment_search_index(connection: Connection) -> None:
+    ensure_equipment_search_index(connection)
+
+
+def fill_location_closure(connection: Connection) -> None:
+    models.Location.ensure_closure(connection)
+
+
+def add_blob_columns(connection: Connection) -> None:
+    """Adds the blob store columns to file_data and image_data and lets data be NULL.
+
+    The content stays in data until 'python -m cmms export-blobs' moves it to the blob store.
+    SQLite can not change a column to nullable in place, its databases are only used for testing
+    and are recreated instead.
+    """
+    inspector = inspect(connection)
+    for model in (models.FileData, models.ImageData):
+        table = model.__table__
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for name in ("sha256", "size", "mime_type"):
+            if name not in existing:
+                column = table.c[name]
+                column_type = column.type.compile(dialect=connection.dialect)
+                connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {name} {column_type}"))
+        indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in indexes:
+                index.create(bind=connection)
+        if connection.dialect.name == "mysql":
+            connection.execute(text(f"ALTER TABLE {table.name} MODIFY data BLOB NULL"))
+
+
+def widen_blob_size_columns(connection: Connection) -> None:
+    """Makes size a BIGINT on databases migrated to version 4 while it was an INT, which stops
+    short of ATTACHMENT_MAX_UPLOAD_BYTES. SQLite integers are 64 bit already."""
+    if connection.dialect.name != "mysql":
+        return
+    for model in (models.FileData, models.ImageData):
+        connection.execute(text(f"ALTER TABLE {model.__table__.name} MODIFY size BIGINT NULL"))
+
+
+def widen_date_modified_columns(connection: Connection) -> None:
+    """Keeps microseconds in date_modified on MySQL, see mixins.PRECISE_DATETIME."""
+    if connection.dialect.name != "mysql":
+        return
+    for table in models.DeclarativeBase.metadata.sorted_tables:
+        if "date_modified" in table.c:
+            connection.execute(text(f"ALTER TABLE {table.name} MODIFY date_modified DATETIME(6) NOT NULL"))
+
+
+MIGRATIONS = [
+    Migration(1, "Create tables", create_tables),
+    Migration(2, "Equipment FULLTEXT search index", create_equipment_search_index),
+    Migration(3, "Fill location closure table", fill_location_closure),
+    Migration(4, "Blob store columns for file and image data", add_blob_columns),
+    Migration(5, "BIGINT size of file and image data", widen_blob_size_columns),
+    Migration(6, "Microsecond date_modified", widen_date_modified_columns),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1].version
+
+
+def get_version(connection: Connection) -> int:
+    """Returns the applied schema version, 0 for an empty or unversioned database."""
+    if not inspect(connection).has_table(schema_version_table.name):
+        return 0
+    return connection.execute(select(func.max(schema_version_table.c.version))).scalar() or 0
+
+
+def create_schema() -> None:
+    """Creates the MySQL schema itself, which has to exist before the engine can connect to it."""
+    if not config.DATABASE_URL_WITH_SCHEMA.startswith("mysql"):
+        return
+    temp_engine = create_engine(config.DATABASE_URL_WITHOUT_SCHEMA)
+    with temp_engine.begin() as connection:
+        connection.execute(text(config.SCHEMA_CREATE_STATEMENT))
+    temp_engine.dispose()
+
+
+def migrate(engine: Engine) -> int:
+    """Applies every migration newer than the database's version, each in its own transaction.
+
+    Returns:
+        int: The schema version after migrating.
+    """
+    create_schema()
+    with engine.connect() as lock_connection:
+        is_mysql = engine.dialect.name == "mysql"
+        if is_mysql:
+            acquired = lock_connection.execute(text("SELECT GET_LOCK(:name, :timeout)"), {"name": MIGRATION_LOCK_NAME, "timeout": MIGRATION_LOCK_TIMEOUT_SECONDS}).scalar()
+            if not acquired:
+                raise errors.SchemaVersionError("Timed out waiting for another migration to finish.")
+        try:
+            schema_version_metadata.create_all(bind=engine)
+            with engine.connect() as connection:
+                version = get_version(connection)
+
+            for migration in MIGRATIONS:
+                if migration.version <= version:
+                    continue
+                logger.info(f"[SYSTEM] Migrating database to version {migration.version}: {migration.description}.")
+                start = time.perf_counter()
+                with engine.begin() as connection:
+                    migration.upgrade(connection)
+                    connection.execute(schema_version_table.insert().values(version=migration.version, description=migration.description))
+                logger.info(f"[SYSTEM] Version {migration.version} applied in {(time.perf_counter() - start) * 1000:.1f} ms.")
+                version = migration.version
+        finally:
+            if is_mysql:
+                lock_connection.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": MIGRATION_LOCK_NAME})
+    return version
+
+
+def export_blobs(engine: Engine, batch_size: int = EXPORT_BLOBS_BATCH_SIZE, progress: Callable[[str, int, int], None] = None) -> dict[str, tuple[int, int]]:
+    """Moves the content of file_data and image_data rows from the data column to the blob store.
+
+    Rows are read by id, batch_size at a time, and each batch is stored and committed before the
+    next is read, so memory holds one batch and an interrupted export resumes where it stopped.
+    Identical content is stored once.
+
+    Returns:
+        dict[str, tuple[int, int]]: Rows and bytes exported, by table name.
+    """
+    from cmms.blobstore import get_blob_store
+    from cmms.mixins import guess_mime_type
+
+    store = get_blob_store()
+    exported = {}
+    for model in (models.FileData, models.ImageData):
+        table = model.__table__
+        rows = size = 0
+        last_id = 0
+        while True:
+            query = (
+                select(table.c.id, table.c.filename, table.c.original_filename, table.c.mime_type, table.c.data)
+                .where(table.c.id > last_id, table.c.data.isnot(None))
+                .order_by(table.c.id)
+                .limit(batch_size)
+            )
+            with engine.begin() as connection:
+                batch = connection.execute(query).all()
+                if not batch:
+                    break
+                for id, filename, original_filename, mime_type, data in batch:
+                    sha256, data_size = store.put_bytes(data)
+                    connection.execute(
+                        table.update().where(table.c.id == id).values(
+                            sha256=sha256,
+                            size=data_size,
+                            mime_type=mime_type or guess_mime_type(original_filename or filename),
+                            data=None
+                        )
+                    )
+                    size += data_size
+            rows += len(batch)
+            last_id = batch[-1].id
+            if progress:
+                progress(table.name, rows, size)
+        exported[table.name] = (rows, size)
+    return exported
+
+
+def check_version(engine: Engine) -> None:
+    """Cheap startup check, one query against schema_version.
+
+    Raises:
+        SchemaVersionError: If the database is behind or ahead of this version of the code.
+    """
+    with engine.connect() as connection:
+        version = get_version(connection)
+    if version < SCHEMA_VERSION:
+        raise errors.SchemaVersionError(f"Database schema is at version {version}, {SCHEMA_VERSION} is required. Run 'python -m cmms migrate'.")
+    if version > SCHEMA_VERSION:
+        raise errors.SchemaVersionError(f"Database schema is at version {version}, newer than this version of cmms ({SCHEMA_VERSION}).")
@@ -1,8 +1,23 @@
 from __future__ import annotations
 import datetime
-from sqlalchemy import Column, Integer, DateTime, ForeignKey
+import mimetypes
+from typing import BinaryIO
+from sqlalchemy import BigInteger, Column, Integer, DateTime, ForeignKey, String
+from sqlalchemy.dialects import mysql
 from sqlalchemy.orm import declared_attr, relationship
-from cmms.config import *
+from cmms.config import DATETIME_FORMAT
+from cmms.blobstore import get_blob_store
+
+
+DEFAULT_MIME_TYPE = "application/octet-stream"
+
+# DATETIME(6) on MySQL, whose DATETIME keeps whole seconds. The ETags of cmms.api.etags are built
+# from date_modified and two writes in the same second would otherwise give the same tag.
+PRECISE_DATETIME = DateTime().with_variant(mysql.DATETIME(fsp=6), "mysql")
+
+
+def guess_mime_type(filename: str) -> str:
+    return mimetypes.guess_type(filename or "")[0] or DEFAULT_MIME_TYPE
 
 
 class NoteMixin:
@@ -22,6 +37,43 @@ class NoteMixin:
         return (self.note_id != None)
 
 
+class BlobMixin:
+    """Blob mixin. Adds sha256, size and mime_type columns for content kept in the blob store.
+
+    Rows written before the blob store keep their content in the data column until
+    'python -m cmms export-blobs' moves it out.
+    """
+
+    @declared_attr
+    def sha256(self) -> Column:
+        return Column(String(64), index=True) # type: str
+
+    @declared_attr
+    def size(self) -> Column:
+        # BIGINT, uploads may be larger than the 2 GiB a signed INT holds.
+        return Column(BigInteger) # type: int
+
+    @declared_attr
+    def mime_type(self) -> Column:
+        return Column(String(255)) # type: str
+
+    def store_file(self, file_path: str) -> None:
+        """Stores the file's content and sets sha256, size and mime_type."""
+        self.sha256, self.size = get_blob_store().put_path(file_path)
+        self.mime_type = guess_mime_type(file_path)
+
+    def open(self) -> BinaryIO:
+        """Opens the content for binary reading."""
+        return get_blob_store().open(self.sha256)
+
+    def download(self, file_path: str) -> None:
+        if self.sha256 is None:
+            with open(file_path, "wb") as f:
+                f.write(self.data)
+            return
+        get_blob_store().copy_to(self.sha256, file_path)
+
+
 class AuditMixin:
     """Audit mixin. Adds date_created, date_modified, created_by_user, and modified_by_user columns to the model."""
 
@@ -31,7 +83,7 @@ class AuditMixin:
     
     @declared_attr
     def date_modified(self) -> Column:
-        return Column(DateTime, nullable=False, default=datetime.datetime.now) # type: datetime.datetime
+        return Column(PRECISE_DATETIME, nullable=False, default=datetime.datetime.now) # type: datetime.datetime
     
     @declared_attr
     def modified_by_user_id(self) -> Column:
@@ -1,18 +1,20 @@
 from __future__ import annotations
 from email.policy import default
 import logging
-import bcrypt
 import os
 import base64
 from enum import Enum as PythonEnum
 from datetime import datetime
-from sqlalchemy import Column, Integer, DateTime, String, ForeignKey, Boolean, UniqueConstraint, Enum, Table, Float, BLOB
-from sqlalchemy.orm import relationship, validates, Session
-from cmms.database import DeclarativeBase, get_session
-from cmms.mixins import AuditMixin, NoteMixin
+from sqlalchemy import Column, Integer, DateTime, String, ForeignKey, Boolean, UniqueConstraint, Enum, Table, Float, BLOB, DDL, event, select, literal, true, exists
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import relationship, validates, object_session, Session, column_property, deferred
+from sqlalchemy.orm.attributes import get_history
+from sqlalchemy.sql import Select
+from cmms.database import DeclarativeBase
+from cmms.mixins import AuditMixin, NoteMixin, BlobMixin
 from cmms.enums import Priority, WorkType, MaintenancePlanRegimen, MaintenanceActivityRegimen, Impact, WOStatus
-from cmms.config import DATETIME_FORMAT, ENCODING_STR
-from cmms import errors
+from cmms.config import DATETIME_FORMAT
+from cmms import errors, passwords
 
 
 logger = logging.getLogger("backend")
@@ -25,6 +27,16 @@ class Base(DeclarativeBase):
     id = Column(Integer, primary_key=True, autoincrement=True)
 
 
+def attachment_exists(owner: type, table: Table):
+    """A deferred EXISTS over an attachment association table, for has_files and the like.
+
+    Reading it on a loaded object is one small query that does not load the attachments, list
+    queries can undefer it to get it in their own select.
+    """
+    owner_column = next(column for column in table.c if column.references(owner.__table__.c.id))
+    return column_property(exists().where(owner_column == owner.id), deferred=True)
+
+
 class Status(Base):
     __abstract__ = True
     __table_args__ = {"sqlite_autoincrement": False}
@@ -56,19 +68,16 @@ class Classification(Type_):
     name = Column(String(256), nullable=False, unique=True, index=True)
 
 
-class FileData(Base, AuditMixin, NoteMixin):
+class FileData(Base, AuditMixin, NoteMixin, BlobMixin):
     __tablename__ = "file_data"
 
     filename = Column(String(500), nullable=False, unique=True)
     original_filename = Column(String(500))
     note = Column(String(750), default="")
-    data = Column(BLOB, nullable=False)
+    # Content of rows written before the blob store, NULL once exported, see BlobMixin.
+    # Deferred, so loading attachment lists never reads it.
+    data = deferred(Column(BLOB))
 
-    def download(self, file_path: str) -> None:
-        with open(file_path, "wb") as f:
-            f.write(self.data)
-        
-    
     @staticmethod
     def create(filename: str, file_path: str, note: str=None) -> FileData:
         """Creates a new FileData obj. Note this does not save to db.
@@ -82,9 +91,6 @@ class FileData(Base, AuditMixin, NoteMixin):
             FileData: Returns obj without saving to db.
         """
         origingal_filename = os.path.basename(file_path)
-        
-        with open(file_path, "rb") as f:
-            file_data = base64.b64decode(f.read())
 
         note_obj = None
         if note:
@@ -92,26 +98,23 @@ class FileData(Base, AuditMixin, NoteMixin):
             
         file_obj = FileData(
             filename=filename,
-            origingal_filename=origingal_filename,
-            data=file_data,
+            original_filename=origingal_filename,
             note=note_obj
         )
+        file_obj.store_file(file_path)
 
         return file_obj
 
 
-class ImageData(Base, AuditMixin, NoteMixin):
+class ImageData(Base, AuditMixin, NoteMixin, BlobMixin):
     __tablename__ = "image_data"
 
     filename = Column(String(500), nullable=False, unique=True)
     original_filename = Column(String(500))
-    data = Column(BLOB, nullable=False)
+    # Content of rows written before the blob store, NULL once exported, see BlobMixin.
+    # Deferred, so loading attachment lists never reads it.
+    data = deferred(Column(BLOB))
 
-    def download(self, file_path: str) -> None:
-        with open(file_path, "wb") as f:
-            f.write(self.data)
-        
-    
     @staticmethod
     def create(filename: str, file_path: str, note: str=None) -> ImageData:
         """Creates a new ImageData obj. Note this does not save to db.
@@ -125,9 +128,6 @@ class ImageData(Base, AuditMixin, NoteMixin):
             ImageData: Returns obj without saving to db.
         """
         origingal_filename = os.path.basename(file_path)
-        
-        with open(file_path, "rb") as f:
-            file_data = base64.b64decode(f.read())
 
         note_obj = None
         if note:
@@ -135,10 +135,10 @@ class ImageData(Base, AuditMixin, NoteMixin):
 
         file_obj = ImageData(
             filename=filename,
-            origingal_filename=origingal_filename,
-            data=file_data,
+            original_filename=origingal_filename,
             note=note_obj
         )
+        file_obj.store_file(file_path)
 
         return file_obj
 
@@ -219,13 +219,13 @@ class User(Base, AuditMixin):
     
     @staticmethod
     def verify_password(password_hash: str, password: str) -> bool:
-        """Check if password matches the one provided."""
-        return bcrypt.checkpw(password.encode(ENCODING_STR), password_hash.encode(ENCODING_STR))
+        """Check if password matches the one provided. Async code should use cmms.passwords.verify_password_async."""
+        return passwords.verify_password(password_hash, password)
     
     @staticmethod
     def generate_password_hash(password: str) -> str:
-        """Generate a hashed password."""
-        return bcrypt.hashpw(password.encode(ENCODING_STR), bcrypt.gensalt()).decode(ENCODING_STR)
+        """Generate a hashed password. Async code should use cmms.passwords.hash_password_async."""
+        return passwords.hash_password(password)
 
 
 class LoginEventType(PythonEnum):
@@ -364,9 +364,12 @@ class MaintenancePlan(Base, AuditMixin, NoteMixin):
     def __str__(self) -> str:
         return self.name
 
-    @property
-    def has_files(self) -> bool:
-        return (self.files > 0)
+    @staticmethod
+    def subtree_ids(plan_ids: list[int]) -> Select:
+        """Select of the ids of the given plans and every plan below them, as one recursive CTE."""
+        tree = select(MaintenancePlan.id).where(MaintenancePlan.id.in_(plan_ids)).cte("plan_tree", recursive=True)
+        tree = tree.union_all(select(MaintenancePlan.id).where(MaintenancePlan.parent_plan_id == tree.c.id))
+        return select(tree.c.id)
 
     @property
     def is_parent(self) -> bool:
@@ -398,6 +401,9 @@ class MaintenancePlan(Base, AuditMixin, NoteMixin):
         self.modified_by_user = user
 
 
+MaintenancePlan.has_files = attachment_exists(MaintenancePlan, maintenanceplantofile_table)
+
+
 maintenanceactivitytofile_table = Table(
     "maintenance_activity_to_file",
     DeclarativeBase.metadata,
@@ -445,14 +451,6 @@ class MaintenanceActivity(Base, AuditMixin, NoteMixin):
     files = relationship("FileData", secondary=maintenanceactivitytofile_table) # type: list[FileData]
     images = relationship("ImageData", secondary=maintenanceactivitytoimage_table) # type: list[ImageData]
     
-    @property
-    def has_files(self) -> bool:
-        return (self.files > 0)
-    
-    @property
-    def has_images(self) -> bool:
-        return (self.images > 0)
-    
     @validates("shutdown_duration_days")
     def validates_shutdown_duration_days(self, key: str, value: int) -> int:
         if not value: return value
@@ -517,6 +515,10 @@ class MaintenanceActivity(Base, AuditMixin, NoteMixin):
         self.modified_by_user = user
     
 
+MaintenanceActivity.has_files = attachment_exists(MaintenanceActivity, maintenanceactivitytofile_table)
+MaintenanceActivity.has_images = attachment_exists(MaintenanceActivity, maintenanceactivitytoimage_table)
+
+
 equipmenttofile_table = Table(
     "equipment_to_file",
     DeclarativeBase.metadata,
@@ -569,14 +571,6 @@ class Equipment(Base, AuditMixin, NoteMixin):
     def has_maintenance_plan(self) -> bool:
         """Returns True if equipment has a maintenance plan."""
         return self.maintenance_plan_id != None
-    
-    @property
-    def has_files(self) -> bool:
-        return self.files > 0
-    
-    @property
-    def has_images(self) -> bool:
-        return self.images > 0
 
     def add_file(self, file_data: FileData, user: User) -> None:
         """Adds a file obj."""
@@ -647,6 +641,17 @@ class Equipment(Base, AuditMixin, NoteMixin):
         self.classification2 = None
 
 
+# FULLTEXT index used by cmms.search on MySQL. Other databases fall back to an in-process search.
+equipment_search_index = DDL(
+    "CREATE FULLTEXT INDEX ix_equipment_search ON equipment (name, brand, model, serial_number, code)"
+).execute_if(dialect="mysql")
+event.listen(Equipment.__table__, "after_create", equipment_search_index)
+
+
+Equipment.has_files = attachment_exists(Equipment, equipmenttofile_table)
+Equipment.has_images = attachment_exists(Equipment, equipmenttoimage_table)
+
+
 locationtofile_table = Table(
     "location_to_file",
     DeclarativeBase.metadata,
@@ -663,8 +668,22 @@ locationtoimage_table = Table(
 )
 
 
+locationclosure_table = Table(
+    "location_closure",
+    DeclarativeBase.metadata,
+    Column("ancestor_id", ForeignKey("location.id", ondelete="CASCADE"), primary_key=True),
+    Column("descendant_id", ForeignKey("location.id", ondelete="CASCADE"), primary_key=True, index=True),
+    Column("depth", Integer, nullable=False),
+)
+
+
 class Location(Base, AuditMixin, NoteMixin):
-    """Represents a location."""
+    """Represents a location.
+
+    Besides the parent_location_id adjacency list every location has a row per ancestor
+    (and one for itself at depth 0) in location_closure. The rows are kept in sync by the
+    mapper events below, so subtree and ancestor lookups are single indexed queries.
+    """
     __tablename__ = "location"
 
     name = Column(String(256), nullable=False, index=True, unique=True)
@@ -677,28 +696,17 @@ class Location(Base, AuditMixin, NoteMixin):
     images = relationship("ImageData", secondary=locationtoimage_table) # type: list[ImageData]
 
     @staticmethod
-    def root() -> Location:
+    def root(session: Session) -> Location:
         """Returns the root location."""
-        db = get_session()
-        location = db.query(Location).filter(Location.name == "Root").first()
-        db.expunge(location)
-        return location
+        return session.query(Location).filter(Location.name == "Root").first()
 
-    @property
-    def has_files(self) -> bool:
-        return (self.files > 0)
-    
-    @property
-    def has_images(self) -> bool:
-        return (self.images > 0)
-    
     @property
     def is_parent(self) -> bool:
         """Returns True if this is the parent location."""
         return self.parent_location_id == None
     
     def add_child(self, child: Location, user: User) -> None:
-        root_location = Location.root()
+        root_location = Location.root(object_session(self))
         if self.id == root_location.id:
             # TODO: Change exception.
             raise errors.CMMSError("Can not add root location to child locations.")
@@ -715,11 +723,11 @@ class Location(Base, AuditMixin, NoteMixin):
         self.modified_by_user = user
     
     def delete(self, session: Session, user: User) -> None:
-        root_location = Location.root()
+        root_location = Location.root(session)
         if self.id == root_location.id:
             # TODO: Change exception.
             raise errors.CMMSError("Can not delete root location.")
-        for child in self.children:
+        for child in list(self.children):
             self.remove_child(child, user)
         
         session.delete(self)
@@ -749,6 +757,128 @@ class Location(Base, AuditMixin, NoteMixin):
         self.images.remove(image_data)
         self.modified_by_user = user
 
+    @staticmethod
+    def descendants_query(location_id: int, include_self: bool = False) -> Select:
+        """Select of every location below location_id, closest first."""
+        query = select(Location).join(locationclosure_table, locationclosure_table.c.descendant_id == Location.id)
+        query = query.where(locationclosure_table.c.ancestor_id == location_id)
+        if not include_self:
+            query = query.where(locationclosure_table.c.depth > 0)
+        return query.order_by(locationclosure_table.c.depth, Location.id)
+
+    @staticmethod
+    def ancestors_query(location_id: int) -> Select:
+        """Select of every location above location_id, closest first."""
+        query = select(Location).join(locationclosure_table, locationclosure_table.c.ancestor_id == Location.id)
+        query = query.where(locationclosure_table.c.descendant_id == location_id, locationclosure_table.c.depth > 0)
+        return query.order_by(locationclosure_table.c.depth)
+
+    @staticmethod
+    def equipment_query(location_id: int, query: Select = None) -> Select:
+        """Select of all equipment in location_id or anywhere below it.
+
+        query is the select of equipment to filter, select(Equipment) when not given.
+        """
+        query = select(Equipment) if query is None else query
+        query = query.join(locationclosure_table, locationclosure_table.c.descendant_id == Equipment.location_id)
+        return query.where(locationclosure_table.c.ancestor_id == location_id)
+
+    @staticmethod
+    def rebuild_closure(connection: Connection) -> None:
+        """Rebuilds location_closure from parent_location_id, one statement per tree level."""
+        connection.execute(locationclosure_table.delete())
+        connection.execute(
+            locationclosure_table.insert().from_select(
+                ["ancestor_id", "descendant_id", "depth"],
+                select(Location.id, Location.id, literal(0))
+            )
+        )
+        depth = 0
+        while True:
+            result = connection.execute(
+                locationclosure_table.insert().from_select(
+                    ["ancestor_id", "descendant_id", "depth"],
+                    select(locationclosure_table.c.ancestor_id, Location.id, locationclosure_table.c.depth + 1)
+                    .join(Location, Location.parent_location_id == locationclosure_table.c.descendant_id)
+                    .where(locationclosure_table.c.depth == depth)
+                )
+            )
+            if result.rowcount == 0:
+                break
+            depth += 1
+
+    @staticmethod
+    def ensure_closure(connection: Connection) -> None:
+        """Builds location_closure for databases created before it existed."""
+        if connection.execute(select(locationclosure_table.c.ancestor_id).limit(1)).first():
+            return
+        if not connection.execute(select(Location.id).limit(1)).first():
+            return
+        logger.info("[SYSTEM] Building location closure table.")
+        Location.rebuild_closure(connection)
+
+
+@event.listens_for(Location, "after_insert")
+def location_after_insert(mapper, connection: Connection, target: Location) -> None:
+    """Adds a path from the new location to itself and to every ancestor of its parent."""
+    if target.parent_location_id is not None:
+        connection.execute(
+            locationclosure_table.insert().from_select(
+                ["ancestor_id", "descendant_id", "depth"],
+                select(locationclosure_table.c.ancestor_id, literal(target.id), locationclosure_table.c.depth + 1)
+                .where(locationclosure_table.c.descendant_id == target.parent_location_id)
+            )
+        )
+    connection.execute(locationclosure_table.insert().values(ancestor_id=target.id, descendant_id=target.id, depth=0))
+
+
+@event.listens_for(Location, "after_update")
+def location_after_update(mapper, connection: Connection, target: Location) -> None:
+    """Moves the paths of the whole subtree when a location gets a new parent."""
+    if not get_history(target, "parent_location_id").has_changes():
+        return
+
+    subtree = [row.descendant_id for row in connection.execute(
+        select(locationclosure_table.c.descendant_id).where(locationclosure_table.c.ancestor_id == target.id)
+    )]
+    if target.parent_location_id in subtree:
+        raise errors.CMMSError(f"Can not move location {target.id} below one of its own children.")
+
+    # The subtree ids are fetched first because MySQL can not select from the table a DELETE targets.
+    connection.execute(
+        locationclosure_table.delete().where(
+            locationclosure_table.c.descendant_id.in_(subtree),
+            locationclosure_table.c.ancestor_id.notin_(subtree)
+        )
+    )
+    if target.parent_location_id is None:
+        return
+
+    parent_paths = locationclosure_table.alias("parent_paths")
+    subtree_paths = locationclosure_table.alias("subtree_paths")
+    connection.execute(
+        locationclosure_table.insert().from_select(
+            ["ancestor_id", "descendant_id", "depth"],
+            select(parent_paths.c.ancestor_id, subtree_paths.c.descendant_id, parent_paths.c.depth + subtree_paths.c.depth + 1)
+            .select_from(parent_paths).join(subtree_paths, true())
+            .where(parent_paths.c.descendant_id == target.parent_location_id, subtree_paths.c.ancestor_id == target.id)
+        )
+    )
+
+
+@event.listens_for(Location, "before_delete")
+def location_before_delete(mapper, connection: Connection, target: Location) -> None:
+    """Removes every path to or from a deleted location."""
+    connection.execute(
+        locationclosure_table.delete().where(
+            (locationclosure_table.c.ancestor_id == target.id) | (locationclosure_table.c.descendant_id == target.id)
+        )
+    )
+
+
+Location.has_files = attachment_exists(Location, locationtofile_table)
+Location.has_images = attachment_exists(Location, locationtoimage_table)
+
 
 nonroutinejobtofile_table = Table(
     "nonroutine_job_to_file",
@@ -877,6 +1007,11 @@ class NonRoutineJob(Base, AuditMixin):
         self.modified_by_user = user
 
 
+NonRoutineJob.has_files = attachment_exists(NonRoutineJob, nonroutinejobtofile_table)
+NonRoutineJob.has_before_images = attachment_exists(NonRoutineJob, nonroutinejobtoimage_before_table)
+NonRoutineJob.has_after_images = attachment_exists(NonRoutineJob, nonroutinejobtoimage_after_table)
+
+
 workordertoequipment_table = Table(
     "work_order_to_equipment",
     DeclarativeBase.metadata,
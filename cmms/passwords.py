@@ -0,0 +1,63 @@
+"""bcrypt password hashing.
+
+bcrypt takes tens of milliseconds per call by design. The async helpers run it on a bounded
+thread pool (bcrypt releases the GIL while hashing), so logins do not stall the event loop.
+The work factor comes from the BCRYPT_ROUNDS setting. Hashes made with another work factor
+still verify and needs_rehash tells the login route to replace them.
+"""
+from __future__ import annotations
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from cmms import config
+from cmms.config import ENCODING_STR
+
+
+_executor = None # type: ThreadPoolExecutor
+_executor_lock = threading.Lock()
+
+
+def hash_password(password: str) -> str:
+    """Hashes a password with the configured work factor. Blocks for the length of the hash."""
+    import bcrypt # Imported on first use, most processes never hash a password.
+    return bcrypt.hashpw(password.encode(ENCODING_STR), bcrypt.gensalt(config.BCRYPT_ROUNDS)).decode(ENCODING_STR)
+
+
+def verify_password(password_hash: str, password: str) -> bool:
+    """Checks a password against a hash. Blocks for the length of the hash."""
+    import bcrypt
+    return bcrypt.checkpw(password.encode(ENCODING_STR), password_hash.encode(ENCODING_STR))
+
+
+def needs_rehash(password_hash: str) -> bool:
+    """Returns True if the hash was made with another work factor than BCRYPT_ROUNDS."""
+    try:
+        rounds = int(password_hash.split("$")[2])
+    except (IndexError, ValueError):
+        return True
+    return rounds != config.BCRYPT_ROUNDS
+
+
+def executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=config.PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+        return _executor
+
+
+def shutdown() -> None:
+    """Stops the worker threads, waiting for hashes in progress."""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
+
+
+async def hash_password_async(password: str) -> str:
+    return await asyncio.get_running_loop().run_in_executor(executor(), hash_password, password)
+
+
+async def verify_password_async(password_hash: str, password: str) -> bool:
+    return await asyncio.get_running_loop().run_in_executor(executor(), verify_password, password_hash, password)
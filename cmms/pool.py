@@ -0,0 +1,156 @@
+from __future__ import annotations
+import time
+import logging
+import threading
+from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool, QueuePool
+
+
+logger = logging.getLogger("backend")
+
+
+class PoolStatistics:
+    """Live counters for a connection pool, fed by the instrumented pool class and pool events."""
+
+    WAIT_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+
+    def __init__(self, name: str):
+        self.name = name
+        self.pool = None # type: Pool
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.checkouts = 0
+            self.connects = 0
+            self.wait_timeouts = 0
+            self.pre_pings = 0
+            self.pre_ping_failures = 0
+            self.total_wait_seconds = 0.0
+            self.max_wait_seconds = 0.0
+            self.wait_histogram = [0] * (len(self.WAIT_BUCKETS_MS) + 1)
+
+    def record_wait(self, seconds: float, timed_out: bool = False) -> None:
+        """Record how long a caller waited for the pool to hand out a connection."""
+        milliseconds = seconds * 1000
+        bucket = len(self.WAIT_BUCKETS_MS)
+        for index, limit in enumerate(self.WAIT_BUCKETS_MS):
+            if milliseconds <= limit:
+                bucket = index
+                break
+
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+            self.wait_histogram[bucket] += 1
+            if timed_out:
+                self.wait_timeouts += 1
+
+    def record_connect(self) -> None:
+        with self._lock:
+            self.connects += 1
+
+    def record_pre_ping(self, failed: bool) -> None:
+        with self._lock:
+            self.pre_pings += 1
+            if failed:
+                self.pre_ping_failures += 1
+
+    def snapshot(self) -> dict:
+        """Returns the current counters together with the pool's own gauges."""
+        labels = [f"<={limit}" for limit in self.WAIT_BUCKETS_MS] + [f">{self.WAIT_BUCKETS_MS[-1]}"]
+        with self._lock:
+            data = {
+                "name": self.name,
+                "checkouts": self.checkouts,
+                "connects": self.connects,
+                "wait_timeouts": self.wait_timeouts,
+                "pre_pings": self.pre_pings,
+                "pre_ping_failures": self.pre_ping_failures,
+                "total_wait_seconds": self.total_wait_seconds,
+                "max_wait_seconds": self.max_wait_seconds,
+                "wait_histogram_ms": dict(zip(labels, self.wait_histogram)),
+            }
+
+        pool = self.pool
+        data["size"] = pool.size() if isinstance(pool, QueuePool) else 0
+        data["checked_in"] = pool.checkedin() if isinstance(pool, QueuePool) else 0
+        data["checked_out"] = pool.checkedout() if isinstance(pool, QueuePool) else 0
+        data["overflow"] = pool.overflow() if isinstance(pool, QueuePool) else 0
+        return data
+
+
+def instrumented_pool_class(base: type, statistics: PoolStatistics) -> type:
+    """Returns a subclass of a queue pool that times every wait for a connection.
+
+    The subclass is created per engine so the statistics survive engine.dispose(),
+    which rebuilds the pool from its class.
+    """
+
+    class InstrumentedPool(base):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            statistics.pool = self
+
+        def _do_get(self):
+            start = time.perf_counter()
+            try:
+                connection = super()._do_get()
+            except exc.TimeoutError:
+                statistics.record_wait(time.perf_counter() - start, timed_out=True)
+                raise
+            statistics.record_wait(time.perf_counter() - start)
+            return connection
+
+    InstrumentedPool.__name__ = f"Instrumented{base.__name__}"
+    return InstrumentedPool
+
+
+def instrument_engine(engine: Engine, statistics: PoolStatistics, pre_ping: str, pre_ping_interval: int) -> None:
+    """Attach connect and pre ping listeners to an engine's pool.
+
+    Args:
+        engine (Engine): Sync engine, use AsyncEngine.sync_engine for async engines.
+        statistics (PoolStatistics): Where counters are recorded.
+        pre_ping (str): "always", "interval" or "never".
+        pre_ping_interval (int): Seconds a connection may sit idle before it is pinged in "interval" mode.
+    """
+    if pre_ping not in ("always", "interval", "never"):
+        logger.warning(f"[DATABASE] Unknown pre ping strategy '{pre_ping}', using 'interval'.")
+        pre_ping = "interval"
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        statistics.record_connect()
+        connection_record.info["checked_in_at"] = time.monotonic()
+
+    @event.listens_for(engine, "checkin")
+    def on_checkin(dbapi_connection, connection_record):
+        connection_record.info["checked_in_at"] = time.monotonic()
+
+    if pre_ping == "never":
+        return
+
+    @event.listens_for(engine, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        if pre_ping == "interval":
+            idle = time.monotonic() - connection_record.info.get("checked_in_at", 0)
+            if idle < pre_ping_interval:
+                return
+
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute("SELECT 1")
+        except Exception as error:
+            statistics.record_pre_ping(failed=True)
+            # The pool discards this connection and retries the checkout with a fresh one.
+            raise exc.DisconnectionError() from error
+        finally:
+            try:
+                cursor.close()
+            except Exception:
+                pass
+        statistics.record_pre_ping(failed=False)
@@ -0,0 +1,127 @@
+from __future__ import annotations
+import re
+import heapq
+import logging
+from collections import Counter, defaultdict
+from sqlalchemy import select, inspect, func
+from sqlalchemy.engine import Connection
+from sqlalchemy.dialects.mysql import match
+from sqlalchemy.ext.asyncio import AsyncSession
+from cmms import models
+
+
+logger = logging.getLogger("backend")
+
+
+EQUIPMENT_SEARCH_INDEX = "ix_equipment_search"
+EQUIPMENT_SEARCH_COLUMNS = (
+    models.Equipment.name,
+    models.Equipment.brand,
+    models.Equipment.model,
+    models.Equipment.serial_number,
+    models.Equipment.code,
+)
+
+# Minimum share of the query's trigrams a row must contain to be returned by the fallback search.
+TRIGRAM_MIN_SCORE = 0.5
+
+
+def ensure_equipment_search_index(connection: Connection) -> None:
+    """Creates the FULLTEXT index on databases where the equipment table already existed."""
+    if connection.dialect.name != "mysql":
+        return
+    indexes = inspect(connection).get_indexes(models.Equipment.__tablename__)
+    if any(index["name"] == EQUIPMENT_SEARCH_INDEX for index in indexes):
+        return
+    logger.info("[SYSTEM] Creating equipment search index.")
+    models.equipment_search_index(models.Equipment.__table__, connection)
+
+
+def search_terms(text: str) -> list[str]:
+    """Splits user input into words, dropping characters that have a meaning in MySQL boolean mode."""
+    return [term for term in re.split(r"\W+", text.lower()) if term]
+
+
+def trigrams(text: str) -> set[str]:
+    """Returns the trigrams of each word, padded like PostgreSQL's pg_trgm."""
+    result = set()
+    for word in search_terms(text):
+        padded = f"  {word} "
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+async def search_equipment(db: AsyncSession, text: str, limit: int) -> list[tuple[models.Equipment, float]]:
+    """Ranked equipment search across name, brand, model, serial number and code.
+
+    MySQL uses the FULLTEXT index in boolean mode. Every word must match and is
+    matched as a prefix, so partial input from the tablets still finds rows.
+    Other databases, like SQLite in test runs, use an in-process trigram match instead.
+
+    Returns:
+        list[tuple[Equipment, float]]: Equipment with its relevance score, best match first.
+    """
+    terms = search_terms(text)
+    if not terms:
+        return []
+
+    if db.bind.dialect.name == "mysql":
+        score = match(*EQUIPMENT_SEARCH_COLUMNS, against=" ".join(f"+{term}*" for term in terms)).in_boolean_mode()
+        query = select(models.Equipment.id, score.label("score")).where(score > 0).order_by(score.desc(), models.Equipment.id).limit(limit)
+        ranked = [(row.id, float(row.score)) for row in await db.execute(query)]
+    else:
+        ranked = await trigram_search(db, text, limit)
+
+    if not ranked:
+        return []
+
+    query = select(models.Equipment).where(models.Equipment.id.in_([id for id, _ in ranked]))
+    equipment = {item.id: item for item in (await db.execute(query)).scalars()}
+    return [(equipment[id], score) for id, score in ranked if id in equipment]
+
+
+class TrigramIndex:
+    """In-process inverted trigram index over the equipment search columns.
+
+    Rebuilt whenever the row count, highest id or latest modification date changes,
+    which one cheap aggregate query detects.
+    """
+
+    def __init__(self):
+        self.version = None
+        self.postings = {} # type: dict[str, set[int]]
+
+    async def refresh(self, db: AsyncSession) -> None:
+        query = select(func.count(models.Equipment.id), func.max(models.Equipment.id), func.max(models.Equipment.date_modified))
+        version = tuple((await db.execute(query)).one())
+        if version == self.version:
+            return
+
+        postings = defaultdict(set)
+        for row in await db.execute(select(models.Equipment.id, *EQUIPMENT_SEARCH_COLUMNS)):
+            for trigram in trigrams(" ".join(value for value in row[1:] if value)):
+                postings[trigram].add(row.id)
+        self.postings = postings
+        self.version = version
+
+    def search(self, text: str, limit: int) -> list[tuple[int, float]]:
+        query_trigrams = trigrams(text)
+        if not query_trigrams:
+            return []
+
+        counts = Counter()
+        for trigram in query_trigrams:
+            counts.update(self.postings.get(trigram, ()))
+
+        scored = [(id, count / len(query_trigrams)) for id, count in counts.items()]
+        scored = [item for item in scored if item[1] >= TRIGRAM_MIN_SCORE]
+        return heapq.nsmallest(limit, scored, key=lambda item: (-item[1], item[0]))
+
+
+trigram_index = TrigramIndex()
+
+
+async def trigram_search(db: AsyncSession, text: str, limit: int) -> list[tuple[int, float]]:
+    """Trigram fallback for databases without a FULLTEXT index, like SQLite in test runs."""
+    await trigram_index.refresh(db)
+    return trigram_index.search(text, limit)
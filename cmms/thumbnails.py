@@ -0,0 +1,187 @@
+"""Thumbnails of image attachments.
+
+Every image gets a JPEG thumbnail per size in THUMBNAIL_SIZES, the longest side in pixels, stored
+next to the original in the blob store under the variant key <sha256>.<size>.jpg. Images smaller
+than a size get no thumbnail of that size.
+
+Decoding and resizing are CPU bound and hold the GIL, so they run on a pool of THUMBNAIL_WORKERS
+processes. The upload route queues the thumbnails of a new image and answers without waiting for
+them. Downloads ask for a thumbnail with ?pixels= and get the smallest one at least that large,
+or the original while there is none.
+
+    python -m cmms thumbnails       Builds the missing thumbnails of existing images.
+
+Needs Pillow, which is imported by the worker processes only.
+"""
+from __future__ import annotations
+import asyncio
+import io
+import logging
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Optional
+from sqlalchemy import select
+from sqlalchemy.engine import Engine
+from cmms import config, models
+from cmms.blobstore import get_blob_store, variant_key
+
+
+logger = logging.getLogger("backend")
+
+
+THUMBNAIL_MEDIA_TYPE = "image/jpeg"
+JPEG_QUALITY = 85
+
+# Rows of image_data read at a time by backfill.
+BACKFILL_BATCH_SIZE = 200
+
+
+_executor = None # type: ProcessPoolExecutor
+_executor_lock = threading.Lock()
+
+
+def thumbnail_sizes() -> tuple[int, ...]:
+    return tuple(sorted(int(size) for size in str(config.THUMBNAIL_SIZES).split(",") if size.strip()))
+
+
+def thumbnail_key(sha256: str, size: int) -> str:
+    return variant_key(sha256, f"{size}.jpg")
+
+
+def find_thumbnail(sha256: str, size: int) -> Optional[str]:
+    """Returns the key of the smallest stored thumbnail at least size pixels large, None when there is none."""
+    store = get_blob_store()
+    for thumbnail_size in thumbnail_sizes():
+        if thumbnail_size >= size and store.exists(thumbnail_key(sha256, thumbnail_size)):
+            return thumbnail_key(sha256, thumbnail_size)
+    return None
+
+
+def build_thumbnails(sha256: str, sizes: tuple[int, ...]) -> int:
+    """Builds the missing thumbnails of a stored image. Runs in a worker process.
+
+    Each size is resized from the next larger thumbnail, not the original, and JPEGs are decoded
+    at a reduced scale when the largest size allows it.
+
+    Returns:
+        int: Bytes of thumbnails written.
+    """
+    from PIL import Image, ImageOps
+
+    store = get_blob_store()
+    missing = [size for size in sizes if not store.exists(thumbnail_key(sha256, size))]
+    if not missing:
+        return 0
+    written = 0
+    with store.open(sha256) as f, Image.open(f) as original:
+        original.draft("RGB", (max(missing), max(missing)))
+        image = ImageOps.exif_transpose(original)
+        if image.mode in ("RGBA", "LA", "P"):
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, "white")
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+
+        for size in sorted(missing, reverse=True):
+            if max(image.size) <= size:
+                continue
+            image = image.copy()
+            image.thumbnail((size, size), Image.LANCZOS)
+            buffer = io.BytesIO()
+            image.save(buffer, "JPEG", quality=JPEG_QUALITY, optimize=True)
+            store.put_variant(sha256, f"{size}.jpg", buffer.getvalue())
+            written += buffer.tell()
+    return written
+
+
+def executor() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=config.THUMBNAIL_WORKERS)
+        return _executor
+
+
+def shutdown() -> None:
+    """Stops the worker processes, waiting for thumbnails in progress."""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
+
+
+def log_failure(sha256: str, future: Future) -> None:
+    if not future.cancelled() and future.exception() is not None:
+        logger.warning(f"[SYSTEM] Could not build the thumbnails of {sha256}: {future.exception()!r}")
+
+
+def queue_thumbnails(sha256: str) -> None:
+    """Builds the thumbnails of an image in the background. Failures are logged, the image is
+    then downloaded full size."""
+    future = asyncio.get_running_loop().run_in_executor(executor(), build_thumbnails, sha256, thumbnail_sizes())
+    future.add_done_callback(lambda future: log_failure(sha256, future))
+
+
+@dataclass
+class BackfillResult:
+    images: int = 0
+    failed: int = 0
+    read_bytes: int = 0
+    written_bytes: int = 0
+    seconds: float = 0.0
+
+    @property
+    def images_per_second(self) -> float:
+        return self.images / self.seconds if self.seconds else 0.0
+
+    @property
+    def read_megabytes_per_second(self) -> float:
+        return self.read_bytes / 1024 / 1024 / self.seconds if self.seconds else 0.0
+
+
+def backfill(engine: Engine, batch_size: int = BACKFILL_BATCH_SIZE, progress: Callable[[BackfillResult], None] = None) -> BackfillResult:
+    """Builds the missing thumbnails of every image in the blob store, a batch of distinct
+    images at a time spread over the worker processes.
+
+    Images whose content has not been exported from the database yet are skipped.
+    """
+    table = models.ImageData.__table__
+    sizes = thumbnail_sizes()
+    result = BackfillResult()
+    start = time.perf_counter()
+    last_sha256 = ""
+    while True:
+        query = (
+            select(table.c.sha256, table.c.size)
+            .where(table.c.sha256.isnot(None), table.c.sha256 > last_sha256)
+            .group_by(table.c.sha256, table.c.size)
+            .order_by(table.c.sha256)
+            .limit(batch_size)
+        )
+        with engine.connect() as connection:
+            batch = connection.execute(query).all()
+        if not batch:
+            break
+        futures = [(sha256, size, executor().submit(build_thumbnails, sha256, sizes)) for sha256, size in batch]
+        for sha256, size, future in futures:
+            try:
+                written = future.result()
+            except Exception as error:
+                result.failed += 1
+                logger.warning(f"[SYSTEM] Could not build the thumbnails of {sha256}: {error!r}")
+                continue
+            result.images += 1
+            if written:
+                result.read_bytes += size or 0
+                result.written_bytes += written
+        last_sha256 = batch[-1].sha256
+        result.seconds = time.perf_counter() - start
+        if progress:
+            progress(result)
+    result.seconds = time.perf_counter() - start
+    return result
@@ -0,0 +1,140 @@
+"""Bounded LRU cache of the users the API authenticates.
+
+The login manager resolves the token's username to a User on every authenticated request.
+The cache keeps the column values of recently seen users, keyed by username, and hands out a
+new detached User built from them on each hit, so requests never share an instance.
+
+Entries expire after USER_CACHE_TTL_SECONDS. Users changed or deleted through any session of
+this process are dropped when that session commits, changes made by another process are seen
+once the entry expires.
+
+A user read from the database is stored with the generation taken before the read. Every
+invalidation bumps the generation, so a read that raced with a commit does not cache the old row:
+
+    generation = user_cache.generation
+    user = ...
+    user_cache.put(user, generation)
+"""
+from __future__ import annotations
+import time
+import threading
+from collections import OrderedDict
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value, get_history
+from sqlalchemy.orm.session import make_transient_to_detached
+from cmms import config, models
+
+
+class UserCache:
+    """Username to User column values, least recently used entries are evicted first."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # type: OrderedDict[str, tuple[float, dict]]
+        # Bumped by invalidate, so a read that raced with a write does not store a stale user.
+        self.generation = 0
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.expirations = 0
+            self.evictions = 0
+            self.invalidations = 0
+            self.stale_puts = 0
+
+    def get(self, username: str) -> models.User:
+        """Returns a detached copy of the cached user, None if it is not cached or expired."""
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is None:
+                self.misses += 1
+                return None
+            loaded_at, values = entry
+            if time.monotonic() - loaded_at > config.USER_CACHE_TTL_SECONDS:
+                del self._entries[username]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(username)
+            self.hits += 1
+        return detached_user(values)
+
+    def put(self, user: models.User, generation: int = None) -> None:
+        """Stores the user's column values, unless generation is given and an invalidation happened since."""
+        values = {attribute.key: getattr(user, attribute.key) for attribute in models.User.__mapper__.column_attrs}
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                self.stale_puts += 1
+                return
+            self._entries[user.username] = (time.monotonic(), values)
+            self._entries.move_to_end(user.username)
+            while len(self._entries) > config.USER_CACHE_SIZE:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, usernames=None) -> None:
+        """Drops the given usernames, every entry when usernames is None."""
+        with self._lock:
+            self.generation += 1
+            if usernames is None:
+                self.invalidations += len(self._entries)
+                self._entries.clear()
+                return
+            for username in usernames:
+                if self._entries.pop(username, None) is not None:
+                    self.invalidations += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": config.USER_CACHE_SIZE,
+                "ttl_seconds": config.USER_CACHE_TTL_SECONDS,
+                "hits": self.hits,
+                "misses": self.misses,
+                "expirations": self.expirations,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "stale_puts": self.stale_puts,
+            }
+
+
+def detached_user(values: dict) -> models.User:
+    """Builds a User in the detached state without running its constructor."""
+    user = models.User.__mapper__.class_manager.new_instance()
+    for key, value in values.items():
+        set_committed_value(user, key, value)
+    make_transient_to_detached(user)
+    return user
+
+
+user_cache = UserCache()
+
+
+# Usernames changed by a session are collected on flush and dropped once the session commits,
+# so a request that reads the user between the flush and the commit cannot cache the old row.
+PENDING_KEY = "user_cache_invalidate"
+
+
+@event.listens_for(Session, "after_flush")
+def collect_changed_users(session: Session, flush_context) -> None:
+    for obj in [*session.dirty, *session.deleted]:
+        if not isinstance(obj, models.User):
+            continue
+        history = get_history(obj, "username")
+        session.info.setdefault(PENDING_KEY, set()).update(username for username in [*history.unchanged, *history.deleted, *history.added] if username)
+
+
+@event.listens_for(Session, "after_commit")
+def invalidate_changed_users(session: Session) -> None:
+    usernames = session.info.pop(PENDING_KEY, None)
+    if usernames:
+        user_cache.invalidate(usernames)
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_changed_users(session: Session) -> None:
+    session.info.pop(PENDING_KEY, None)
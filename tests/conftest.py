@@ -0,0 +1,67 @@
+"""Test fixtures.
+
+The settings are pointed at a SQLite database and a blob store in a temporary folder before
+anything imports cmms.database, so the tests never touch the configured MySQL database:
+
+    pip install -r requirements-dev.txt
+    python -m pytest tests
+"""
+import os
+import shutil
+import tempfile
+import pytest
+
+os.environ["CMMS_SETTINGS_BACKENDS"] = "env"
+
+from cmms import config
+
+TEMP_FOLDER = tempfile.mkdtemp(prefix="cmms-tests-")
+DATABASE_FILE = os.path.join(TEMP_FOLDER, "cmms.db")
+
+# check_same_thread: the test client runs the app in another thread than the tests.
+config.DATABASE_URL_WITH_SCHEMA = f"sqlite:///{DATABASE_FILE}?check_same_thread=false"
+config.DATABASE_URL_WITHOUT_SCHEMA = config.DATABASE_URL_WITH_SCHEMA
+config.ASYNC_DATABASE_URL_WITH_SCHEMA = f"sqlite+aiosqlite:///{DATABASE_FILE}"
+config.SCHEMA_CREATE_STATEMENT = "SELECT 1"
+config.BLOB_STORE_FOLDER = os.path.join(TEMP_FOLDER, "Blobs")
+config.MIGRATE_ON_STARTUP = True
+config.BCRYPT_ROUNDS = 4
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(TEMP_FOLDER, ignore_errors=True)
+
+
+@pytest.fixture(scope="session")
+def engine():
+    """The sync engine of a migrated database with the default data."""
+    from cmms.database import engine
+    from cmms.defaultdata import load_default_data
+    from cmms.migrations import migrate
+
+    migrate(engine)
+    load_default_data()
+    return engine
+
+
+@pytest.fixture
+def session(engine):
+    from cmms.database import SessionLocal
+
+    with SessionLocal() as session:
+        yield session
+
+
+@pytest.fixture(scope="session")
+def client(engine):
+    from fastapi.testclient import TestClient
+    from cmms.api import app
+
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture(scope="session")
+def auth_headers(client):
+    token = client.post("/auth/token", data={"username": "admin", "password": "admin"}).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
@@ -0,0 +1,44 @@
+"""Attachment lists load metadata only, has_files and has_images answer from EXISTS."""
+import os
+from uuid import uuid4
+from sqlalchemy import inspect, select
+from sqlalchemy.orm import undefer
+from cmms import models
+from cmms.database import SessionLocal
+
+
+def test_attachment_relationships_do_not_load_data(session):
+    location = models.Location(name=f"Attachments {uuid4().hex}")
+    location.files.append(models.FileData(filename=uuid4().hex, original_filename="a.pdf", data=os.urandom(32)))
+    location.images.append(models.ImageData(filename=uuid4().hex, original_filename="a.png", data=os.urandom(32)))
+    session.add(location)
+    session.commit()
+
+    with SessionLocal() as other:
+        loaded = other.get(models.Location, location.id)
+        attachments = [*loaded.files, *loaded.images]
+        assert len(attachments) == 2
+        assert all("data" in inspect(attachment).unloaded for attachment in attachments)
+        assert all(attachment.original_filename for attachment in attachments)
+        # Reading data on purpose still works.
+        assert len(loaded.files[0].data) == 32
+
+
+def test_has_files_and_has_images(session):
+    with_files = models.Location(name=f"With files {uuid4().hex}")
+    with_files.files.append(models.FileData(filename=uuid4().hex, original_filename="a.pdf", data=b"pdf"))
+    without = models.Location(name=f"Without {uuid4().hex}")
+    session.add_all([with_files, without])
+    session.commit()
+
+    with SessionLocal() as other:
+        loaded = other.get(models.Location, with_files.id)
+        assert "has_files" in inspect(loaded).unloaded
+        assert loaded.has_files is True
+        assert loaded.has_images is False
+        assert other.get(models.Location, without.id).has_files is False
+
+    with SessionLocal() as other:
+        query = select(models.Location).where(models.Location.id.in_([with_files.id, without.id])).options(undefer(models.Location.has_files))
+        has_files = {location.id: location.has_files for location in other.execute(query).scalars()}
+        assert has_files == {with_files.id: True, without.id: False}
@@ -0,0 +1,111 @@
+import os
+import time
+from datetime import datetime, timedelta
+from uuid import uuid4
+from cmms import models
+from cmms.attachmentgc import collect
+from cmms.blobstore import get_blob_store
+
+
+GRACE_PERIOD = timedelta(hours=1)
+LONG_AGO = datetime.now() - timedelta(days=2)
+
+
+def stored(data: bytes, old: bool = True) -> str:
+    store = get_blob_store()
+    sha256, _ = store.put_bytes(data)
+    if old:
+        os.utime(store.local_path(sha256), (time.time() - 2 * 24 * 3600,) * 2)
+    return sha256
+
+
+def attachment(model, data: bytes, date_created: datetime = LONG_AGO, **values):
+    sha256 = stored(data, old=date_created == LONG_AGO)
+    return model(filename=uuid4().hex, original_filename="a.bin", sha256=sha256, size=len(data), date_created=date_created, **values)
+
+
+def test_collect(session):
+    store = get_blob_store()
+    location = models.Location(name=f"GC {uuid4().hex}")
+    shared = os.urandom(64)
+    orphan_sharing = attachment(models.FileData, shared)
+    attached_sharing = attachment(models.ImageData, shared)
+    location.images.append(attached_sharing)
+    orphan = attachment(models.FileData, os.urandom(64))
+    orphan_with_note = attachment(models.ImageData, os.urandom(64), note=models.Note(data="before"))
+    recent_orphan = attachment(models.FileData, os.urandom(64), date_created=datetime.now())
+    session.add_all([location, orphan_sharing, orphan, orphan_with_note, recent_orphan])
+    session.commit()
+    note_id = orphan_with_note.note_id
+    rows = {"orphan_sharing": orphan_sharing, "attached_sharing": attached_sharing, "orphan": orphan, "orphan_with_note": orphan_with_note, "recent_orphan": recent_orphan}
+    ids = {name: row.id for name, row in rows.items()}
+    hashes = {name: row.sha256 for name, row in rows.items()}
+    stray = stored(os.urandom(64))
+    recent_stray = stored(os.urandom(64), old=False)
+
+    dry_run = collect(session.bind, GRACE_PERIOD, pause=0, dry_run=True)
+    assert sum(result.rows for result in dry_run) >= 3
+    assert session.get(models.FileData, ids["orphan"]) is not None
+    assert store.exists(stray)
+
+    collect(session.bind, GRACE_PERIOD, batch_size=2, pause=0)
+    session.expire_all()
+
+    assert session.get(models.FileData, ids["orphan_sharing"]) is None
+    assert session.get(models.FileData, ids["orphan"]) is None
+    assert session.get(models.ImageData, ids["orphan_with_note"]) is None
+    assert session.get(models.Note, note_id) is None
+    assert not store.exists(hashes["orphan"])
+    assert not store.exists(hashes["orphan_with_note"])
+    assert not store.exists(stray)
+
+    # A hash another row still has keeps its blob, rows and blobs in the grace period are kept.
+    assert session.get(models.ImageData, ids["attached_sharing"]) is not None
+    assert store.read(hashes["attached_sharing"]) == shared
+    assert session.get(models.FileData, ids["recent_orphan"]) is not None
+    assert store.exists(hashes["recent_orphan"])
+    assert store.exists(recent_stray)
+
+
+def test_blob_attached_after_the_store_check_is_kept(session):
+    """A row inserted between collect_store's batch check and the delete keeps its blob."""
+    from cmms.attachmentgc import CollectResult, delete_blobs
+
+    store = get_blob_store()
+    sha256 = stored(os.urandom(64))
+    # The row arrives after the batch found no row with the hash.
+    session.add(models.FileData(filename=uuid4().hex, original_filename="a.bin", sha256=sha256, size=64))
+    session.commit()
+    result = CollectResult("blob store")
+    delete_blobs(session.bind, store, {sha256}, time.time() - GRACE_PERIOD.total_seconds(), result)
+
+    assert store.exists(sha256)
+    assert result.blobs == 0
+
+
+def test_collect_deletes_old_temp_files(session):
+    store = get_blob_store()
+    sha256 = stored(os.urandom(64))
+    blob_folder = os.path.dirname(store.local_path(sha256))
+    old_temp_files = [
+        os.path.join(store.backend.staging_folder(), f".upload-{uuid4().hex}"),
+        os.path.join(blob_folder, f".upload-{uuid4().hex}"),
+    ]
+    recent_temp_file = os.path.join(store.backend.staging_folder(), f".upload-{uuid4().hex}")
+    for path in [*old_temp_files, recent_temp_file]:
+        with open(path, "wb") as f:
+            f.write(b"partial")
+    for path in old_temp_files:
+        os.utime(path, (time.time() - 2 * 24 * 3600,) * 2)
+
+    dry_run = collect(session.bind, GRACE_PERIOD, pause=0, dry_run=True)[-1]
+    assert dry_run.temp_files >= 2
+    assert all(os.path.exists(path) for path in old_temp_files)
+
+    result = collect(session.bind, GRACE_PERIOD, pause=0)[-1]
+
+    assert result.temp_files >= 2
+    assert result.temp_bytes >= 2 * len(b"partial")
+    assert not any(os.path.exists(path) for path in old_temp_files)
+    assert os.path.exists(recent_temp_file)
+    os.unlink(recent_temp_file)
@@ -0,0 +1,96 @@
+import os
+import pytest
+from fastapi import HTTPException
+from cmms import config, models
+from cmms.api.attachments import parse_range
+
+
+SIZE = 1000
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("", None),
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-", (100, 999)),
+    ("bytes=-10", (990, 999)),
+    ("bytes=-5000", (0, 999)),
+    ("bytes=900-5000", (900, 999)),
+    ("bytes=999-999", (999, 999)),
+    # Not a single byte range, the whole content is sent.
+    ("bytes=-", None),
+    ("bytes=0-1,5-9", None),
+    ("items=0-9", None),
+    ("bytes=20-10", None),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, SIZE) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=5000-6000"])
+def test_range_past_the_end_is_not_satisfiable(header):
+    with pytest.raises(HTTPException) as error:
+        parse_range(header, SIZE)
+    assert error.value.status_code == 416
+    assert error.value.headers["Content-Range"] == f"bytes */{SIZE}"
+
+
+def test_suffix_range_of_empty_content_is_not_satisfiable():
+    with pytest.raises(HTTPException) as error:
+        parse_range("bytes=-10", 0)
+    assert error.value.status_code == 416
+
+
+@pytest.fixture(scope="module")
+def location_id(client, auth_headers):
+    return client.post("/location/create", json={"name": f"Attachments {os.getpid()}"}, headers=auth_headers).json()["id"]
+
+
+def test_upload_and_ranged_download(client, auth_headers, location_id):
+    data = os.urandom(300 * 1024)
+    response = client.post(f"/attachment/location/{location_id}/files", files={"file": ("manual.pdf", data, "application/octet-stream")}, data={"note": "rev 2"}, headers=auth_headers)
+    assert response.status_code == 201
+    attachment = response.json()
+    assert (attachment["size"], attachment["mime_type"], attachment["original_filename"]) == (len(data), "application/pdf", "manual.pdf")
+
+    download = client.get(f"/attachment/file/{attachment['id']}")
+    assert download.content == data
+    assert download.headers["etag"] == f'"{attachment["sha256"]}"'
+
+    partial = client.get(f"/attachment/file/{attachment['id']}", headers={"Range": "bytes=-100", "If-Range": download.headers["etag"]})
+    assert partial.status_code == 206
+    assert partial.content == data[-100:]
+    assert partial.headers["content-range"] == f"bytes {len(data) - 100}-{len(data) - 1}/{len(data)}"
+
+    stale = client.get(f"/attachment/file/{attachment['id']}", headers={"Range": "bytes=-100", "If-Range": '"older"'})
+    assert stale.status_code == 200
+    assert len(stale.content) == len(data)
+
+
+def test_upload_past_the_limit_is_refused(client, auth_headers, location_id, monkeypatch):
+    monkeypatch.setattr(config, "ATTACHMENT_MAX_UPLOAD_BYTES", 1024)
+    response = client.post(f"/attachment/location/{location_id}/files", files={"file": ("big.bin", os.urandom(2048))}, headers=auth_headers)
+    assert response.status_code == 413
+
+
+def test_upload_to_a_missing_owner_is_refused(client, auth_headers):
+    response = client.post("/attachment/location/999999/files", files={"file": ("x.txt", b"x")}, headers=auth_headers)
+    assert response.status_code == 404
+
+
+def test_unexported_content_is_streamed_from_the_column(client, session, monkeypatch):
+    monkeypatch.setattr("cmms.api.attachments.COLUMN_CHUNK_SIZE", 1000)
+    data = os.urandom(5555)
+    file_data = models.FileData(filename=f"{os.urandom(8).hex()}.bin", original_filename="old.bin", data=data)
+    session.add(file_data)
+    session.commit()
+
+    download = client.get(f"/attachment/file/{file_data.id}")
+    assert download.status_code == 200
+    assert download.content == data
+    assert "etag" not in download.headers
+
+    partial = client.get(f"/attachment/file/{file_data.id}", headers={"Range": "bytes=999-3100"})
+    assert partial.status_code == 206
+    assert partial.content == data[999:3101]
+    assert client.get(f"/attachment/file/{file_data.id}", headers={"Range": "bytes=6000-"}).status_code == 416
@@ -0,0 +1,38 @@
+"""The audit users of a response are read with one query, whatever number of users wrote the rows."""
+from uuid import uuid4
+from cmms import models
+from tests.test_maintenance_plan_queries import count_queries
+
+
+def locations_by_distinct_users(session, count: int) -> str:
+    """Adds count locations, each created and modified by users of its own, and returns their common name prefix."""
+    prefix = f"Audit {uuid4().hex}"
+    for index in range(count):
+        creator, modifier = (models.User(username=f"{prefix} {index} {role}", first_name="Audit", last_name=role, password_hash="x") for role in ("creator", "modifier"))
+        session.add(models.Location(name=f"{prefix} {index}", created_by_user=creator, modified_by_user=modifier))
+    session.commit()
+    return prefix
+
+
+def queries_to_list(client, prefix: str) -> tuple[int, dict]:
+    with count_queries() as count:
+        response = client.get("/location/", params={"name": prefix})
+    assert response.status_code == 200
+    return count[0], response.json()
+
+
+def test_list_runs_the_same_queries_whatever_the_number_of_users(client, session):
+    few = locations_by_distinct_users(session, 2)
+    many = locations_by_distinct_users(session, 12)
+    # Fills the process caches first.
+    queries_to_list(client, f"Warm up {uuid4().hex}")
+
+    few_queries, few_body = queries_to_list(client, few)
+    many_queries, many_body = queries_to_list(client, many)
+
+    assert len(few_body["items"]) == 2
+    assert len(many_body["items"]) == 12
+    assert many_queries == few_queries
+    for item in many_body["items"]:
+        assert item["created_by_user"]["username"] == f"{item['name']} creator"
+        assert item["modified_by_user"]["username"] == f"{item['name']} modifier"
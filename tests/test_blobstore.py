@@ -0,0 +1,104 @@
+import hashlib
+import io
+import os
+import pytest
+from cmms.blobstore import BlobStore, BlobTooLargeError, FileSystemBackend, is_key, variant_key
+
+
+@pytest.fixture
+def store(tmp_path):
+    return BlobStore(FileSystemBackend(str(tmp_path)))
+
+
+def test_content_is_stored_under_its_hash(store, tmp_path):
+    data = b"manual " * 1000
+    sha256, size = store.put_bytes(data)
+    assert sha256 == hashlib.sha256(data).hexdigest()
+    assert size == len(data)
+    assert os.path.isfile(os.path.join(tmp_path, sha256[:2], sha256[2:4], sha256))
+    assert store.read(sha256) == data
+    assert store.size(sha256) == len(data)
+
+
+def test_put_file_reads_in_chunks_and_matches_put_bytes(store, monkeypatch):
+    monkeypatch.setattr("cmms.blobstore.CHUNK_SIZE", 7)
+    data = os.urandom(100)
+    assert store.put_file(io.BytesIO(data)) == store.put_bytes(data)
+    assert store.read(hashlib.sha256(data).hexdigest()) == data
+
+
+def test_same_content_is_stored_once(store, tmp_path):
+    first = store.put_bytes(b"same")
+    second = store.put_file(io.BytesIO(b"same"))
+    assert first == second
+    assert list(store.keys()) == [first[0]]
+    assert not os.listdir(os.path.join(tmp_path, "staging"))
+
+
+def test_storing_again_touches_the_blob(store):
+    sha256, _ = store.put_bytes(b"again")
+    os.utime(store.local_path(sha256), (0, 0))
+    store.put_bytes(b"again")
+    assert store.modified_time(sha256) > 0
+
+
+def test_delete_removes_the_variants(store):
+    sha256, _ = store.put_bytes(b"image")
+    key = store.put_variant(sha256, "160.jpg", b"thumbnail")
+    assert key == variant_key(sha256, "160.jpg")
+    assert store.read(key) == b"thumbnail"
+    assert list(store.keys()) == [sha256]
+
+    store.delete(sha256)
+    assert not store.exists(sha256)
+    assert not store.exists(key)
+    store.delete(sha256)
+
+
+def test_missing_blob_raises_file_not_found(store):
+    with pytest.raises(FileNotFoundError):
+        store.open(hashlib.sha256(b"never stored").hexdigest())
+
+
+@pytest.mark.parametrize("key, valid", [
+    ("a" * 64, True),
+    ("a" * 64 + ".160.jpg", True),
+    ("A" * 64, False),
+    ("a" * 63, False),
+    ("a" * 64 + "./../x", False),
+    ("../" + "a" * 61, False),
+])
+def test_keys_are_validated(store, key, valid):
+    assert is_key(key) is valid
+    if not valid:
+        with pytest.raises(ValueError):
+            store.exists(key)
+
+
+def test_writer_commits_what_was_written(store):
+    with store.writer() as writer:
+        writer.write(b"part one, ")
+        writer.write(b"part two")
+        sha256, size = writer.commit()
+    assert store.read(sha256) == b"part one, part two"
+    assert size == 18
+
+
+def test_writer_refuses_content_past_max_size(store, tmp_path):
+    with pytest.raises(BlobTooLargeError):
+        with store.writer(max_size=10) as writer:
+            writer.write(b"123456")
+            writer.write(b"7890")
+            writer.write(b"1")
+    assert not os.listdir(os.path.join(tmp_path, "staging"))
+    assert list(store.keys()) == []
+
+
+def test_writer_abort_removes_the_staged_file(store, tmp_path):
+    writer = store.writer()
+    writer.write(b"interrupted upload")
+    assert len(os.listdir(os.path.join(tmp_path, "staging"))) == 1
+    writer.abort()
+    writer.abort()
+    assert not os.listdir(os.path.join(tmp_path, "staging"))
+    assert list(store.keys()) == []
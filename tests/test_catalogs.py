@@ -0,0 +1,28 @@
+"""The reference catalog caches: invalidation by the routes and names added behind their back."""
+from uuid import uuid4
+from cmms import catalogs, models
+
+
+def test_renamed_type_is_seen_without_waiting_for_the_ttl(client, auth_headers, session):
+    name = f"Type {uuid4().hex}"
+    type_id = client.post("/equipment_type/create", json={"name": name, "failures": []}, headers=auth_headers).json()["id"]
+    assert catalogs.equipment_type.id_of(session, name) == type_id
+    session.commit()
+
+    new_name = f"Type {uuid4().hex}"
+    response = client.put(f"/equipment_type/{type_id}", json={"name": new_name, "failures": []}, headers=auth_headers)
+    assert response.status_code == 200
+
+    mapping = catalogs.equipment_type.mapping(session)
+    assert mapping[new_name] == type_id
+    assert name not in mapping
+
+
+def test_name_added_by_another_process_is_found(session):
+    catalogs.equipment_type.mapping(session)
+    # Written without invalidating, like the desktop program does.
+    equipment_type = models.EquipmentType(name=f"Type {uuid4().hex}")
+    session.add(equipment_type)
+    session.commit()
+
+    assert catalogs.equipment_type.ids(session, [equipment_type.name, "No such type"]) == {equipment_type.name: equipment_type.id}
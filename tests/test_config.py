@@ -0,0 +1,33 @@
+"""Choosing the settings backends when CMMS_SETTINGS_BACKENDS is not set."""
+import importlib.util
+from cmms import config
+
+
+def unconfigured(monkeypatch, tmp_path, has_pyqt):
+    for key in config.SETTINGS:
+        monkeypatch.delenv(config.ENVIRONMENT_PREFIX + key, raising=False)
+    monkeypatch.setenv(f"{config.ENVIRONMENT_PREFIX}CONFIG_FILE", str(tmp_path / "cmms.toml"))
+    find_spec = importlib.util.find_spec
+    monkeypatch.setattr(importlib.util, "find_spec", lambda name, *args: (object() if has_pyqt else None) if name == "PyQt5" else find_spec(name, *args))
+
+
+def test_qsettings_install_keeps_qsettings(monkeypatch, tmp_path):
+    unconfigured(monkeypatch, tmp_path, has_pyqt=True)
+    assert config.default_backend_names() == "env,toml,qsettings"
+
+
+def test_no_pyqt_uses_env_and_toml(monkeypatch, tmp_path):
+    unconfigured(monkeypatch, tmp_path, has_pyqt=False)
+    assert config.default_backend_names() == "env,toml"
+
+
+def test_toml_file_turns_off_qsettings(monkeypatch, tmp_path):
+    unconfigured(monkeypatch, tmp_path, has_pyqt=True)
+    (tmp_path / "cmms.toml").write_text('DATABASE_HOST = "db01"\n')
+    assert config.default_backend_names() == "env,toml"
+
+
+def test_environment_setting_turns_off_qsettings(monkeypatch, tmp_path):
+    unconfigured(monkeypatch, tmp_path, has_pyqt=True)
+    monkeypatch.setenv(f"{config.ENVIRONMENT_PREFIX}DATABASE_HOST", "db01")
+    assert config.default_backend_names() == "env,toml"
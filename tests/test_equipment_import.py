@@ -0,0 +1,89 @@
+import json
+import re
+from datetime import datetime
+import pytest
+from cmms import models
+from cmms.equipmentimport import ImportRowError, equipment_values, parse_equipment_file
+
+
+NOW = datetime(2024, 5, 1, 8, 30)
+
+MAPS = {
+    "location": {"Termination": 3},
+    "type": {"Applicator": 5},
+    "classification1": {"Production": 7},
+    "classification2": {},
+}
+
+ROW = {"Name": "Crimp Press", "Brand": "Komax", "Model": "Alpha 530", "Serial Number": "K-001"}
+
+
+def test_minimal_row_gets_defaults():
+    values = equipment_values(ROW, MAPS, user_id=2, now=NOW)
+    assert values["name"] == "Crimp Press"
+    assert values["serial_number"] == "K-001"
+    assert values["priority"] == "NA"
+    assert values["year"] is None
+    assert values["acquisition_date"] == NOW
+    assert values["location_id"] is None
+    assert values["created_by_user_id"] == values["modified_by_user_id"] == 2
+
+
+def test_names_are_resolved_through_the_maps():
+    row = {**ROW, "Location": "Termination", "Type": "Applicator", "Classification 1": "Production", "Year": "2019", "Priority": "High", "Acquisition Date": "2020-02-03"}
+    values = equipment_values(row, MAPS, user_id=2, now=NOW)
+    assert (values["location_id"], values["type_id"], values["classification1_id"]) == (3, 5, 7)
+    assert values["year"] == 2019
+    assert values["priority"] == "High"
+    assert values["acquisition_date"] == datetime(2020, 2, 3)
+
+
+@pytest.mark.parametrize("row, message", [
+    ({"Name": "Crimp Press", "Brand": "Komax"}, "Missing Model, Serial Number."),
+    ({**ROW, "Priority": "Urgent"}, "Priority 'Urgent'"),
+    ({**ROW, "Year": "nineteen"}, "Year 'nineteen'"),
+    ({**ROW, "Acquisition Date": "03/02/2020"}, "Acquisition Date '03/02/2020'"),
+    ({**ROW, "Location": "Moon"}, "Location 'Moon' does not exist."),
+    ({**ROW, "Classification 2": "New"}, "Classification 2 'New' does not exist."),
+])
+def test_invalid_rows_are_rejected(row, message):
+    with pytest.raises(ImportRowError, match=re.escape(message)):
+        equipment_values(row, MAPS, user_id=2, now=NOW)
+
+
+def test_created_maps_leave_missing_names_for_the_caller():
+    row = {**ROW, "Classification 1": "Production", "Classification 2": "New"}
+    values = equipment_values(row, MAPS, user_id=2, now=NOW, created=("classification1", "classification2"))
+    assert values["classification1_id"] == 7
+    assert values["classification2_id"] is None
+    with pytest.raises(ImportRowError):
+        equipment_values({**row, "Location": "Moon"}, MAPS, user_id=2, now=NOW, created=("classification1", "classification2"))
+
+
+def test_csv_and_json_files_give_the_same_rows():
+    csv_file = b"\xef\xbb\xbfName,Brand,Model,Serial Number,Year\nCrimp Press,Komax,Alpha 530,K-001,\n"
+    json_file = b'{"Equipment": [{"Name": "Crimp Press", "Brand": "Komax", "Model": "Alpha 530", "Serial Number": "K-001"}]}'
+    assert parse_equipment_file("equipment.csv", csv_file) == parse_equipment_file("equipment.json", json_file) == [ROW]
+
+
+def test_json_that_is_not_a_list_of_rows_is_refused():
+    with pytest.raises(ValueError):
+        parse_equipment_file("equipment.json", b'{"Equipment": ["Crimp Press"]}')
+
+
+def test_import_skips_invalid_rows_and_their_classifications(client, auth_headers, session):
+    rows = [
+        {**ROW, "Serial Number": "IMPORT-1", "Priority": "Urgent", "Classification 1": "Only on a rejected row"},
+        {**ROW, "Serial Number": "IMPORT-2", "Classification 2": "Imported classification"},
+        {**ROW, "Serial Number": "IMPORT-2"},
+    ]
+    response = client.post("/equipment/import", files={"file": ("equipment.json", json.dumps(rows))}, headers=auth_headers)
+    assert response.status_code == 200
+    result = response.json()
+    assert (result["inserted"], result["failed"]) == (1, 2)
+    assert [error["row"] for error in result["errors"]] == [0, 2]
+
+    classification1 = session.query(models.EquipmentClassification1).filter_by(name="Only on a rejected row").first()
+    assert classification1 is None
+    equipment = session.query(models.Equipment).filter_by(serial_number="IMPORT-2").one()
+    assert equipment.classification2.name == "Imported classification"
@@ -0,0 +1,62 @@
+"""Weak ETags of the GET by id routes: 304 answers and tags that follow the children."""
+from datetime import datetime
+from uuid import uuid4
+from sqlalchemy import select
+from cmms import models
+from tests.test_maintenance_plan_queries import generated_plan
+
+
+def etag_of(client, path: str) -> str:
+    response = client.get(path)
+    assert response.status_code == 200
+    return response.headers["ETag"]
+
+
+def test_matching_if_none_match_is_answered_with_304(client, auth_headers):
+    plan_id = client.post("/maintenance_plan/create", json=generated_plan(depth=2, children=2, activities=1), headers=auth_headers).json()["id"]
+    etag = etag_of(client, f"/maintenance_plan/{plan_id}")
+    assert etag.startswith('W/"')
+
+    response = client.get(f"/maintenance_plan/{plan_id}", headers={"If-None-Match": etag})
+
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert response.content == b""
+    # The strong form of the tag and a list holding it match too, a stale tag does not.
+    assert client.get(f"/maintenance_plan/{plan_id}", headers={"If-None-Match": etag.removeprefix("W/")}).status_code == 304
+    assert client.get(f"/maintenance_plan/{plan_id}", headers={"If-None-Match": f'W/"stale", {etag}'}).status_code == 304
+    assert client.get(f"/maintenance_plan/{plan_id}", headers={"If-None-Match": 'W/"stale"'}).status_code == 200
+
+
+def test_editing_a_child_activity_changes_the_plan_tag(client, auth_headers, session):
+    plan_id = client.post("/maintenance_plan/create", json=generated_plan(depth=2, children=2, activities=1), headers=auth_headers).json()["id"]
+    etag = etag_of(client, f"/maintenance_plan/{plan_id}")
+    child_ids = select(models.MaintenancePlan.id).where(models.MaintenancePlan.parent_plan_id == plan_id)
+    activity = session.execute(select(models.MaintenanceActivity).where(models.MaintenanceActivity.plan_id.in_(child_ids))).scalars().first()
+
+    activity.name = f"Renamed {uuid4().hex}"
+    activity.date_modified = datetime.now()
+    session.commit()
+
+    response = client.get(f"/maintenance_plan/{plan_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_editing_a_child_location_changes_the_parent_tag(client, auth_headers):
+    location = {"name": f"Parent {uuid4().hex}", "children": [{"name": f"Child {uuid4().hex}", "children": [{"name": f"Grandchild {uuid4().hex}"}]}]}
+    created = client.post("/location/create", json=location, headers=auth_headers).json()
+    grandchild = created["children"][0]["children"][0]
+    etag = etag_of(client, f"/location/{created['id']}")
+
+    response = client.put(f"/location/{grandchild['id']}", json={"name": f"Renamed {uuid4().hex}", "parent_location_id": created["children"][0]["id"]}, headers=auth_headers)
+    assert response.status_code == 200
+
+    response = client.get(f"/location/{created['id']}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_fields_are_part_of_the_tag(client, auth_headers):
+    plan_id = client.post("/maintenance_plan/create", json=generated_plan(depth=1, children=0, activities=1), headers=auth_headers).json()["id"]
+    assert etag_of(client, f"/maintenance_plan/{plan_id}") != etag_of(client, f"/maintenance_plan/{plan_id}?fields=id,name")
@@ -0,0 +1,49 @@
+"""?fields= and ?expand= on the read endpoints."""
+import pytest
+from tests.test_maintenance_plan_queries import generated_plan
+
+
+@pytest.fixture(scope="module")
+def plan_id(client, auth_headers):
+    return client.post("/maintenance_plan/create", json=generated_plan(depth=2, children=1, activities=1), headers=auth_headers).json()["id"]
+
+
+def test_fields_limit_the_keys(client, plan_id):
+    body = client.get(f"/maintenance_plan/{plan_id}?fields=name").json()
+    assert set(body) == {"id", "name"}
+
+
+def test_fields_apply_to_every_item_of_a_list(client, plan_id):
+    body = client.get("/maintenance_plan/?fields=id,regimen&limit=3").json()
+    assert body["items"]
+    assert all(set(item) == {"id", "regimen"} for item in body["items"])
+
+
+def test_empty_expand_embeds_nothing(client, plan_id):
+    body = client.get(f"/maintenance_plan/{plan_id}?expand=").json()
+    assert {"id", "name", "regimen", "date_created"} <= set(body)
+    assert not {"activities", "children", "created_by_user", "modified_by_user"} & set(body)
+
+
+def test_dotted_expand_embeds_the_objects_on_the_way(client, plan_id):
+    body = client.get(f"/maintenance_plan/{plan_id}?expand=activities.meter_unit").json()
+    assert not {"children", "created_by_user", "modified_by_user"} & set(body)
+    meter_activity = next(activity for activity in body["activities"] if activity["name"] == "Meter activity")
+    assert meter_activity["meter_unit"]["name"] == "Pieces"
+    assert "created_by_user" not in meter_activity
+
+
+def test_relationship_named_in_expand_but_not_in_fields_is_left_out(client, plan_id):
+    body = client.get(f"/maintenance_plan/{plan_id}?fields=name&expand=activities").json()
+    assert set(body) == {"id", "name"}
+
+
+@pytest.mark.parametrize("query, name", [
+    ("fields=name,nope", "nope"),
+    ("expand=nope", "nope"),
+    ("expand=activities.nope", "activities.nope"),
+])
+def test_unknown_names_are_rejected(client, plan_id, query, name):
+    response = client.get(f"/maintenance_plan/{plan_id}?{query}")
+    assert response.status_code == 400
+    assert name in response.json()["detail"]
@@ -0,0 +1,78 @@
+from uuid import uuid4
+import pytest
+from sqlalchemy import select
+from cmms import errors, models
+
+
+closure = models.locationclosure_table
+
+
+def make_tree(session):
+    """Plant > Hall A > Line 1 > Cell 1 and Plant > Hall B, by name."""
+    prefix = uuid4().hex[:8]
+    locations = {}
+    for name, parent in [("Plant", None), ("Hall A", "Plant"), ("Line 1", "Hall A"), ("Cell 1", "Line 1"), ("Hall B", "Plant")]:
+        location = models.Location(name=f"{prefix} {name}", parent_location_id=locations[parent].id if parent else None)
+        session.add(location)
+        session.flush()
+        locations[name] = location
+    session.commit()
+    return locations
+
+
+def names(session, query, locations):
+    by_id = {location.id: name for name, location in locations.items()}
+    return [by_id[location.id] for location in session.execute(query).scalars()]
+
+
+def paths(session, locations):
+    ids = [location.id for location in locations.values()]
+    query = select(closure.c.ancestor_id, closure.c.descendant_id, closure.c.depth).where(closure.c.descendant_id.in_(ids))
+    return sorted(session.execute(query).all())
+
+
+def test_insert_adds_a_path_to_every_ancestor(session):
+    locations = make_tree(session)
+    assert names(session, models.Location.ancestors_query(locations["Cell 1"].id), locations) == ["Line 1", "Hall A", "Plant"]
+    assert names(session, models.Location.descendants_query(locations["Plant"].id), locations) == ["Hall A", "Hall B", "Line 1", "Cell 1"]
+    assert names(session, models.Location.descendants_query(locations["Hall A"].id, include_self=True), locations) == ["Hall A", "Line 1", "Cell 1"]
+
+
+def test_moving_a_location_moves_its_subtree(session):
+    locations = make_tree(session)
+    locations["Line 1"].parent_location_id = locations["Hall B"].id
+    session.commit()
+
+    assert names(session, models.Location.ancestors_query(locations["Cell 1"].id), locations) == ["Line 1", "Hall B", "Plant"]
+    assert names(session, models.Location.descendants_query(locations["Hall A"].id), locations) == []
+    assert names(session, models.Location.descendants_query(locations["Hall B"].id), locations) == ["Line 1", "Cell 1"]
+
+
+def test_moving_a_location_below_its_own_child_is_refused(session):
+    locations = make_tree(session)
+    locations["Hall A"].parent_location_id = locations["Cell 1"].id
+    with pytest.raises(errors.CMMSError):
+        session.commit()
+    session.rollback()
+    assert names(session, models.Location.ancestors_query(locations["Cell 1"].id), locations) == ["Line 1", "Hall A", "Plant"]
+
+
+def test_delete_removes_every_path_of_the_location(session):
+    locations = make_tree(session)
+    cell_id = locations["Cell 1"].id
+    session.delete(locations["Cell 1"])
+    session.commit()
+
+    query = select(closure.c.ancestor_id).where((closure.c.ancestor_id == cell_id) | (closure.c.descendant_id == cell_id))
+    assert session.execute(query).first() is None
+
+
+def test_rebuild_matches_the_maintained_closure(session):
+    locations = make_tree(session)
+    locations["Line 1"].parent_location_id = locations["Hall B"].id
+    session.commit()
+    maintained = paths(session, locations)
+
+    models.Location.rebuild_closure(session.connection())
+    assert paths(session, locations) == maintained
+    session.rollback()
@@ -0,0 +1,72 @@
+"""Deleting a maintenance plan tree with the chunked set based statements."""
+import os
+from uuid import uuid4
+from sqlalchemy import func, select
+from cmms import models
+from cmms.api.routes import maintenanceplan
+from cmms.enums import WorkType
+from tests.test_maintenance_plan_queries import generated_plan
+
+
+def tree_ids(session, plan_id: int) -> tuple[list[int], list[int]]:
+    plan_ids = session.execute(models.MaintenancePlan.subtree_ids([plan_id])).scalars().all()
+    activity_ids = session.execute(select(models.MaintenanceActivity.id).where(models.MaintenanceActivity.plan_id.in_(plan_ids))).scalars().all()
+    return plan_ids, activity_ids
+
+
+def attach_files(session, plan_ids: list[int], activity_ids: list[int]) -> None:
+    plans = [session.get(models.MaintenancePlan, plan_id) for plan_id in plan_ids]
+    activities = [session.get(models.MaintenanceActivity, activity_id) for activity_id in activity_ids]
+    for plan in plans:
+        plan.files.append(models.FileData(filename=uuid4().hex, original_filename="plan.pdf", data=os.urandom(16)))
+    for activity in activities:
+        activity.files.append(models.FileData(filename=uuid4().hex, original_filename="activity.pdf", data=os.urandom(16)))
+        activity.images.append(models.ImageData(filename=uuid4().hex, original_filename="activity.png", data=os.urandom(16)))
+    session.commit()
+
+
+def count_rows(session, table, column, ids: list[int]) -> int:
+    return session.execute(select(func.count()).select_from(table).where(table.c[column].in_(ids))).scalar()
+
+
+def test_delete_removes_the_whole_tree(client, auth_headers, session, monkeypatch):
+    # Small chunks, so every statement runs for several of them.
+    monkeypatch.setattr(maintenanceplan, "DELETE_CHUNK_SIZE", 4)
+    plan = generated_plan(depth=3, children=2, activities=2)
+    plan_id = client.post("/maintenance_plan/create", json=plan, headers=auth_headers).json()["id"]
+    plan_ids, activity_ids = tree_ids(session, plan_id)
+    assert len(plan_ids) == 7
+    assert len(activity_ids) == 7 * 3
+    attach_files(session, plan_ids, activity_ids)
+
+    response = client.delete(f"/maintenance_plan/{plan_id}", headers=auth_headers)
+
+    assert response.status_code == 204
+    session.expire_all()
+    assert session.execute(select(func.count()).where(models.MaintenancePlan.id.in_(plan_ids))).scalar() == 0
+    assert session.execute(select(func.count()).where(models.MaintenanceActivity.id.in_(activity_ids))).scalar() == 0
+    assert count_rows(session, models.maintenanceplantofile_table, "maintenance_plan_id", plan_ids) == 0
+    assert count_rows(session, models.maintenanceactivitytofile_table, "maintenance_activity_to_file_id", activity_ids) == 0
+    assert count_rows(session, models.maintenanceactivitytoimage_table, "maintenance_activity_to_image_id", activity_ids) == 0
+
+
+def test_delete_of_plan_used_by_a_work_order_changes_nothing(client, auth_headers, session, monkeypatch):
+    monkeypatch.setattr(maintenanceplan, "DELETE_CHUNK_SIZE", 4)
+    plan = generated_plan(depth=3, children=2, activities=2)
+    plan_id = client.post("/maintenance_plan/create", json=plan, headers=auth_headers).json()["id"]
+    plan_ids, activity_ids = tree_ids(session, plan_id)
+    attach_files(session, plan_ids, activity_ids)
+    # The last activity belongs to a grandchild plan.
+    work_order = models.WorkOrder(number=f"WO {uuid4().hex}")
+    work_order.items.append(models.WorkOrderItem(maintenance_activity_id=activity_ids[-1], activity_name="Used", work_type=WorkType.Preventive))
+    session.add(work_order)
+    session.commit()
+
+    response = client.delete(f"/maintenance_plan/{plan_id}", headers=auth_headers)
+
+    assert response.status_code == 409
+    session.expire_all()
+    assert tree_ids(session, plan_id) == (plan_ids, activity_ids)
+    assert count_rows(session, models.maintenanceplantofile_table, "maintenance_plan_id", plan_ids) == len(plan_ids)
+    assert count_rows(session, models.maintenanceactivitytofile_table, "maintenance_activity_to_file_id", activity_ids) == len(activity_ids)
+    assert count_rows(session, models.maintenanceactivitytoimage_table, "maintenance_activity_to_image_id", activity_ids) == len(activity_ids)
@@ -0,0 +1,69 @@
+import json
+import os
+from contextlib import contextmanager
+from uuid import uuid4
+from sqlalchemy import event
+from cmms.database import async_engine
+
+
+ALPHA530 = os.path.join(os.path.dirname(os.path.dirname(__file__)), "alpha530.json")
+
+
+@contextmanager
+def count_queries():
+    count = [0]
+
+    def before_cursor_execute(connection, cursor, statement, *args):
+        # Login events are written in the background, see cmms.loginlog.
+        if not statement.startswith("INSERT INTO user_login"):
+            count[0] += 1
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield count
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+
+
+def generated_plan(depth: int, children: int, activities: int) -> dict:
+    """A plan tree with children plans per plan down to depth, every plan with some activities
+    done by date and one by meter reading, like alpha530."""
+    plan = {
+        "name": f"Generated {uuid4().hex}",
+        "regimen": "Mixed",
+        "activities": [{"name": f"Activity {index}", "date_regimen": "month(s)", "date_frequency": 3} for index in range(activities)],
+        "children": [],
+    }
+    plan["activities"].append({"name": "Meter activity", "meter_unit_name": "Pieces", "meter_frequency": 75000})
+    if depth > 1:
+        plan["children"] = [generated_plan(depth - 1, children, activities) for _ in range(children)]
+    return plan
+
+
+def tree_size(plan: dict) -> int:
+    return 1 + sum(tree_size(child) for child in plan["children"] or [])
+
+
+def queries_to_get(client, plan_id: int) -> tuple[int, dict]:
+    # The first request fills the process caches, like the user and catalog caches.
+    assert client.get(f"/maintenance_plan/{plan_id}").status_code == 200
+    with count_queries() as count:
+        response = client.get(f"/maintenance_plan/{plan_id}")
+    assert response.status_code == 200
+    return count[0], response.json()
+
+
+def test_get_plan_runs_the_same_queries_whatever_the_tree_size(client, auth_headers):
+    with open(ALPHA530) as f:
+        alpha530 = json.load(f)
+    large = generated_plan(depth=4, children=4, activities=3)
+
+    alpha530_id = client.post("/maintenance_plan/create", json=alpha530, headers=auth_headers).json()["id"]
+    large_id = client.post("/maintenance_plan/create", json=large, headers=auth_headers).json()["id"]
+
+    alpha530_queries, alpha530_body = queries_to_get(client, alpha530_id)
+    large_queries, large_body = queries_to_get(client, large_id)
+
+    assert tree_size(large_body) == tree_size(large) == 85
+    assert tree_size(large_body) > 2 * tree_size(alpha530_body)
+    assert large_queries == alpha530_queries
@@ -0,0 +1,44 @@
+import base64
+import pytest
+from fastapi import HTTPException
+from cmms.config import MAX_PAGE_LIMIT
+from cmms.api.pagination import encode_cursor, decode_cursor
+
+
+@pytest.mark.parametrize("last_id", [0, 1, 7, 123456789])
+def test_cursor_round_trip(last_id):
+    cursor = encode_cursor(last_id)
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == last_id
+
+
+@pytest.mark.parametrize("cursor", [
+    "not a cursor!",
+    base64.urlsafe_b64encode(b"[1]").decode(),
+    base64.urlsafe_b64encode(b'{"after": 1}').decode(),
+    base64.urlsafe_b64encode(b'{"id": "x"}').decode(),
+])
+def test_invalid_cursor_is_a_bad_request(cursor):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(cursor)
+    assert error.value.status_code == 400
+
+
+def test_pages_cover_every_item_once(client):
+    everything = client.get("/equipment_failure/", params={"limit": MAX_PAGE_LIMIT}).json()
+    assert everything["next_cursor"] is None
+
+    ids, cursor = [], None
+    while True:
+        params = {"limit": 3, **({"after": cursor} if cursor else {})}
+        page = client.get("/equipment_failure/", params=params).json()
+        ids.extend(item["id"] for item in page["items"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert ids == [item["id"] for item in everything["items"]]
+    assert len(ids) > 3
+
+
+def test_invalid_cursor_is_rejected_by_the_api(client):
+    assert client.get("/equipment_failure/", params={"after": "nope"}).status_code == 400
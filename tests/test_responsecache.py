@@ -0,0 +1,77 @@
+"""The response cache: tag invalidation racing with a render, and LRU eviction by size."""
+from fastapi import Response
+from starlette.requests import Request
+from cmms import config
+from cmms.api.responsecache import ResponseCache
+
+
+def make_request(path, query=""):
+    return Request({"type": "http", "method": "GET", "path": path, "query_string": query.encode(), "headers": []})
+
+
+def test_put_after_invalidate_is_not_stored():
+    cache = ResponseCache()
+    request = make_request("/equipment_type/")
+    assert cache.get(request) is None
+    # A write commits and invalidates while the request renders what it read before.
+    cache.invalidate("equipment_type")
+    rendered = cache.put(request, Response(), {"items": ["old"]}, tags=("equipment_type",))
+
+    assert rendered.body == b'{"items":["old"]}'
+    assert cache.get(make_request("/equipment_type/")) is None
+    assert cache.stale_puts == 1
+
+
+def test_put_after_invalidating_everything_is_not_stored():
+    cache = ResponseCache()
+    request = make_request("/location/")
+    assert cache.get(request) is None
+    cache.invalidate()
+    cache.put(request, Response(), {"items": []}, tags=("location",))
+
+    assert cache.get(make_request("/location/")) is None
+
+
+def test_put_after_other_tag_invalidated_is_stored():
+    cache = ResponseCache()
+    request = make_request("/equipment_type/")
+    assert cache.get(request) is None
+    cache.invalidate("location")
+    cache.put(request, Response(), {"items": []}, tags=("equipment_type",))
+
+    cached = cache.get(make_request("/equipment_type/"))
+    assert cached is not None
+    assert cached.body == b'{"items":[]}'
+
+
+def test_least_recently_used_entry_is_evicted(monkeypatch):
+    cache = ResponseCache()
+    body_size = len(b'{"items":"aaaaaaaaaa"}')
+    monkeypatch.setattr(config, "RESPONSE_CACHE_MAX_BYTES", body_size * 2)
+    for name in ("a", "b"):
+        request = make_request(f"/{name}/")
+        cache.get(request)
+        cache.put(request, Response(), {"items": name * 10}, tags=(name,))
+    # Reading a makes b the least recently used.
+    assert cache.get(make_request("/a/")) is not None
+    request = make_request("/c/")
+    cache.get(request)
+    cache.put(request, Response(), {"items": "c" * 10}, tags=("c",))
+
+    assert cache.get(make_request("/b/")) is None
+    assert cache.get(make_request("/a/")) is not None
+    assert cache.get(make_request("/c/")) is not None
+    assert cache.evictions == 1
+    assert cache.size_bytes == body_size * 2
+
+
+def test_body_over_the_cap_is_not_stored(monkeypatch):
+    cache = ResponseCache()
+    monkeypatch.setattr(config, "RESPONSE_CACHE_MAX_BYTES", 8)
+    request = make_request("/large/")
+    cache.get(request)
+    rendered = cache.put(request, Response(), {"items": "x" * 100}, tags=("large",))
+
+    assert len(rendered.body) > 8
+    assert cache.get(make_request("/large/")) is None
+    assert cache.size_bytes == 0
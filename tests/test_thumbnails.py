@@ -0,0 +1,77 @@
+"""Thumbnails: the sizes build_thumbnails writes and the ?pixels= choice of the download route."""
+import io
+from uuid import uuid4
+import pytest
+from PIL import Image
+from cmms import models, thumbnails
+from cmms.blobstore import get_blob_store
+
+SIZES = (160, 480, 1280)
+
+
+def stored_image(width: int, height: int) -> str:
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), (uuid4().int % 256, 120, 40)).save(buffer, "PNG")
+    sha256, _ = get_blob_store().put_bytes(buffer.getvalue())
+    return sha256
+
+
+def thumbnail_size(sha256: str, size: int) -> tuple[int, int]:
+    with Image.open(io.BytesIO(get_blob_store().read(thumbnails.thumbnail_key(sha256, size)))) as image:
+        assert image.format == "JPEG"
+        return image.size
+
+
+def test_build_thumbnails_writes_the_sizes_smaller_than_the_image():
+    store = get_blob_store()
+    sha256 = stored_image(1000, 600)
+
+    assert thumbnails.build_thumbnails(sha256, SIZES) > 0
+
+    assert thumbnail_size(sha256, 160) == (160, 96)
+    assert thumbnail_size(sha256, 480) == (480, 288)
+    assert not store.exists(thumbnails.thumbnail_key(sha256, 1280))
+    # Thumbnails that exist are not built again.
+    assert thumbnails.build_thumbnails(sha256, SIZES) == 0
+
+
+@pytest.fixture
+def image_id(session):
+    sha256 = stored_image(1000, 600)
+    image = models.ImageData(filename=f"{uuid4().hex}.png", original_filename="photo.png", sha256=sha256, size=get_blob_store().size(sha256), mime_type="image/png")
+    session.add(image)
+    session.commit()
+    return image.id
+
+
+def test_pixels_falls_back_to_the_original_without_thumbnails(client, image_id):
+    response = client.get(f"/attachment/image/{image_id}", params={"pixels": 100})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/png"
+
+
+def test_pixels_picks_the_smallest_large_enough_thumbnail(client, session, image_id):
+    sha256 = session.get(models.ImageData, image_id).sha256
+    thumbnails.build_thumbnails(sha256, thumbnails.thumbnail_sizes())
+
+    response = client.get(f"/attachment/image/{image_id}", params={"pixels": 200})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == thumbnails.THUMBNAIL_MEDIA_TYPE
+    assert response.headers["content-disposition"] == "attachment; filename*=utf-8''photo.jpg"
+    with Image.open(io.BytesIO(response.content)) as image:
+        assert image.size == (480, 288)
+
+    # Larger than every thumbnail, the original is sent.
+    response = client.get(f"/attachment/image/{image_id}", params={"pixels": 2000})
+    assert response.headers["content-type"] == "image/png"
+    assert response.headers["content-disposition"] == "attachment; filename*=utf-8''photo.png"
+    assert response.content == get_blob_store().read(sha256)
+
+
+def test_blob_missing_from_the_store_is_404(client, session, image_id):
+    sha256 = session.get(models.ImageData, image_id).sha256
+    get_blob_store().delete(sha256)
+
+    response = client.get(f"/attachment/image/{image_id}")
+    assert response.status_code == 404
+    assert "missing from the blob store" in response.json()["detail"]
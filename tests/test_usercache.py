@@ -0,0 +1,49 @@
+"""The user cache: reads that race with a commit, and changes reaching the next request."""
+from uuid import uuid4
+from cmms import models
+from cmms.passwords import hash_password
+from cmms.usercache import UserCache, user_cache
+
+
+def make_user(username):
+    return models.User(username=username, first_name="Test", last_name="User", password_hash="x", active=True)
+
+
+def test_put_after_invalidate_is_not_stored():
+    cache = UserCache()
+    username = f"user-{uuid4().hex[:8]}"
+    generation = cache.generation
+    # A commit changes the user while the loader reads the old row.
+    cache.invalidate([username])
+    cache.put(make_user(username), generation)
+
+    assert cache.get(username) is None
+    assert cache.stale_puts == 1
+
+
+def test_put_without_invalidation_is_stored():
+    cache = UserCache()
+    username = f"user-{uuid4().hex[:8]}"
+    generation = cache.generation
+    cache.put(make_user(username), generation)
+
+    assert cache.get(username).username == username
+
+
+def test_deactivation_takes_effect_on_next_request(client, session):
+    username = f"user-{uuid4().hex[:8]}"
+    user = models.User(username=username, first_name="Test", last_name="User", password_hash=hash_password("secret"))
+    session.add(user)
+    session.commit()
+    token = client.post("/auth/token", data={"username": username, "password": "secret"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    # Authenticated, the row does not exist.
+    assert client.delete("/cause_of_equipment_failure/0", headers=headers).status_code == 404
+    assert user_cache.get(username) is not None
+
+    user.active = False
+    session.commit()
+
+    assert user_cache.get(username) is None
+    assert client.delete("/cause_of_equipment_failure/0", headers=headers).status_code == 401